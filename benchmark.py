@@ -0,0 +1,344 @@
+# Author: Gitee Volkath@amazoncloud
+# Program: PyWebPlayback benchmark suite
+# Repository: https://gitee.com/amazoncloud/py-web-playback.git
+#
+# Replays traffic mixes against main.py with the fake audio backend and the
+# recording key injector, so it runs anywhere. Usage:
+#
+#   python benchmark.py                      # run and compare with the baseline
+#   python benchmark.py --save-baseline      # run and store the baseline
+#   python benchmark.py --transport http --scenario slider_drag
+#   python benchmark.py --nodes 12 --scenario controller   # controller mode against 12 local nodes
+
+import argparse
+import atexit
+import http.client
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from os import path
+
+DEFAULT_BASELINE = path.join(path.dirname(path.abspath(__file__)), 'benchmark_baseline.json')
+
+def load_main(overrides):
+    # Fake backends, and logs in a scratch directory; the user's config file is
+    # neither read nor written
+    sys.path.insert(0, path.dirname(path.abspath(__file__)))
+    import main
+    # Every simulated client shares 127.0.0.1, so the limiter gets limits it
+    # never reaches: the runs measure its overhead, not its rejections
+    main.create_app({'audio_backend': 'fake', 'key_injector': 'recording', 'nowplaying_provider': 'fake',
+                     'rate_limit': {'rate': 10 ** 9, 'burst': 10 ** 9, 'max_concurrent': 10 ** 6,
+                                    'max_per_client': 10 ** 6},
+                     **overrides},
+                    log_dir=tempfile.mkdtemp(prefix='pywebplayback-bench-'))
+    # Keep the console quiet; the log files still see everything
+    main.default_handler.setLevel(logging.WARNING)
+    return main
+
+def load_app(nodes=None):
+    return load_main({'controller': {'nodes': nodes or {}}}).app
+
+def serve_node(port):
+    # Runs one fake node for controller benchmarks until killed
+    main = load_main({'baseport': port, 'listenaddress': '127.0.0.1'})
+    main.run_server()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_nodes(count, timeout=15.0):
+    # Starts count fake nodes as separate processes; returns {name: url}
+    nodes = {}
+    for i in range(count):
+        port = free_port()
+        process = subprocess.Popen([sys.executable, path.abspath(__file__), '--serve-node', str(port)],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        atexit.register(process.kill)
+        nodes[f'node{i + 1}'] = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + timeout
+    for url in nodes.values():
+        port = int(url.rsplit(':', 1)[1])
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f'Node at {url} did not start')
+                time.sleep(0.1)
+    return nodes
+
+# Scenarios are generators per simulated client: each yields (method, path, json
+# body) and receives the decoded JSON response back, so clients can keep cursors.
+def idle_dashboards(client_id):
+    # Legacy dashboards polling volume and tailing logs
+    cursor = 0
+    while True:
+        yield 'GET', '/get_volume', None
+        response = yield 'GET', f'/logs?since={cursor}', None
+        if response:
+            cursor = response.get('seq', cursor)
+
+def slider_drag(client_id):
+    # A new writer id for every pass (timed, memory, each transport): the app
+    # keeps the last seq per writer and would reject a restarted count as stale
+    client = f'bench-{client_id}-{os.urandom(4).hex()}'
+    seq = 0
+    while True:
+        for volume in list(range(0, 101, 2)) + list(range(100, -1, -2)):
+            seq += 1
+            yield 'POST', '/volume', {'volume': volume, 'seq': seq, 'client': client}
+
+def log_tail(client_id):
+    cursor = 0
+    while True:
+        # Something has to produce log lines for the tail to read
+        yield 'POST', '/playback', {'action': 'next'}
+        response = yield 'GET', f'/logs?since={cursor}', None
+        if response:
+            cursor = response.get('seq', cursor)
+
+def controls(client_id):
+    while True:
+        yield 'POST', '/playback', {'action': 'playpause'}
+        yield 'POST', '/shortcut', {'shortcut': 'alt1'}
+        yield 'POST', '/batch', {'actions': [
+            {'route': 'volume', 'volume': 30},
+            {'route': 'playback', 'action': 'next'},
+            {'route': 'shortcut', 'shortcut': 'alt2'},
+        ]}
+
+def page_load(client_id):
+    while True:
+        yield 'GET', '/', None
+
+def controller(client_id):
+    # A controller dashboard: aggregated state plus the odd fan-out command
+    volume = 0
+    while True:
+        for _ in range(4):
+            yield 'GET', '/nodes', None
+        volume = (volume + 10) % 110
+        yield 'POST', '/nodes/command', {'route': 'volume', 'data': {'volume': volume}}
+
+def mixed(client_id):
+    # Mostly idle dashboards, some sliders, the odd button press
+    kind = client_id % 10
+    if kind < 7:
+        return idle_dashboards(client_id)
+    if kind < 9:
+        return slider_drag(client_id)
+    return controls(client_id)
+
+SCENARIOS = {
+    'idle_dashboards': idle_dashboards,
+    'slider_drag': slider_drag,
+    'log_tail': log_tail,
+    'controls': controls,
+    'page_load': page_load,
+    'mixed': mixed,
+    'controller': controller,
+}
+# Only run when nodes are started
+NODE_SCENARIOS = ('controller',)
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, url, body):
+        response = self.client.open(url, method=method, json=body)
+        return response.status_code, response.data
+
+class HttpClient:
+    # One keep-alive connection per simulated client
+    def __init__(self, port):
+        self.port = port
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+
+    def request(self, method, url, body):
+        headers = {'Accept-Encoding': 'gzip'}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, url, body=data, headers=headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+            raise
+        if response.will_close:
+            self.connection.close()
+        return response.status, payload
+
+def start_http_server(app, threads):
+    # One server for the whole run; prefer the production server so numbers
+    # reflect the default deployment. Returns the port it listens on.
+    try:
+        import waitress
+    except ImportError:
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server.server_port
+    server = waitress.create_server(app, host='127.0.0.1', port=0, threads=threads)
+    threading.Thread(target=server.run, daemon=True).start()
+    return server.effective_port
+
+def run_clients(make_client, scenario, clients, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client_loop(client_id):
+        client = make_client()
+        requests = SCENARIOS[scenario](client_id)
+        mine = []
+        failed = 0
+        response = None
+        while time.perf_counter() < deadline:
+            method, url, body = requests.send(response)
+            started = time.perf_counter()
+            try:
+                status, payload = client.request(method, url, body)
+            except Exception:
+                failed += 1
+                response = None
+                continue
+            mine.append(time.perf_counter() - started)
+            if status >= 400:
+                failed += 1
+            response = None
+            if payload[:1] == b'{':
+                try:
+                    response = json.loads(payload)
+                except ValueError:
+                    pass
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return latencies, errors[0], elapsed
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def run_scenario(app, port, scenario, clients, duration):
+    if port is not None:
+        make_client = lambda: HttpClient(port)
+    else:
+        make_client = lambda: InProcessClient(app)
+    latencies, errors, elapsed = run_clients(make_client, scenario, clients, duration)
+    # Memory is measured in a separate short pass; tracing would skew the timings
+    tracemalloc.start()
+    run_clients(make_client, scenario, clients, min(duration, 1.0))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    # Returns a list of human-readable regressions
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if result['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{key}: {result['rps']} req/s vs baseline {base['rps']}")
+        if result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{key}: p99 {result['p99_ms']} ms vs baseline {base['p99_ms']}")
+        if result['peak_kib'] > base['peak_kib'] * (1 + memory_tolerance):
+            regressions.append(f"{key}: peak {result['peak_kib']} KiB vs baseline {base['peak_kib']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PyWebPlayback routes against fake backends.')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run (repeatable, default: all)')
+    parser.add_argument('--transport', choices=['inprocess', 'http', 'both'], default='both')
+    parser.add_argument('--clients', type=int, default=10, help='simulated clients per scenario')
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds per scenario')
+    parser.add_argument('--threads', type=int, default=32, help='server worker threads for http runs')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    parser.add_argument('--memory-tolerance', type=float, default=0.5,
+                        help='allowed relative growth of peak memory, which is noisier')
+    parser.add_argument('--nodes', type=int, default=0,
+                        help='start this many fake nodes for the controller scenario')
+    parser.add_argument('--serve-node', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_node:
+        serve_node(args.serve_node)
+        return 0
+
+    app = load_app(start_nodes(args.nodes) if args.nodes else None)
+    transports = ['inprocess', 'http'] if args.transport == 'both' else [args.transport]
+    scenarios = args.scenario or [name for name in SCENARIOS if args.nodes or name not in NODE_SCENARIOS]
+
+    results = {}
+    print(f"{'run':<28} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'peak KiB':>9} {'errors':>7}")
+    for transport in transports:
+        port = start_http_server(app, args.threads) if transport == 'http' else None
+        for scenario in scenarios:
+            key = f'{transport}/{scenario}'
+            if scenario in NODE_SCENARIOS:
+                key += f'@{args.nodes}'
+            result = run_scenario(app, port, scenario, args.clients, args.duration)
+            results[key] = result
+            print(f"{key:<28} {result['rps']:>10} {result['p50_ms']:>9} {result['p99_ms']:>9} "
+                  f"{result['peak_kib']:>9} {result['errors']:>7}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+
+    if not path.exists(args.baseline):
+        print('No baseline to compare with; run with --save-baseline first')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if not regressions:
+        print('No regressions against the baseline')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
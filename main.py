@@ -2,686 +2,4390 @@
 # Program: PyWebPlayback ver 1.0.1 Build 2024.12.29
 # Repository: https://gitee.com/amazoncloud/py-web-playback.git
 
-from flask import Flask, request, jsonify, render_template_string
+import time
+import_started = time.perf_counter()
+
+from flask import Blueprint, Flask, Response, request, jsonify, abort, has_request_context
+from flask.logging import default_handler
+from werkzeug.wsgi import ClosingIterator
+import atexit
 import ctypes
-from ctypes import cast, POINTER
-from comtypes import CLSCTX_ALL
-from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
-import pythoncom
-import win32api
-import win32con
-import webbrowser
+import functools
+import http.client
+import itertools
+import math
+import os
 from os import _exit as quit_completely, makedirs, path
 import threading
-import time
 import json
 from os.path import expanduser
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler
 import queue
+import sys
+import gzip
+import hashlib
+import ipaddress
+import struct
+from datetime import datetime
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+from urllib.parse import urlsplit
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Importing this module only defines things. create_app() loads the config,
+# opens the logs, starts the backends and sets the module state below.
+app = None
+routes = Blueprint('pywebplayback', __name__)
+
+# Metrics in Prometheus text format. Recording writes to a per-thread shard
+# without locking; shards are only summed when /metrics is scraped.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class ThreadShards:
+    def __init__(self, size):
+        self.size = size
+        self.local = threading.local()
+        self.shards = []
+        self.retired = [0] * size
+        self.lock = threading.Lock()
+
+    def new_shard(self):
+        shard = self.local.shard = [0] * self.size
+        with self.lock:
+            self.shards.append((threading.current_thread(), shard))
+        return shard
+
+    def totals(self):
+        with self.lock:
+            totals = list(self.retired)
+            alive = []
+            for thread, shard in self.shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    # Threads that have exited never write again; fold them away
+                    for i, value in enumerate(shard):
+                        self.retired[i] += value
+                for i, value in enumerate(shard):
+                    totals[i] += value
+            self.shards = alive
+        return totals
+
+class Counter(ThreadShards):
+    # Also used for gauges: per-thread increments and decrements sum correctly
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self.new_shard()
+        shard[0] += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def value(self):
+        return self.totals()[0]
+
+class Histogram(ThreadShards):
+    # Shard layout: one count per bucket, then +Inf, then the sum
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        super().__init__(len(buckets) + 2)
+        self.buckets = buckets
+
+    def observe(self, value):
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self.new_shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+class MetricFamily:
+    def __init__(self, name, kind, help, label_names, factory):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.label_names = label_names
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.factory())
+        return child
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class MetricsRegistry:
+    def __init__(self, prefix='pywebplayback_'):
+        self.prefix = prefix
+        self.families = []
+        self.callbacks = []
+
+    def counter(self, name, help, label_names=()):
+        return self._add(MetricFamily(self.prefix + name, 'counter', help, label_names, Counter))
+
+    def gauge(self, name, help, label_names=()):
+        return self._add(MetricFamily(self.prefix + name, 'gauge', help, label_names, Counter))
+
+    def histogram(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._add(MetricFamily(self.prefix + name, 'histogram', help, label_names,
+                                      lambda: Histogram(buckets)))
+
+    def callback(self, name, kind, help, read):
+        # For values owned elsewhere; read() is only called at scrape time
+        self.callbacks.append((self.prefix + name, kind, help, read))
+
+    def _add(self, family):
+        self.families.append(family)
+        return family
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            lines.append(f'# HELP {family.name} {family.help}')
+            lines.append(f'# TYPE {family.name} {family.kind}')
+            for values, child in sorted(family.children.items()):
+                if family.kind == 'histogram':
+                    totals = child.totals()
+                    cumulative = 0
+                    for bound, count in zip(child.buckets + ('+Inf',), totals):
+                        cumulative += count
+                        labels = format_labels(family.label_names, values, f'le="{bound}"')
+                        lines.append(f'{family.name}_bucket{labels} {cumulative}')
+                    labels = format_labels(family.label_names, values)
+                    lines.append(f'{family.name}_sum{labels} {totals[-1]}')
+                    lines.append(f'{family.name}_count{labels} {cumulative}')
+                else:
+                    lines.append(f'{family.name}{format_labels(family.label_names, values)} {child.value()}')
+        for name, kind, help, read in self.callbacks:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {read()}')
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+request_latency = metrics.histogram('http_request_duration_seconds', 'Time to produce a response, by route.', ('route', 'method'))
+request_count = metrics.counter('http_requests_total', 'Responses sent, by route and status code.', ('route', 'method', 'status'))
+active_requests = metrics.gauge('http_active_requests', 'Requests in flight, including open event streams.').labels()
+backend_latency = metrics.histogram('backend_call_duration_seconds', 'Time spent in audio and keyboard backend calls.', ('backend', 'call'))
+backend_errors = metrics.counter('backend_call_errors_total', 'Backend calls that raised.', ('backend', 'call'))
+
+# Set up logging. Request threads only enqueue records; a single LogListener
+# thread formats them, writes the files and handles rotation.
+default_log_dir = path.join(expanduser('~'), 'documents', 'logs')
+
+def pack_ip(address):
+    # 16-byte form used in log indexes; IPv4 is stored IPv4-mapped, unknown as zeros
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return bytes(16)
+    if ip.version == 4:
+        return b'\0' * 10 + b'\xff\xff' + ip.packed
+    return ip.packed
+
+class IndexedRotatingFileHandler(RotatingFileHandler):
+    # Writes a sidecar <file>.idx next to every log file with one fixed-size
+    # entry per record (time, byte offset, level, client IP). Index files rotate
+    # together with their logs, so any backup can be searched by seeking.
+    # Offsets and the rollover size come from a byte counter instead of
+    # seek/tell, which would flush the text stream on every record; flushing is
+    # left to the LogListener, which flushes once per batch.
+    INDEX_ENTRY = struct.Struct('<dQB16s')
+    SEARCH_CHUNK = 256
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, encoding='utf-8', **kwargs)
+        self.rotation_lock = threading.Lock()
+        self.rollovers = 0
+        self.size = path.getsize(self.baseFilename) if path.exists(self.baseFilename) else 0
+        self.index = open(self.baseFilename + '.idx', 'ab')
+
+    def emit(self, record):
+        try:
+            message = self.format(record) + self.terminator
+            # What the text stream will put on disk, newline translation included
+            length = len(message.replace('\n', os.linesep).encode(self.encoding, self.errors or 'strict'))
+            if self.maxBytes > 0 and self.size > 0 and self.size + length >= self.maxBytes:
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(message)
+            self.index.write(self.INDEX_ENTRY.pack(
+                record.created, self.size, record.levelno, pack_ip(getattr(record, 'client_ip', ''))))
+            self.size += length
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        pass
+
+    def flush_buffer(self):
+        # Log before index, so an index entry never points past what is on disk
+        RotatingFileHandler.flush(self)
+        self.index.flush()
+
+    def doRollover(self):
+        with self.rotation_lock:
+            self.index.close()
+            super().doRollover()
+            for i in range(self.backupCount - 1, 0, -1):
+                source = f'{self.backup_name(i)}.idx'
+                if path.exists(source):
+                    os.replace(source, f'{self.backup_name(i + 1)}.idx')
+            if self.backupCount > 0:
+                os.replace(self.baseFilename + '.idx', f'{self.backup_name(1)}.idx')
+            else:
+                os.remove(self.baseFilename + '.idx')
+            self.index = open(self.baseFilename + '.idx', 'ab')
+            self.size = 0
+            self.rollovers += 1
+
+    def close(self):
+        super().close()
+        self.index.close()
+
+    def backup_name(self, age):
+        if age == 0:
+            return self.baseFilename
+        return self.rotation_filename(f'{self.baseFilename}.{age}')
+
+    def search(self, start, end, ip=None, min_level=0, limit=10000):
+        # Yields matching records, oldest first, as raw bytes. Files are only
+        # held open while a chunk is read, and a rotation mid-search is followed
+        # by counting rollovers rather than trusting file names.
+        packed_ip = pack_ip(ip) if ip else None
+        generation = self.rollovers
+        for age in range(self.backupCount, -1, -1):
+            position = None
+            while limit > 0:
+                with self.rotation_lock:
+                    current_age = age + self.rollovers - generation
+                    log_path = self.backup_name(current_age)
+                    if current_age > self.backupCount or not path.exists(log_path + '.idx'):
+                        break
+                    records, position, done = self._search_chunk(
+                        log_path, position, start, end, packed_ip, min_level, limit)
+                limit -= len(records)
+                yield from records
+                if done:
+                    break
+
+    def _search_chunk(self, log_path, position, start, end, packed_ip, min_level, limit):
+        size = self.INDEX_ENTRY.size
+        records = []
+        with open(log_path + '.idx', 'rb') as index, open(log_path, 'rb') as log:
+            count = path.getsize(log_path + '.idx') // size
+            if position is None:
+                # Binary search for the first entry at or after start
+                low, high = 0, count
+                while low < high:
+                    middle = (low + high) // 2
+                    index.seek(middle * size)
+                    if self.INDEX_ENTRY.unpack(index.read(size))[0] < start:
+                        low = middle + 1
+                    else:
+                        high = middle
+                position = low
+
+            # One extra entry tells where the chunk's last record ends
+            index.seek(position * size)
+            data = index.read((self.SEARCH_CHUNK + 1) * size)
+            entries = [self.INDEX_ENTRY.unpack_from(data, i) for i in range(0, len(data) - size + 1, size)]
+            for i, (created, offset, levelno, entry_ip) in enumerate(entries[:self.SEARCH_CHUNK]):
+                if created > end:
+                    return records, position + i, True
+                if levelno < min_level or (packed_ip is not None and entry_ip != packed_ip):
+                    continue
+                log.seek(offset)
+                if i + 1 < len(entries):
+                    records.append(log.read(entries[i + 1][1] - offset))
+                else:
+                    records.append(log.readline())
+                if len(records) >= limit:
+                    return records, position + i + 1, True
+            consumed = min(len(entries), self.SEARCH_CHUNK)
+            return records, position + consumed, position + consumed >= count
+
+# Ring buffer for real-time logs. Entries carry increasing sequence numbers so
+# every client reads with its own cursor instead of draining a shared queue.
+class StreamHub:
+    # Everything a page streams pings this hub, so a single event stream per page
+    # can wait on all of it. Player state and log lines wake every stream; meter
+    # frames, ten a second, only wake the streams that carry the meter.
+    def __init__(self):
+        lock = threading.Lock()
+        self.changed = threading.Condition(lock)
+        self.metered = threading.Condition(lock)
+        self.tick = 0
+        self.meter_tick = 0
+
+    def notify(self):
+        with self.changed:
+            self.tick += 1
+            self.changed.notify_all()
+            self.metered.notify_all()
+
+    def notify_meter(self):
+        with self.metered:
+            self.meter_tick += 1
+            self.metered.notify_all()
+
+    def wait(self, tick, timeout, meter_tick=None):
+        # Block until something changed after tick, or with meter_tick, until a
+        # meter frame came after it too; False on timeout
+        with self.changed:
+            if meter_tick is None:
+                return self.changed.wait_for(lambda: self.tick != tick, timeout)
+            return self.metered.wait_for(lambda: self.tick != tick or self.meter_tick != meter_tick, timeout)
+
+stream_hub = StreamHub()
+
+class LogBuffer:
+    def __init__(self, size=100):
+        self.size = size
+        self.entries = [None] * size
+        self.last_seq = 0
+        self.condition = threading.Condition()
+
+    def append(self, entry):
+        with self.condition:
+            self.last_seq += 1
+            entry['seq'] = self.last_seq
+            self.entries[self.last_seq % self.size] = entry
+            self.condition.notify_all()
+        stream_hub.notify()
+
+    def since(self, seq):
+        # Entries newer than seq, oldest first. A cursor that fell out of the
+        # ring resumes at the oldest entry still kept.
+        with self.condition:
+            start = max(seq + 1, self.last_seq - self.size + 1, 1)
+            return [self.entries[s % self.size] for s in range(start, self.last_seq + 1)], self.last_seq
+
+log_buffer = LogBuffer()
+
+class LogBufferHandler(logging.Handler):
+    def emit(self, record):
+        log_entry = {
+            'message': f'[{record.client_ip}] [{record.user_agent}] {self.format(record)}',
+            'type': record.levelname.lower()
+        }
+        log_buffer.append(log_entry)
+
+log_buffer_handler = LogBufferHandler()
+log_buffer_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+
+class RequestInfoFilter(logging.Filter):
+    # Copies what the handlers need from the request while it is still around
+    def filter(self, record):
+        if has_request_context():
+            record.client_ip = request.remote_addr
+            record.user_agent = request.headers.get('User-Agent', 'Unknown UA')
+        else:
+            record.client_ip = 'Unknown IP'
+            record.user_agent = 'Unknown UA'
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    # Never blocks a request: when the listener falls behind, records are counted and dropped
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def evenly_sampled(counter, rate):
+    # True for an evenly spaced `rate` fraction of the values drawn from an
+    # itertools.count(1); next() on it is atomic, so threads can share one
+    n = next(counter)
+    return int(n * rate) != int((n - 1) * rate)
+
+class LogSampler(logging.Filter):
+    # Keeps a fixed fraction of each sampled route's info lines, evenly spaced.
+    # Runs on request threads; warnings and errors always pass.
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.counters = {route: itertools.count(1) for route in rates}
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not has_request_context() or request.url_rule is None:
+            return True
+        rate = self.rates.get(request.url_rule.rule)
+        if rate is None:
+            return True
+        if evenly_sampled(self.counters[request.url_rule.rule], rate):
+            return True
+        self.dropped += 1
+        return False
+
+class LogDeduplicator:
+    # Collapses runs of identical info lines from one client. The first line is
+    # written as usual; the repeats become one summary line with their count and
+    # time span when the run ends, or every window seconds while it lasts.
+    # Used by the LogListener thread only.
+    MAX_CLIENTS = 1024
+
+    def __init__(self, window):
+        self.window = window
+        # client -> [message, first record, repeats, time of last repeat]
+        self.runs = {}
+        self.collapsed = 0
+
+    def process(self, record):
+        # Returns the records to write in place of this one
+        if record.levelno >= logging.WARNING or not self.window:
+            return [record]
+        message = record.getMessage()
+        client = getattr(record, 'client_ip', '')
+        run = self.runs.pop(client, None)
+        if run is not None and run[0] == message:
+            run[2] += 1
+            run[3] = record.created
+            self.runs[client] = run
+            self.collapsed += 1
+            return []
+        self.runs[client] = [message, record, 0, record.created]
+        records = [record]
+        if run is not None and run[2]:
+            records.insert(0, self._summary(run, record.created))
+        if len(self.runs) > self.MAX_CLIENTS:
+            evicted = self.runs.pop(next(iter(self.runs)))
+            if evicted[2]:
+                records.append(self._summary(evicted, record.created))
+        return records
+
+    def expire(self, now, everything=False):
+        # Summaries for runs older than the window; runs with nothing to report
+        # are forgotten, runs with repeats start counting again
+        records = []
+        for client, run in list(self.runs.items()):
+            if not everything and now - run[1].created < self.window:
+                continue
+            if run[2]:
+                records.append(self._summary(run, now))
+                run[1] = records[-1]
+                run[2] = 0
+            else:
+                del self.runs[client]
+        return records
+
+    def next_expiry(self):
+        if not self.window or not self.runs:
+            return None
+        return min(run[1].created for run in self.runs.values()) + self.window
+
+    def _summary(self, run, now):
+        # Stamped when written, so the file stays in time order
+        message, first, repeats, last = run
+        summary = logging.makeLogRecord(first.__dict__)
+        summary.msg = f'{message} (repeated {repeats} more times over {last - first.created:.1f}s)'
+        summary.args = None
+        summary.created = now
+        summary.msecs = (now - int(now)) * 1000
+        return summary
+
+class LogListener(threading.Thread):
+    FLUSH_INTERVAL = 1.0
+    BATCH_SIZE = 256
+
+    def __init__(self, log_queue, handlers, deduplicator):
+        super().__init__(name='LogListener', daemon=True)
+        self.queue = log_queue
+        self.handlers = handlers
+        self.deduplicator = deduplicator
+
+    def run(self):
+        pending = False
+        stopping = False
+        last_flush = time.monotonic()
+        while not stopping:
+            timeout = max(0, last_flush + self.FLUSH_INTERVAL - time.monotonic()) if pending else None
+            expiry = self.deduplicator.next_expiry()
+            if expiry is not None:
+                until_expiry = max(0, expiry - time.time())
+                timeout = until_expiry if timeout is None else min(timeout, until_expiry)
+            try:
+                batch = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = []
+            for record in batch:
+                if record is None:
+                    stopping = True
+                    continue
+                records.extend(self.deduplicator.process(record))
+            records.extend(self.deduplicator.expire(time.time(), everything=stopping))
+            for record in records:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+                pending = True
+
+            # The first record after a quiet spell is flushed at once; a burst is
+            # written out at most once per FLUSH_INTERVAL
+            if pending and (stopping or time.monotonic() - last_flush >= self.FLUSH_INTERVAL):
+                self.flush()
+                pending = False
+                last_flush = time.monotonic()
+
+    def flush(self):
+        for handler in self.handlers:
+            getattr(handler, 'flush_buffer', handler.flush)()
+
+    def stop(self, timeout=5.0):
+        # Writes out everything queued so far; used before the process exits
+        # and when create_app() replaces the listener
+        if not self.is_alive():
+            return
+        self.queue.put(None)
+        self.join(timeout)
+
+log_records = queue.Queue(maxsize=10000)
+log_queue_handler = DroppingQueueHandler(log_records)
+log_queue_handler.addFilter(RequestInfoFilter())
+
+# Log files searchable through /logs/search, filled in by setup_logging()
+LOG_FILES = {}
+log_listener = log_sampler = None
+
+def setup_logging(app, log_dir, settings):
+    global log_listener, log_sampler
+    makedirs(log_dir, exist_ok=True)
+    if log_listener is not None:
+        # A second create_app(): the old listener writes out what it has and
+        # closes its files, so no record lands in the previous app's logs
+        log_listener.stop()
+        atexit.unregister(log_listener.stop)
+        for handler in LOG_FILES.values():
+            handler.close()
+
+    # Access log
+    access_handler = IndexedRotatingFileHandler(path.join(log_dir, 'access.log'), maxBytes=100*1024*1024, backupCount=5)  # 100MB limit
+    access_handler.setLevel(logging.INFO)
+    access_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+
+    # Error log
+    error_handler = IndexedRotatingFileHandler(path.join(log_dir, 'error.log'), maxBytes=100*1024*1024, backupCount=5)  # 100MB limit
+    error_handler.setLevel(logging.WARNING)
+    error_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    LOG_FILES.update(access=access_handler, error=error_handler)
+
+    if log_sampler is not None:
+        log_queue_handler.removeFilter(log_sampler)
+    log_sampler = LogSampler(settings['sample'])
+    log_queue_handler.addFilter(log_sampler)
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(log_queue_handler)
+    app.logger.setLevel(logging.INFO)
+    log_listener = LogListener(log_records, [default_handler, access_handler, error_handler, log_buffer_handler],
+                               LogDeduplicator(settings['dedup_window']))
+    log_listener.start()
+    # Runs before logging's own exit hook closes the files
+    atexit.register(log_listener.stop)
+
+metrics.callback('log_records_dropped_total', 'counter', 'Log records dropped because the log queue was full.',
+                 lambda: log_queue_handler.dropped)
+metrics.callback('log_records_sampled_out_total', 'counter', 'Info lines skipped by per-route log sampling.',
+                 lambda: log_sampler.dropped if log_sampler else 0)
+metrics.callback('log_records_collapsed_total', 'counter', 'Repeated log lines folded into a summary line.',
+                 lambda: log_listener.deduplicator.collapsed if log_listener else 0)
+metrics.callback('log_queue_depth', 'gauge', 'Log records waiting for the log listener.', log_records.qsize)
+metrics.callback('log_buffer_evicted_total', 'counter', 'Entries overwritten in the real-time log ring buffer.',
+                 lambda: max(0, log_buffer.last_seq - log_buffer.size))
+
+# Load config from JSON
+config_dir = path.join(expanduser('~'), 'documents', 'config')
+config_file = path.join(config_dir, 'PyWebPlayback.json')
+
+# Default config
+default_config = {
+    "baseport": 80,
+    "listenaddress": "0.0.0.0",
+    "debug": False,
+    "audio_backend": "auto",  # auto, windows or fake
+    "key_injector": "auto",  # auto, sendinput or recording
+    "nowplaying_provider": "auto",  # auto, windows, fake or none
+    # Shortcut name -> keys pressed in order and released in reverse. An entry may
+    # also be {"keys": [...], "label": "..."} to control the button caption.
+    "shortcuts": {
+        "alt1": ["alt", "1"],
+        "alt2": ["alt", "2"],
+        "alt3": ["alt", "3"],
+        "ctrlaltl": ["ctrl", "alt", "l"],
+        "altq": ["alt", "q"]
+    },
+    "server": {
+        "mode": "production",  # production (waitress) or dev (Flask development server)
+        "threads": 32,
+        "connection_limit": 200,
+        "keepalive_timeout": 120,
+        "max_request_body_size": 1024 * 1024,
+        # WebSocket command channel at /ws; needs flask-sock and dev mode
+        "websocket": False,
+        # Event streams open at once, one per visible page. Each holds a thread,
+        # so in production it is kept 8 below threads.
+        "max_streams": 24
+    },
+    # Admission control for routes that reach the audio or keyboard backends
+    "rate_limit": {
+        "enabled": True,
+        # Per client IP: sustained requests per second and burst size
+        "rate": 30,
+        "burst": 60,
+        # Backend requests in flight across all clients, and from one client
+        "max_concurrent": 16,
+        "max_per_client": 4
+    },
+    "ui": {
+        # auto (reduced motion preference or a discharging battery), true or false
+        "low_power": "auto"
+    },
+    # Controller mode: other PyWebPlayback instances shown and commanded from
+    # this one, as name -> base URL, e.g. {"office": "http://192.168.1.20:80"}
+    "controller": {
+        "nodes": {},
+        # Seconds each node gets to answer
+        "timeout": 2.0,
+        # Idle keep-alive connections kept per node
+        "pool_size": 4
+    },
+    "logging": {
+        # Fraction of info lines kept per route, e.g. {"/get_volume": 0.01};
+        # warnings and errors are always written
+        "sample": {},
+        # Identical consecutive info lines from one client are written once,
+        # then summarised with a repeat count at most this many seconds later;
+        # 0 writes every line
+        "dedup_window": 60
+    },
+    # cProfile the next `requests` requests (only on `routes` when given) and a
+    # fraction of the requests per route in `sample`, e.g. {"/volume": 0.1};
+    # profiles go to the profiles folder next to the logs. Also set at runtime
+    # through POST /profile.
+    "profiling": {
+        "requests": 0,
+        "routes": [],
+        "sample": {}
+    }
+}
+
+# Sections merged key by key with their defaults, so a config file only needs
+# to list the settings it changes
+MERGED_SECTIONS = ('server', 'rate_limit', 'ui', 'controller', 'logging', 'profiling')
+
+def merge_config(overrides):
+    config = {**default_config, **overrides}
+    for section in MERGED_SECTIONS:
+        config[section] = {**default_config[section], **config[section]}
+    return config
+
+def load_config():
+    # Load or create config file
+    makedirs(config_dir, exist_ok=True)
+    if path.exists(config_file):
+        with open(config_file, 'r') as f:
+            return merge_config(json.load(f))
+    with open(config_file, 'w') as f:
+        json.dump(default_config, f, indent=4)
+    return merge_config({})
+
+config = None
+baseport = None
+service_link = None
+version = 'PyWebPlayback ver 1.0.1 Build 2024.12.30'
+
+# Audio backends. Every method is called from the AudioWorker thread only.
+class AudioBackend:
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def get_volume(self):
+        raise NotImplementedError
+
+    def set_volume(self, volume):
+        raise NotImplementedError
+
+    def get_mute(self):
+        raise NotImplementedError
+
+    def set_mute(self, muted):
+        raise NotImplementedError
+
+    def watch(self, callback):
+        # Register callback(volume, muted) for changes made outside this process.
+        # Returns False when the backend cannot notify and must be polled instead.
+        return False
+
+    def get_peak(self):
+        # Peak level, 0.0-1.0, played on the device get_volume() reads since
+        # the previous call
+        raise NotImplementedError
+
+    # Per-device and per-application control, keyed by the backend's own ids.
+    # Info dicts look like {'id', 'name', 'volume', 'muted'} plus 'default' for
+    # devices and 'pid' for sessions; None means the device or session is gone.
+    def list_devices(self):
+        return []
+
+    def get_device(self, device_id):
+        return None
+
+    def set_device_volume(self, device_id, volume):
+        raise NotImplementedError
+
+    def set_device_mute(self, device_id, muted):
+        raise NotImplementedError
+
+    def list_sessions(self):
+        return []
+
+    def get_session(self, session_id):
+        return None
+
+    def resolve_session(self, handle):
+        # Turns the handle passed with a 'session_added' notification into an info dict
+        return None
+
+    def forget_session(self, session_id):
+        # Drops whatever is still held for a session reported removed
+        pass
+
+    def set_session_volume(self, session_id, volume):
+        raise NotImplementedError
+
+    def set_session_mute(self, session_id, muted):
+        raise NotImplementedError
+
+    def watch_topology(self, callback):
+        # Register callback(event, payload) for 'device_changed' (device id),
+        # 'session_added' (handle), 'session_changed' and 'session_removed'
+        # (session id). Returns False when the backend cannot notify.
+        return False
+
+class WindowsAudioBackend(AudioBackend):
+    # Without device notifications, poll the default device id at most this often
+    DEVICE_CHECK_INTERVAL = 1.0
+
+    def __init__(self):
+        self._interface = None
+        self._speakers = None
+        self._meter = None
+        self._device_id = None
+        self._stale = True
+        self._last_device_check = 0.0
+        self._enumerator = None
+        self._notification_client = None
+        self._watch_callback = None
+        self._volume_callback = None
+        self._topology_callback = None
+        # device id -> (IAudioEndpointVolume, volume callback or None)
+        self._device_endpoints = {}
+        # session id -> (pycaw AudioSession, events callback or None)
+        self._sessions = {}
+        self._session_manager = None
+        self._session_notification = None
+
+    RPC_E_CHANGED_MODE = -2147417850
+
+    def open(self):
+        # MTA so that endpoint notifications can reach us from MMDevAPI threads.
+        # Importing pythoncom or comtypes initialises COM on the importing
+        # thread (this one) with sys.coinit_flags, STA unless told otherwise.
+        sys.coinit_flags = 0  # COINIT_MULTITHREADED
+        import pythoncom
+        try:
+            pythoncom.CoInitializeEx(pythoncom.COINIT_MULTITHREADED)
+        except pythoncom.com_error as e:
+            # Someone imported COM on this thread first; keep the apartment it made
+            if e.hresult != self.RPC_E_CHANGED_MODE:
+                raise
+            app.logger.warning('COM was already initialised as STA on the audio thread; '
+                               'change notifications may not arrive')
+        self._register_device_notifications()
+
+    def close(self):
+        import pythoncom
+        if self._notification_client is not None:
+            try:
+                self._enumerator.UnregisterEndpointNotificationCallback(self._notification_client)
+            except Exception:
+                pass
+        self._unregister_volume_callback()
+        self._interface = None
+        self._speakers = None
+        self._meter = None
+        self._notification_client = None
+        self._enumerator = None
+        self._device_endpoints.clear()
+        self._sessions.clear()
+        self._session_manager = None
+        self._session_notification = None
+        pythoncom.CoUninitialize()
+
+    def _register_device_notifications(self):
+        try:
+            from pycaw.callbacks import MMNotificationClient
+            from pycaw.pycaw import AudioUtilities
+        except ImportError:
+            return
+
+        backend = self
+
+        class DefaultDeviceClient(MMNotificationClient):
+            def on_default_device_changed(self, flow, flow_id, role, role_id, default_device_id):
+                backend._stale = True
+                backend._topology_changed('device_changed', default_device_id)
+
+            def on_device_added(self, added_device_id):
+                backend._topology_changed('device_changed', added_device_id)
+
+            def on_device_removed(self, removed_device_id):
+                backend._topology_changed('device_changed', removed_device_id)
+
+            def on_device_state_changed(self, device_id, new_state, new_state_id):
+                backend._topology_changed('device_changed', device_id)
+
+        try:
+            self._enumerator = AudioUtilities.GetDeviceEnumerator()
+            self._notification_client = DefaultDeviceClient()
+            self._enumerator.RegisterEndpointNotificationCallback(self._notification_client)
+        except Exception as e:
+            app.logger.warning(f'Device notifications unavailable: {str(e)}')
+            self._notification_client = None
+
+    def _default_device_changed(self):
+        from pycaw.pycaw import AudioUtilities
+        now = time.monotonic()
+        if now - self._last_device_check < self.DEVICE_CHECK_INTERVAL:
+            return False
+        self._last_device_check = now
+        return AudioUtilities.GetSpeakers().GetId() != self._device_id
+
+    def _endpoint(self):
+        if self._interface is not None and not self._stale:
+            if self._notification_client is not None or not self._default_device_changed():
+                return self._interface
+        self._activate()
+        return self._interface
+
+    def _activate(self):
+        from ctypes import cast, POINTER
+        from comtypes import CLSCTX_ALL
+        from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
+        self._stale = False
+        self._unregister_volume_callback()
+        self._interface = None
+        self._meter = None
+        devices = AudioUtilities.GetSpeakers()
+        interface = devices.Activate(
+            IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
+        self._interface = cast(interface, POINTER(IAudioEndpointVolume))
+        self._speakers = devices
+        self._device_id = devices.GetId()
+        self._last_device_check = time.monotonic()
+        app.logger.info(f'Audio endpoint activated: {self._device_id}')
+        if self._watch_callback is not None:
+            self._register_volume_callback()
+            # The new device has its own level; report it like any other change
+            self._watch_callback(self.get_volume(), self.get_mute())
+
+    def _register_volume_callback(self):
+        from pycaw.callbacks import AudioEndpointVolumeCallback
+        watch_callback = self._watch_callback
+
+        class VolumeCallback(AudioEndpointVolumeCallback):
+            def on_notify(self, new_volume, new_mute, event_context, channels, channel_volumes):
+                watch_callback(round(new_volume * 100), bool(new_mute))
+
+        self._volume_callback = VolumeCallback()
+        self._interface.RegisterControlChangeNotify(self._volume_callback)
+
+    def _unregister_volume_callback(self):
+        if self._volume_callback is None or self._interface is None:
+            return
+        try:
+            self._interface.UnregisterControlChangeNotify(self._volume_callback)
+        except Exception:
+            pass
+        self._volume_callback = None
+
+    def _call(self, fn):
+        # A cached endpoint goes bad when its device disappears; retry once on a fresh one
+        try:
+            return fn(self._endpoint())
+        except Exception:
+            self._activate()
+            return fn(self._interface)
+
+    def get_volume(self):
+        return round(self._call(lambda e: e.GetMasterVolumeLevelScalar()) * 100)
+
+    def set_volume(self, volume):
+        self._call(lambda e: e.SetMasterVolumeLevelScalar(volume / 100, None))
+
+    def get_mute(self):
+        return bool(self._call(lambda e: e.GetMute()))
+
+    def get_peak(self):
+        def read(endpoint):
+            # Activated on the endpoint's device on first use, and again after
+            # the default device changes
+            if self._meter is None:
+                from ctypes import cast, POINTER
+                from comtypes import CLSCTX_ALL
+                from pycaw.pycaw import IAudioMeterInformation
+                meter = self._speakers.Activate(IAudioMeterInformation._iid_, CLSCTX_ALL, None)
+                self._meter = cast(meter, POINTER(IAudioMeterInformation))
+            return self._meter.GetPeakValue()
+        return self._call(read)
+
+    def set_mute(self, muted):
+        self._call(lambda e: e.SetMute(int(bool(muted)), None))
+
+    def watch(self, callback):
+        try:
+            import pycaw.callbacks  # noqa: F401
+        except ImportError:
+            return False
+        self._watch_callback = callback
+        # Activating a fresh endpoint registers the callback on its own
+        self._endpoint()
+        if self._volume_callback is None:
+            self._register_volume_callback()
+        return True
+
+    # Devices
+    E_RENDER = 0
+    DEVICE_STATE_ACTIVE = 0x1
+
+    def _topology_changed(self, event, payload):
+        if self._topology_callback is not None:
+            self._topology_callback(event, payload)
+
+    def _get_enumerator(self):
+        from pycaw.pycaw import AudioUtilities
+        if self._enumerator is None:
+            self._enumerator = AudioUtilities.GetDeviceEnumerator()
+        return self._enumerator
+
+    def _device_endpoint(self, device_id, device=None):
+        cached = self._device_endpoints.get(device_id)
+        if cached is not None:
+            return cached[0]
+        from ctypes import cast, POINTER
+        from comtypes import CLSCTX_ALL
+        from pycaw.pycaw import IAudioEndpointVolume
+        if device is None:
+            device = self._get_enumerator().GetDevice(device_id)
+        interface = cast(device.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None),
+                         POINTER(IAudioEndpointVolume))
+        callback = None
+        if self._topology_callback is not None:
+            from pycaw.callbacks import AudioEndpointVolumeCallback
+            backend = self
+
+            class DeviceVolumeCallback(AudioEndpointVolumeCallback):
+                def on_notify(self, new_volume, new_mute, event_context, channels, channel_volumes):
+                    backend._topology_changed('device_changed', device_id)
+
+            callback = DeviceVolumeCallback()
+            interface.RegisterControlChangeNotify(callback)
+        self._device_endpoints[device_id] = (interface, callback)
+        return interface
+
+    def _drop_device(self, device_id):
+        interface, callback = self._device_endpoints.pop(device_id, (None, None))
+        if callback is not None:
+            try:
+                interface.UnregisterControlChangeNotify(callback)
+            except Exception:
+                pass
+
+    def _device_info(self, device):
+        from pycaw.pycaw import AudioUtilities
+        device_id = device.GetId()
+        endpoint = self._device_endpoint(device_id, device)
+        self._endpoint()
+        return {
+            'id': device_id,
+            'name': AudioUtilities.CreateDevice(device).FriendlyName,
+            'default': device_id == self._device_id,
+            'volume': round(endpoint.GetMasterVolumeLevelScalar() * 100),
+            'muted': bool(endpoint.GetMute()),
+        }
+
+    def list_devices(self):
+        collection = self._get_enumerator().EnumAudioEndpoints(self.E_RENDER, self.DEVICE_STATE_ACTIVE)
+        return [self._device_info(collection.Item(i)) for i in range(collection.GetCount())]
+
+    def get_device(self, device_id):
+        try:
+            device = self._get_enumerator().GetDevice(device_id)
+            if device.GetState() == self.DEVICE_STATE_ACTIVE:
+                return self._device_info(device)
+        except Exception:
+            pass
+        self._drop_device(device_id)
+        return None
+
+    def set_device_volume(self, device_id, volume):
+        self._device_endpoint(device_id).SetMasterVolumeLevelScalar(volume / 100, None)
+
+    def set_device_mute(self, device_id, muted):
+        self._device_endpoint(device_id).SetMute(int(bool(muted)), None)
+
+    # Application sessions on the default device
+    AUDIO_SESSION_STATE_EXPIRED = 2
+
+    def _track_session(self, session):
+        session_id = session.InstanceIdentifier
+        if session_id in self._sessions:
+            return session_id
+        events = None
+        if self._topology_callback is not None:
+            from pycaw.callbacks import AudioSessionEvents
+            backend = self
+
+            class SessionEvents(AudioSessionEvents):
+                def on_simple_volume_changed(self, new_volume, new_mute, event_context):
+                    backend._topology_changed('session_changed', session_id)
+
+                # These run on COM notification threads: they only report, and
+                # the AudioIndex has the worker call forget_session()
+                def on_state_changed(self, new_state, new_state_id):
+                    if new_state_id == backend.AUDIO_SESSION_STATE_EXPIRED:
+                        backend._topology_changed('session_removed', session_id)
+
+                def on_session_disconnected(self, disconnect_reason, disconnect_reason_id):
+                    backend._topology_changed('session_removed', session_id)
+
+            events = SessionEvents()
+            session.register_notification(events)
+        self._sessions[session_id] = (session, events)
+        return session_id
+
+    def _session_info(self, session_id):
+        session = self._sessions[session_id][0]
+        process = session.Process
+        volume = session.SimpleAudioVolume
+        return {
+            'id': session_id,
+            'name': process.name() if process else (session.DisplayName or 'System Sounds'),
+            'pid': session.ProcessId,
+            'volume': round(volume.GetMasterVolume() * 100),
+            'muted': bool(volume.GetMute()),
+        }
+
+    def list_sessions(self):
+        from pycaw.pycaw import AudioUtilities
+        ids = [self._track_session(session) for session in AudioUtilities.GetAllSessions()]
+        for session_id in set(self._sessions) - set(ids):
+            self.forget_session(session_id)
+        return [self._session_info(session_id) for session_id in ids]
+
+    def get_session(self, session_id):
+        if session_id not in self._sessions:
+            return None
+        try:
+            return self._session_info(session_id)
+        except Exception:
+            self.forget_session(session_id)
+            return None
+
+    def forget_session(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None and entry[1] is not None:
+            try:
+                entry[0].unregister_notification()
+            except Exception:
+                pass
+
+    def resolve_session(self, handle):
+        from pycaw.pycaw import AudioSession, IAudioSessionControl2
+        session = AudioSession(handle.QueryInterface(IAudioSessionControl2))
+        return self.get_session(self._track_session(session))
+
+    def set_session_volume(self, session_id, volume):
+        self._sessions[session_id][0].SimpleAudioVolume.SetMasterVolume(volume / 100, None)
+
+    def set_session_mute(self, session_id, muted):
+        self._sessions[session_id][0].SimpleAudioVolume.SetMute(int(bool(muted)), None)
+
+    def watch_topology(self, callback):
+        try:
+            from comtypes import CLSCTX_ALL
+            from pycaw.callbacks import AudioSessionNotification
+            from pycaw.pycaw import AudioUtilities, IAudioSessionManager2
+        except ImportError:
+            return False
+        self._topology_callback = callback
+        backend = self
+
+        class SessionCreated(AudioSessionNotification):
+            def on_session_created(self, new_session):
+                # COM calls are not allowed inside the notification; resolve later
+                backend._topology_changed('session_added', new_session)
+
+        manager = AudioUtilities.GetSpeakers().Activate(IAudioSessionManager2._iid_, CLSCTX_ALL, None)
+        self._session_manager = manager.QueryInterface(IAudioSessionManager2)
+        # Session notifications only start once the sessions have been enumerated
+        self._session_manager.GetSessionEnumerator()
+        self._session_notification = SessionCreated()
+        self._session_manager.RegisterSessionNotification(self._session_notification)
+        return True
+
+class FakeAudioBackend(AudioBackend):
+    # In-memory stand-in used off Windows, in tests and in benchmarks
+    DEFAULT_DEVICE = 'fake-speakers'
+
+    def __init__(self, volume=50, muted=False):
+        self.volume = volume
+        self.muted = muted
+        self._watch_callback = None
+        self._topology_callback = None
+        # The default device's level is self.volume/self.muted
+        self.devices = {
+            self.DEFAULT_DEVICE: {'name': 'Fake Speakers'},
+            'fake-headphones': {'name': 'Fake Headphones', 'volume': 80, 'muted': False},
+        }
+        self.sessions = {}
+        self.add_session('fake-browser', 'browser.exe', 1001)
+        self.add_session('fake-player', 'player.exe', 1002)
+
+    def get_volume(self):
+        return self.volume
+
+    def set_volume(self, volume):
+        self.volume = round(volume)
+        self._notify()
+
+    def get_mute(self):
+        return self.muted
+
+    def set_mute(self, muted):
+        self.muted = bool(muted)
+        self._notify()
+
+    def watch(self, callback):
+        self._watch_callback = callback
+        return True
+
+    def get_peak(self):
+        # Synthetic signal: a slow swell with a 2 Hz beat on top; silent when muted
+        if self.muted:
+            return 0.0
+        t = time.monotonic()
+        return (0.55 + 0.35 * math.sin(2 * math.pi * 0.25 * t)) * (0.6 + 0.4 * abs(math.sin(2 * math.pi * 2 * t)))
+
+    def _notify(self):
+        # Mirrors the endpoint notification Windows sends after every change
+        if self._watch_callback is not None:
+            self._watch_callback(self.volume, self.muted)
+        self._topology_changed('device_changed', self.DEFAULT_DEVICE)
+
+    def _topology_changed(self, event, payload):
+        if self._topology_callback is not None:
+            self._topology_callback(event, payload)
+
+    def get_device(self, device_id):
+        device = self.devices.get(device_id)
+        if device is None:
+            return None
+        if device_id == self.DEFAULT_DEVICE:
+            return {'id': device_id, 'name': device['name'], 'default': True,
+                    'volume': self.volume, 'muted': self.muted}
+        return {'id': device_id, 'default': False, **device}
+
+    def list_devices(self):
+        return [self.get_device(device_id) for device_id in self.devices]
+
+    def set_device_volume(self, device_id, volume):
+        if device_id == self.DEFAULT_DEVICE:
+            return self.set_volume(volume)
+        self.devices[device_id]['volume'] = round(volume)
+        self._topology_changed('device_changed', device_id)
+
+    def set_device_mute(self, device_id, muted):
+        if device_id == self.DEFAULT_DEVICE:
+            return self.set_mute(muted)
+        self.devices[device_id]['muted'] = bool(muted)
+        self._topology_changed('device_changed', device_id)
+
+    def add_session(self, session_id, name, pid, volume=100, muted=False):
+        self.sessions[session_id] = {'name': name, 'pid': pid, 'volume': volume, 'muted': muted}
+        self._topology_changed('session_added', session_id)
+
+    def remove_session(self, session_id):
+        self.sessions.pop(session_id, None)
+        self._topology_changed('session_removed', session_id)
+
+    def get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        return {'id': session_id, **session} if session is not None else None
+
+    def list_sessions(self):
+        return [self.get_session(session_id) for session_id in self.sessions]
+
+    def resolve_session(self, handle):
+        return self.get_session(handle)
+
+    def set_session_volume(self, session_id, volume):
+        self.sessions[session_id]['volume'] = round(volume)
+        self._topology_changed('session_changed', session_id)
+
+    def set_session_mute(self, session_id, muted):
+        self.sessions[session_id]['muted'] = bool(muted)
+        self._topology_changed('session_changed', session_id)
+
+    def watch_topology(self, callback):
+        self._topology_callback = callback
+        return True
+
+AUDIO_BACKENDS = {
+    'windows': WindowsAudioBackend,
+    'fake': FakeAudioBackend,
+}
+
+def create_audio_backend(name):
+    if name == 'auto':
+        name = 'windows' if sys.platform == 'win32' else 'fake'
+    if name not in AUDIO_BACKENDS:
+        raise ValueError(f'Unknown audio backend: {name}')
+    return AUDIO_BACKENDS[name]()
+
+class AudioWorker(threading.Thread):
+    # Owns the audio backend (and its COM apartment) for the life of the process.
+    # Request handlers submit commands through a queue and wait for the result.
+    def __init__(self, backend, timeout=5.0):
+        super().__init__(name='AudioWorker', daemon=True)
+        self.backend = backend
+        self.timeout = timeout
+        self.commands = queue.Queue()
+        # Set when the backend failed to open; calls then fail at once
+        self.error = None
+        self.lock = threading.Lock()
+        # method -> (latency, errors) metric children, bound on first use
+        self.meters = {}
+
+    def run(self):
+        try:
+            self.backend.open()
+        except Exception as e:
+            app.logger.error(f'Audio backend failed to start: {str(e)}')
+            with self.lock:
+                self.error = e
+            # Nothing is queued after error is set, so this drains every waiter
+            while True:
+                try:
+                    command = self.commands.get_nowait()
+                except queue.Empty:
+                    return
+                if command is not None and command[0].set_running_or_notify_cancel():
+                    command[0].set_exception(self.unavailable())
+        try:
+            while True:
+                command = self.commands.get()
+                if command is None:
+                    break
+                future, method, args = command
+                if not future.set_running_or_notify_cancel():
+                    continue
+                meters = self.meters.get(method)
+                if meters is None:
+                    meters = self.meters[method] = (backend_latency.labels('audio', method),
+                                                    backend_errors.labels('audio', method))
+                started = time.perf_counter()
+                try:
+                    future.set_result(getattr(self.backend, method)(*args))
+                except Exception as e:
+                    meters[1].inc()
+                    future.set_exception(e)
+                meters[0].observe(time.perf_counter() - started)
+        finally:
+            self.backend.close()
+
+    def unavailable(self):
+        return RuntimeError(f'Audio backend unavailable: {str(self.error)}')
+
+    def call(self, method, *args):
+        future = Future()
+        with self.lock:
+            if self.error is not None:
+                raise self.unavailable()
+            self.commands.put((future, method, args))
+        return future.result(self.timeout)
+
+    def stop(self):
+        # Commands already queued still run; later calls fail at once
+        with self.lock:
+            if self.error is None:
+                self.error = RuntimeError('Audio worker stopped')
+            self.commands.put(None)
+
+class PlayerState:
+    # Single source of player state for every connected client. Volume and mute
+    # are fed by backend change notifications, or by one slow poller when the
+    # backend has none; playback is whatever was last sent, since media keys
+    # give no feedback. Every change bumps the version.
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.state = {'volume': None, 'muted': None, 'playing': False, 'last_action': None}
+        self.version = 0
+        # Versions restart with the process; the epoch keeps old ETags from matching
+        self.epoch = os.urandom(4).hex()
+        self.body = None
+        self.condition = threading.Condition()
+
+    def start(self):
+        try:
+            self.publish(self.worker.call('get_volume'), self.worker.call('get_mute'))
+            if self.worker.call('watch', self.publish):
+                return
+        except Exception as e:
+            app.logger.warning(f'Volume notifications unavailable: {str(e)}')
+        threading.Thread(target=self._poll, name='VolumePoller', daemon=True).start()
+
+    def _poll(self):
+        while self.worker.error is None:
+            time.sleep(self.POLL_INTERVAL)
+            try:
+                self.publish(self.worker.call('get_volume'), self.worker.call('get_mute'))
+            except Exception:
+                pass
+
+    def publish(self, volume, muted):
+        self.update(volume=volume, muted=muted)
+
+    def update(self, **changes):
+        with self.condition:
+            state = {**self.state, **changes}
+            if state == self.state:
+                return
+            self.state = state
+            self.version += 1
+            self.body = None
+            self.condition.notify_all()
+        stream_hub.notify()
+
+    def record_playback(self, action):
+        with self.condition:
+            playing = self.state['playing']
+            if action == 'playpause':
+                playing = not playing
+            self.update(playing=playing, last_action=action)
+
+    def snapshot(self):
+        # (ETag, JSON body, state) for the current version; the body is
+        # serialized once per version and shared by every poller
+        with self.condition:
+            if self.body is None:
+                self.body = json.dumps({'status': 'success', **self.state, 'version': self.version})
+            return f'{self.epoch}-{self.version}', self.body, self.state
+
+    def current(self):
+        with self.condition:
+            return self.version, self.state
+
+class VolumeBatch:
+    def __init__(self):
+        self.target = None
+        self.requests = 0
+        self.applied = None
+        self.error = None
+        self.done = threading.Event()
+
+class VolumeWriter:
+    # Coalesces slider bursts. The first write goes straight through; writes that
+    # arrive while it is in flight, or within WINDOW of it, join one batch and only
+    # the batch's latest target reaches the device. Client sequence numbers make
+    # the latest target win even when requests arrive out of order.
+    WINDOW = 0.05
+    MAX_CLIENTS = 1024
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.pending = None
+        self.last_write = 0.0
+        self.client_seqs = {}
+
+    def _accept(self, client, seq):
+        # False when seq is not newer than the last one seen from this client;
+        # called with the lock held
+        last = self.client_seqs.pop(client, None)
+        if last is not None and seq <= last:
+            self.client_seqs[client] = last
+            return False
+        self.client_seqs[client] = seq
+        if len(self.client_seqs) > self.MAX_CLIENTS:
+            del self.client_seqs[next(iter(self.client_seqs))]
+        return True
+
+    def submit(self, volume, client=None, seq=None):
+        # Returns the batch this write ended up in, once it has been applied, or
+        # None when seq is stale. The seq check and the target update share one
+        # critical section, so an older write can never replace a newer target.
+        with self.lock:
+            if seq is not None and not self._accept(client, seq):
+                return None
+            batch = self.pending
+            leader = batch is None
+            if leader:
+                batch = self.pending = VolumeBatch()
+            batch.target = volume
+            batch.requests += 1
+        if not leader:
+            batch.done.wait(self.WINDOW + 2 * self.worker.timeout)
+            if not batch.done.is_set():
+                batch.error = TimeoutError('Volume write timed out')
+            return batch
+
+        with self.write_lock:
+            delay = self.last_write + self.WINDOW - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self.lock:
+                # Later writes start the next batch from here on
+                self.pending = None
+                target = batch.target
+            try:
+                self.worker.call('set_volume', target)
+                batch.applied = target
+                if batch.requests > 1:
+                    app.logger.info(f'Volume set to {target} ({batch.requests} requests coalesced)')
+                else:
+                    app.logger.info(f'Volume set to {target}')
+            except Exception as e:
+                batch.error = e
+            self.last_write = time.monotonic()
+        batch.done.set()
+        return batch
+
+# Volume ramps. A single scheduler thread steps the volume at a fixed rate,
+# computing every step from monotonic time so late ticks never add up to drift.
+RAMP_FLOOR = 1
+
+def ramp_value(start, target, fraction, curve):
+    if fraction >= 1:
+        return target
+    if curve == 'linear':
+        return start + (target - start) * fraction
+    # logarithmic: equal steps in decibels, which sounds even. Zero is out of
+    # reach in decibels, so the ramp runs to RAMP_FLOOR and snaps at the end.
+    low = 20 * math.log10(max(start, RAMP_FLOOR) / 100)
+    high = 20 * math.log10(max(target, RAMP_FLOOR) / 100)
+    return 100 * 10 ** ((low + (high - low) * fraction) / 20)
+
+class VolumeRamp:
+    CURVES = ('linear', 'logarithmic')
+
+    def __init__(self, start, target, duration, curve):
+        self.start = start
+        self.target = target
+        self.duration = duration
+        self.curve = curve
+        self.started = time.monotonic()
+
+    def value(self, now):
+        # (volume, finished) at monotonic time now
+        fraction = 1.0 if self.duration <= 0 else min(1.0, (now - self.started) / self.duration)
+        return round(ramp_value(self.start, self.target, fraction, self.curve)), fraction >= 1
+
+    def describe(self):
+        return {'from': self.start, 'target': self.target,
+                'duration_ms': round(self.duration * 1000), 'curve': self.curve}
+
+class VolumeRamper:
+    # Starts its thread on the first ramp and sleeps while there is none. A new
+    # ramp replaces the running one and starts from where that one got to.
+    TICK = 0.02
+
+    def __init__(self, worker, state):
+        self.worker = worker
+        self.state = state
+        self.condition = threading.Condition()
+        self.ramp = None
+        self.applied = None
+        self.thread = None
+
+    def start(self, target, duration, curve):
+        current = self.state.state['volume']
+        if current is None:
+            current = self.worker.call('get_volume')
+        with self.condition:
+            if self.ramp is not None:
+                current = self.applied
+                app.logger.info(f'Volume ramp to {self.ramp.target} retargeted')
+            else:
+                self.applied = current
+            self.ramp = VolumeRamp(current, target, duration, curve)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='VolumeRamper', daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+            return self.ramp
+
+    def cancel(self):
+        # Stops the running ramp where it is; True if there was one. Waits for a
+        # step being written, so a write made after this can't be overwritten.
+        with self.condition:
+            ramp, self.ramp = self.ramp, None
+            self.condition.notify_all()
+        if ramp is not None:
+            app.logger.info(f'Volume ramp to {ramp.target} cancelled at {self.applied}')
+        return ramp is not None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.ramp is not None)
+                ramp = self.ramp
+                next_tick = time.monotonic()
+                while self.ramp is ramp:
+                    value, finished = ramp.value(time.monotonic())
+                    if value != self.applied:
+                        try:
+                            self.worker.call('set_volume', value)
+                        except Exception as e:
+                            app.logger.error(f'Volume ramp stopped: {str(e)}')
+                            self.ramp = None
+                            break
+                        self.applied = value
+                        self.state.update(volume=value)
+                    if finished:
+                        self.ramp = None
+                        app.logger.info(f'Volume ramp to {ramp.target} finished')
+                        break
+                    # Fixed-rate ticks; ticks missed while the backend was slow are skipped
+                    next_tick += self.TICK
+                    now = time.monotonic()
+                    if next_tick < now:
+                        next_tick = now
+                    self.condition.wait_for(lambda: self.ramp is not ramp, next_tick - now)
+
+class LevelMeter:
+    # One sampler for every meter subscriber. While anyone is subscribed, the
+    # peak level is read at SAMPLE_INTERVAL and every SAMPLES_PER_FRAME samples
+    # become a frame of (peak, RMS of the samples), each scaled to 0-255.
+    # Subscribers (event streams asking for meter events) pick up the latest
+    # frame and skip any they were too slow for.
+    # With no subscribers the thread sleeps and the backend is not read.
+    SAMPLE_INTERVAL = 0.02
+    SAMPLES_PER_FRAME = 5
+    RETRY_INTERVAL = 1.0
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.condition = threading.Condition()
+        self.subscribers = 0
+        self.seq = 0
+        self.frame = None
+        self.thread = None
+
+    def subscribe(self):
+        # Returns the current frame's seq, to wait past it for a fresh one
+        with self.condition:
+            self.subscribers += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='LevelMeter', daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+            return self.seq
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def latest(self):
+        with self.condition:
+            return self.seq, self.frame
+
+    def _run(self):
+        failing = False
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.subscribers > 0)
+            samples = []
+            next_tick = time.monotonic()
+            while len(samples) < self.SAMPLES_PER_FRAME:
+                try:
+                    samples.append(max(0.0, min(1.0, self.worker.call('get_peak'))))
+                except Exception as e:
+                    if not failing:
+                        app.logger.warning(f'Level meter unavailable: {str(e)}')
+                    failing = True
+                    break
+                # Fixed-rate ticks; ticks missed while the backend was slow are skipped
+                next_tick += self.SAMPLE_INTERVAL
+                now = time.monotonic()
+                if next_tick < now:
+                    next_tick = now
+                time.sleep(next_tick - now)
+            if len(samples) < self.SAMPLES_PER_FRAME:
+                time.sleep(self.RETRY_INTERVAL)
+                continue
+            failing = False
+            peak = round(max(samples) * 255)
+            rms = round(math.sqrt(sum(sample * sample for sample in samples) / len(samples)) * 255)
+            with self.condition:
+                self.seq += 1
+                self.frame = (peak, rms)
+            stream_hub.notify_meter()
+
+metrics.callback('level_meter_subscribers', 'gauge', 'Clients streaming the level meter.',
+                 lambda: level_meter.subscribers if level_meter else 0)
+
+class AudioIndex:
+    # Cached view of output devices and application sessions, so listing them
+    # does not enumerate through COM on every request. Backend notifications only
+    # mark entries dirty; the next read refreshes just those entries through the
+    # worker. Without notifications the index is rebuilt once per FALLBACK_TTL.
+    FALLBACK_TTL = 5.0
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.entries = {'device': {}, 'session': {}}
+        # Public ids are short hashes of the backend's ids, which can be long
+        # and contain characters that do not belong in a URL
+        self.raw_ids = {}
+        self.watched = False
+        self.built = None
+        self.dirty = {'device': set(), 'session': set()}
+        self.removed = set()
+        self.added = []
+
+    def start(self):
+        try:
+            self.watched = self.worker.call('watch_topology', self.notify)
+        except Exception as e:
+            app.logger.warning(f'Device and session notifications unavailable: {str(e)}')
+        if not self.watched:
+            app.logger.info(f'Device and session index refreshes every {self.FALLBACK_TTL:g}s')
+
+    @staticmethod
+    def public_id(raw_id):
+        return hashlib.sha1(str(raw_id).encode()).hexdigest()[:12]
+
+    def notify(self, event, payload):
+        # Called from the backend's notification threads: no backend calls here
+        with self.lock:
+            if event == 'device_changed':
+                self.dirty['device'].add(payload)
+            elif event == 'session_added':
+                self.added.append(payload)
+            elif event == 'session_changed':
+                self.dirty['session'].add(payload)
+            elif event == 'session_removed':
+                self.removed.add(payload)
+
+    def _store(self, kind, raw_id, info):
+        entries = self.entries[kind]
+        public_id = self.public_id(raw_id)
+        if info is None:
+            entries.pop(public_id, None)
+            self.raw_ids.pop((kind, public_id), None)
+            return None
+        info = {**info, 'id': public_id}
+        if kind == 'device' and info.get('default'):
+            previous = [entry for entry in entries.values() if entry.get('default') and entry['id'] != public_id]
+            for entry in previous:
+                entry['default'] = False
+            if previous:
+                # Sessions belong to the default device, which just moved
+                self.built = None
+        entries[public_id] = info
+        self.raw_ids[(kind, public_id)] = raw_id
+        return info
+
+    def _rebuild(self):
+        devices = self.worker.call('list_devices')
+        sessions = self.worker.call('list_sessions')
+        with self.lock:
+            self.entries = {'device': {}, 'session': {}}
+            self.raw_ids = {}
+            for info in devices:
+                self._store('device', info['id'], info)
+            for info in sessions:
+                self._store('session', info['id'], info)
+            self.built = time.monotonic()
+
+    def refresh(self):
+        with self.refresh_lock:
+            with self.lock:
+                expired = self.built is None or (
+                    not self.watched and time.monotonic() - self.built > self.FALLBACK_TTL)
+                if expired:
+                    self.dirty = {'device': set(), 'session': set()}
+                    self.removed = set()
+                    self.added = []
+                dirty_devices, self.dirty['device'] = self.dirty['device'], set()
+                dirty_sessions, self.dirty['session'] = self.dirty['session'], set()
+                removed, self.removed = self.removed, set()
+                added, self.added = self.added, []
+            if expired:
+                self._rebuild()
+                return
+
+            devices = [(raw_id, self.worker.call('get_device', raw_id)) for raw_id in dirty_devices]
+            for raw_id in removed:
+                self.worker.call('forget_session', raw_id)
+            sessions = [(raw_id, self.worker.call('get_session', raw_id)) for raw_id in dirty_sessions - removed]
+            for handle in added:
+                info = self.worker.call('resolve_session', handle)
+                if info is not None:
+                    sessions.append((info['id'], info))
+            with self.lock:
+                for raw_id, info in devices:
+                    self._store('device', raw_id, info)
+                for raw_id in removed:
+                    self._store('session', raw_id, None)
+                for raw_id, info in sessions:
+                    self._store('session', raw_id, info)
+            if self.built is None:
+                self._rebuild()
+
+    def list(self, kind):
+        self.refresh()
+        with self.lock:
+            return list(self.entries[kind].values())
+
+    def update(self, kind, public_id, setting, value):
+        # Applies volume or mute to one device or session and returns its new info
+        self.refresh()
+        with self.lock:
+            raw_id = self.raw_ids.get((kind, public_id))
+            current = self.entries[kind].get(public_id)
+        if raw_id is None:
+            raise KeyError(f'Unknown {kind}: {public_id}')
+        if setting == 'mute' and value is None:
+            value = not current['muted']
+        self.worker.call(f'set_{kind}_{setting}', raw_id, value)
+        info = self.worker.call(f'get_{kind}', raw_id)
+        with self.lock:
+            return self._store(kind, raw_id, info)
+
+# Now playing. Providers return {'title', 'artist', 'album', 'position',
+# 'duration', 'playing'} for the current media session, or None when there is
+# none; artwork() returns the raw album art of the track get() last saw.
+class NowPlayingProvider:
+    def get(self):
+        return None
+
+    def artwork(self):
+        return None
+
+class WindowsNowPlayingProvider(NowPlayingProvider):
+    # System Media Transport Controls through winsdk
+    def __init__(self):
+        self._thumbnail = None
+
+    def get(self):
+        import asyncio
+        return asyncio.run(self._get())
+
+    async def _get(self):
+        from winsdk.windows.media.control import (
+            GlobalSystemMediaTransportControlsSessionManager as SessionManager,
+            GlobalSystemMediaTransportControlsSessionPlaybackStatus as PlaybackStatus)
+        manager = await SessionManager.request_async()
+        session = manager.get_current_session()
+        if session is None:
+            self._thumbnail = None
+            return None
+        properties = await session.try_get_media_properties_async()
+        timeline = session.get_timeline_properties()
+        playing = session.get_playback_info().playback_status == PlaybackStatus.PLAYING
+        # The timeline is a snapshot from last_updated_time
+        position = timeline.position.total_seconds()
+        if playing:
+            position += (datetime.now(timeline.last_updated_time.tzinfo) - timeline.last_updated_time).total_seconds()
+        self._thumbnail = properties.thumbnail
+        return {
+            'title': properties.title,
+            'artist': properties.artist,
+            'album': properties.album_title,
+            'position': round(min(position, timeline.end_time.total_seconds()), 1),
+            'duration': round(timeline.end_time.total_seconds(), 1),
+            'playing': playing,
+        }
+
+    def artwork(self):
+        if self._thumbnail is None:
+            return None
+        import asyncio
+        return asyncio.run(self._artwork())
+
+    async def _artwork(self):
+        from winsdk.windows.storage.streams import Buffer, InputStreamOptions
+        stream = await self._thumbnail.open_read_async()
+        buffer = Buffer(stream.size)
+        await stream.read_async(buffer, buffer.capacity, InputStreamOptions.READ_AHEAD)
+        return bytes(buffer)
+
+def rgb_png(width, height, rows):
+    # rows: one bytes object of width RGB pixels per row
+    import zlib
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b''.join(b'\0' + row for row in rows))) + chunk(b'IEND', b''))
+
+def solid_png(width, height, rgb):
+    return rgb_png(width, height, [bytes(rgb) * width] * height)
+
+class FakeNowPlayingProvider(NowPlayingProvider):
+    # A fixed playlist that advances with the clock, with full-size solid-colour art
+    TRACKS = [
+        ('Fake Track One', 'Fake Artist', 'Fake Album', 180, (200, 60, 60)),
+        ('Fake Track Two', 'Fake Artist', 'Fake Album', 240, (200, 60, 60)),
+        ('Another Fake Track', 'Other Artist', 'Other Album', 200, (60, 90, 200)),
+    ]
+    ARTWORK_SIZE = 1000
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._track = None
+
+    def get(self):
+        elapsed = (time.monotonic() - self.started) % sum(track[3] for track in self.TRACKS)
+        for track in self.TRACKS:
+            if elapsed < track[3]:
+                break
+            elapsed -= track[3]
+        self._track = track
+        title, artist, album, duration, _ = track
+        return {'title': title, 'artist': artist, 'album': album,
+                'position': round(elapsed, 1), 'duration': duration, 'playing': True}
+
+    def artwork(self):
+        if self._track is None:
+            return None
+        return solid_png(self.ARTWORK_SIZE, self.ARTWORK_SIZE, self._track[4])
+
+NOWPLAYING_PROVIDERS = {
+    'windows': WindowsNowPlayingProvider,
+    'fake': FakeNowPlayingProvider,
+    'none': NowPlayingProvider,
+}
+
+def create_nowplaying_provider(name):
+    if name == 'auto':
+        if sys.platform != 'win32':
+            name = 'fake'
+        else:
+            import importlib.util
+            name = 'windows' if importlib.util.find_spec('winsdk') else 'none'
+    if name not in NOWPLAYING_PROVIDERS:
+        raise ValueError(f'Unknown now playing provider: {name}')
+    return NOWPLAYING_PROVIDERS[name]()
+
+class ArtworkCache:
+    # Album art downscaled once and kept under content-hashed names, least
+    # recently used evicted first, bounded by entry count and total bytes.
+    # Pillow (in requirements.txt) does the downscaling; if it is missing, art
+    # is kept as is up to MAX_UNSCALED_BYTES and dropped beyond that.
+    SIZE = 256
+    MAX_ENTRIES = 64
+    MAX_BYTES = 4 * 1024 * 1024
+    MAX_UNSCALED_BYTES = 256 * 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # Digest of the original art -> name, so the same art is only scaled once
+        self.sources = {}
+        self.bytes = 0
+        self.evictions = 0
+        self.unscaled_warned = False
+
+    def add(self, raw):
+        # Returns the name the art is served under, or None if it can't be
+        source = hashlib.sha1(raw).hexdigest()
+        with self.lock:
+            name = self.sources.get(source)
+            if name is not None:
+                self.entries.move_to_end(name)
+                return name
+        asset, ext = self._thumbnail(raw)
+        if asset is None:
+            return None
+        name = hashed_name(f'artwork.{ext}', asset)
+        size = len(asset.variants[None][0])
+        with self.lock:
+            if name not in self.entries:
+                self.entries[name] = (asset, source, size)
+                self.sources[source] = name
+                self.bytes += size
+            while len(self.entries) > self.MAX_ENTRIES or self.bytes > self.MAX_BYTES:
+                _, (_, evicted_source, evicted_size) = self.entries.popitem(last=False)
+                del self.sources[evicted_source]
+                self.bytes -= evicted_size
+                self.evictions += 1
+        return name
+
+    def get(self, name):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return None
+            self.entries.move_to_end(name)
+            return entry[0]
+
+    def _thumbnail(self, raw):
+        try:
+            from PIL import Image
+        except ImportError:
+            if not self.unscaled_warned:
+                self.unscaled_warned = True
+                app.logger.warning(f'Pillow is not installed: album art is served unscaled, '
+                                   f'up to {self.MAX_UNSCALED_BYTES // 1024} KB')
+            ext = 'png' if raw.startswith(b'\x89PNG') else 'jpg' if raw.startswith(b'\xff\xd8') else None
+            if ext is None or len(raw) > self.MAX_UNSCALED_BYTES:
+                return None, None
+            return StaticAsset(raw, f'image/{"png" if ext == "png" else "jpeg"}', IMMUTABLE, compress=False), ext
+        import io
+        image = Image.open(io.BytesIO(raw))
+        image.thumbnail((self.SIZE, self.SIZE))
+        out = io.BytesIO()
+        image.convert('RGB').save(out, 'JPEG', quality=80, optimize=True)
+        return StaticAsset(out.getvalue(), 'image/jpeg', IMMUTABLE, compress=False), 'jpg'
+
+metrics.callback('artwork_cache_bytes', 'gauge', 'Bytes of scaled album art held in memory.',
+                 lambda: artwork_cache.bytes if artwork_cache else 0)
+metrics.callback('artwork_cache_evictions_total', 'counter', 'Album art evicted from the cache.',
+                 lambda: artwork_cache.evictions if artwork_cache else 0)
+
+class NowPlaying:
+    # Everyone polling within TTL shares one provider read; artwork is only
+    # fetched and scaled when the track changes
+    TTL = 1.0
+
+    def __init__(self, provider, artwork_cache):
+        self.provider = provider
+        self.artwork_cache = artwork_cache
+        self.lock = threading.Lock()
+        self.fetched = None
+        self.track = None
+        self.track_key = None
+        self.artwork_name = None
+        self.meters = {method: (backend_latency.labels('nowplaying', method), backend_errors.labels('nowplaying', method))
+                       for method in ('get', 'artwork')}
+
+    def get(self):
+        with self.lock:
+            if self.fetched is None or time.monotonic() - self.fetched >= self.TTL:
+                self._refresh()
+                self.fetched = time.monotonic()
+            return self.track
+
+    def _call(self, method):
+        latency, errors = self.meters[method]
+        started = time.perf_counter()
+        try:
+            return getattr(self.provider, method)()
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - started)
+
+    def _refresh(self):
+        info = self._call('get')
+        if info is None:
+            self.track = self.track_key = self.artwork_name = None
+            return
+        key = (info['title'], info['artist'], info['album'])
+        evicted = self.artwork_name is not None and self.artwork_cache.get(self.artwork_name) is None
+        if key != self.track_key or evicted:
+            self.track_key = key
+            self.artwork_name = None
+            try:
+                raw = self._call('artwork')
+                if raw:
+                    self.artwork_name = self.artwork_cache.add(raw)
+            except Exception as e:
+                app.logger.warning(f'Error reading artwork: {str(e)}')
+        artwork = f'/artwork/{self.artwork_name}' if self.artwork_name else None
+        self.track = {**info, 'artwork': artwork}
+
+# Controller mode. Every node gets a small pool of keep-alive connections and
+# every command goes to all nodes at once, so a fan-out takes as long as the
+# slowest node rather than the sum of them.
+node_latency = metrics.histogram('node_request_duration_seconds', 'Time for a node to answer the controller.', ('node', 'route'))
+node_errors = metrics.counter('node_errors_total', 'Node requests that failed or timed out.', ('node', 'route'))
+
+class NodeClient:
+    # How a reused keep-alive connection fails when the node has closed it;
+    # only these are retried, since nothing was processed
+    STALE = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+    def __init__(self, name, url, timeout, pool_size):
+        parts = urlsplit(url)
+        self.name = name
+        self.url = url
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.idle = queue.LifoQueue()
+        # (ETag, state) of the last /get_volume answer, revalidated on every poll
+        self.cached = (None, None)
+
+    def request(self, method, route, body=None, headers=None):
+        # Returns (status, ETag, decoded JSON or None)
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            try:
+                connection = self.idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+                reused = False
+            try:
+                connection.request(method, self.prefix + route, body=data, headers=headers)
+                response = connection.getresponse()
+            except self.STALE:
+                connection.close()
+                # The node dropped an idle connection before answering; that is
+                # worth one retry on a fresh one, a failed fresh connection is not
+                if not reused or attempt:
+                    raise
+                continue
+            except (OSError, http.client.HTTPException):
+                # Timeouts included: the node may have run the command already
+                connection.close()
+                raise
+            try:
+                payload = response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                raise
+            break
+        if response.will_close or self.idle.qsize() >= self.pool_size:
+            connection.close()
+        else:
+            self.idle.put(connection)
+        decoded = json.loads(payload) if payload[:1] == b'{' else None
+        return response.status, response.getheader('ETag'), decoded
+
+    def state(self):
+        etag, state = self.cached
+        status, new_etag, body = self.request('GET', '/get_volume', headers={'If-None-Match': etag} if etag else None)
+        if status == 304:
+            return state
+        if status != 200 or body is None:
+            raise RuntimeError(f'HTTP {status}')
+        self.cached = (new_etag, body)
+        return body
+
+    def command(self, route, data):
+        status, _, body = self.request('POST', f'/{route}', data)
+        if body is None:
+            raise RuntimeError(f'HTTP {status}')
+        return body
+
+class Controller:
+    ROUTES = ('volume', 'mute', 'playback', 'shortcut', 'batch')
+
+    def __init__(self, nodes, timeout, pool_size):
+        self.nodes = {name: NodeClient(name, url, timeout, pool_size) for name, url in nodes.items()}
+        self.timeout = timeout
+        # Enough workers that nodes still waiting out a timeout don't hold up the next fan-out
+        self.executor = ThreadPoolExecutor(max_workers=min(64, 4 * len(nodes)), thread_name_prefix='Controller')
+
+    def _call(self, node, route, call):
+        started = time.perf_counter()
+        try:
+            return {'status': 'success', **call(node)}
+        except Exception:
+            node_errors.labels(node.name, route).inc()
+            raise
+        finally:
+            node_latency.labels(node.name, route).observe(time.perf_counter() - started)
+
+    def fan_out(self, names, route, call):
+        # Runs call(node) on every named node at once; returns {name: result}.
+        # Nodes that miss the deadline are reported as timed out and left behind.
+        futures = {self.executor.submit(self._call, self.nodes[name], route, call): name for name in names}
+        done, _ = wait_futures(futures, timeout=self.timeout)
+        results = {}
+        for future, name in futures.items():
+            if future not in done:
+                node_errors.labels(name, route).inc()
+                results[name] = {'status': 'error', 'message': 'Timed out'}
+                continue
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = {'status': 'error', 'message': str(e)}
+        return results
+
+    def state(self):
+        states = self.fan_out(self.nodes, 'get_volume', NodeClient.state)
+        return {name: {'url': self.nodes[name].url, **state} for name, state in states.items()}
+
+    def command(self, names, route, data):
+        return self.fan_out(names, route, lambda node: node.command(route, data))
+
+# Keyboard injection. Shortcuts are compiled once into tuples of (virtual key,
+# key up) events; injectors turn those into whatever they send in one call.
+KEY_CODES = {
+    'ctrl': 0x11, 'alt': 0x12, 'shift': 0x10, 'win': 0x5B,
+    'space': 0x20, 'enter': 0x0D, 'tab': 0x09, 'esc': 0x1B, 'backspace': 0x08,
+    'delete': 0x2E, 'insert': 0x2D, 'home': 0x24, 'end': 0x23,
+    'pageup': 0x21, 'pagedown': 0x22,
+    'left': 0x25, 'up': 0x26, 'right': 0x27, 'down': 0x28,
+    'media_play_pause': 0xB3, 'media_next': 0xB0, 'media_prev': 0xB1, 'media_stop': 0xB2,
+    'volume_mute': 0xAD, 'volume_down': 0xAE, 'volume_up': 0xAF,
+}
+KEY_CODES.update({chr(c).lower(): c for c in range(ord('A'), ord('Z') + 1)})
+KEY_CODES.update({chr(c): c for c in range(ord('0'), ord('9') + 1)})
+KEY_CODES.update({f'f{n}': 0x6F + n for n in range(1, 25)})
+
+KEY_LABELS = {'ctrl': 'Ctrl', 'alt': 'Alt', 'shift': 'Shift', 'win': 'Win'}
+
+MEDIA_ACTIONS = {
+    'playpause': ['media_play_pause'],
+    'next': ['media_next'],
+    'previous': ['media_prev'],
+}
+
+def compile_keys(name, keys):
+    if not isinstance(keys, list) or not keys:
+        raise ValueError(f'Shortcut {name} must be a non-empty list of keys')
+    codes = []
+    for key in keys:
+        code = KEY_CODES.get(str(key).lower())
+        if code is None:
+            raise ValueError(f'Unknown key {key!r} in shortcut {name}')
+        codes.append(code)
+    return tuple([(code, False) for code in codes] + [(code, True) for code in reversed(codes)])
+
+def compile_shortcuts(definitions):
+    # Returns {name: (label, events)}; raises ValueError on the first bad entry
+    compiled = {}
+    for name, definition in definitions.items():
+        if isinstance(definition, dict):
+            keys = definition.get('keys')
+            label = definition.get('label')
+        else:
+            keys = definition
+            label = None
+        events = compile_keys(name, keys)
+        if label is None:
+            label = '+'.join(KEY_LABELS.get(str(key).lower(), str(key).upper()) for key in keys)
+        compiled[name] = (label, events)
+    return compiled
+
+class KeyInjector:
+    def prepare(self, events):
+        # Precompute whatever send() needs; called once per shortcut at startup
+        return events
+
+    def send(self, prepared):
+        raise NotImplementedError
+
+class KEYBDINPUT(ctypes.Structure):
+    _fields_ = [('wVk', ctypes.c_ushort), ('wScan', ctypes.c_ushort), ('dwFlags', ctypes.c_ulong),
+                ('time', ctypes.c_ulong), ('dwExtraInfo', ctypes.c_size_t)]
+
+class MOUSEINPUT(ctypes.Structure):
+    _fields_ = [('dx', ctypes.c_long), ('dy', ctypes.c_long), ('mouseData', ctypes.c_ulong),
+                ('dwFlags', ctypes.c_ulong), ('time', ctypes.c_ulong), ('dwExtraInfo', ctypes.c_size_t)]
+
+class INPUT(ctypes.Structure):
+    class _INPUT(ctypes.Union):
+        # MOUSEINPUT is only here so the union has the size SendInput expects
+        _fields_ = [('ki', KEYBDINPUT), ('mi', MOUSEINPUT)]
+    _anonymous_ = ('u',)
+    _fields_ = [('type', ctypes.c_ulong), ('u', _INPUT)]
+
+class SendInputInjector(KeyInjector):
+    # One SendInput call per shortcut: Windows inserts the whole array into the
+    # input stream at once, so modifiers never interleave with other input.
+    INPUT_KEYBOARD = 1
+    KEYEVENTF_KEYUP = 0x0002
+
+    def __init__(self):
+        self._send_input = ctypes.windll.user32.SendInput
+
+    def prepare(self, events):
+        inputs = (INPUT * len(events))()
+        for item, (code, key_up) in zip(inputs, events):
+            item.type = self.INPUT_KEYBOARD
+            item.ki.wVk = code
+            item.ki.dwFlags = self.KEYEVENTF_KEYUP if key_up else 0
+        return inputs
+
+    def send(self, prepared):
+        sent = self._send_input(len(prepared), prepared, ctypes.sizeof(INPUT))
+        if sent != len(prepared):
+            raise OSError(f'SendInput injected {sent} of {len(prepared)} key events')
+
+class RecordingKeyInjector(KeyInjector):
+    # Records (monotonic time, events) instead of touching the keyboard
+    def __init__(self, maxlen=1000):
+        self.sent = deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+
+    def send(self, prepared):
+        with self.lock:
+            self.sent.append((time.monotonic(), prepared))
+
+KEY_INJECTORS = {
+    'sendinput': SendInputInjector,
+    'recording': RecordingKeyInjector,
+}
+
+def create_key_injector(name):
+    if name == 'auto':
+        name = 'sendinput' if sys.platform == 'win32' else 'recording'
+    if name not in KEY_INJECTORS:
+        raise ValueError(f'Unknown key injector: {name}')
+    return KEY_INJECTORS[name]()
+
+class ShortcutTable:
+    # kind names the entries in error messages ('shortcut', 'playback action')
+    def __init__(self, injector, definitions, kind='shortcut'):
+        self.injector = injector
+        self.kind = kind
+        self.latency = backend_latency.labels('keyboard', 'send')
+        self.errors = backend_errors.labels('keyboard', 'send')
+        self.labels = {}
+        self.prepared = {}
+        for name, (label, events) in compile_shortcuts(definitions).items():
+            self.labels[name] = label
+            self.prepared[name] = injector.prepare(events)
+
+    def send(self, name):
+        prepared = self.prepared.get(name)
+        if prepared is None:
+            raise ValueError(f'Unknown {self.kind}: {name}')
+        started = time.perf_counter()
+        try:
+            self.injector.send(prepared)
+        except Exception:
+            self.errors.inc()
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+
+# Backends and the state built on them, set by create_app()
+key_injector = shortcuts = media_keys = None
+audio_worker = player_state = volume_writer = volume_ramper = level_meter = audio_index = None
+now_playing = artwork_cache = None
+controller = None
+
+HTML_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="en" data-low-power="{{ low_power }}" data-websocket="{{ websocket }}">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <meta name="theme-color" content="{{ theme_color }}">
+    <title>PyWebPlayback Control Panel</title>
+    <link rel="manifest" href="/manifest.webmanifest">
+    <link rel="icon" href="{{ icon_url }}" type="image/svg+xml">
+    <link rel="apple-touch-icon" href="{{ touch_icon_url }}">
+    <link href="{{ style_url }}" rel="stylesheet">
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1 class="title">PyWebPlayback for WindowsControl Panel</h1>
+            <div class="version">{{ version }}</div>
+        </div>
+
+        <div class="control-panel">
+            <div class="now-playing" hidden>
+                <img class="now-playing-art" alt="" hidden>
+                <div>
+                    <div class="now-playing-title"></div>
+                    <div class="now-playing-artist"></div>
+                </div>
+            </div>
+            <div class="playback-controls">
+                <button class="control-button" id="prevButton">⏮</button>
+                <button class="control-button" id="playPauseButton">⏯</button>
+                <button class="control-button" id="nextButton">⏭</button>
+            </div>
+            <div class="volume-control">
+                <button class="control-button" id="muteButton">🔊</button>
+                <input type="range" class="volume-slider" min="0" max="100" value="50">
+                <div class="volume-value">50%</div>
+            </div>
+            <div class="level-meter">
+                <div class="level-rms"></div>
+                <div class="level-peak"></div>
+            </div>
+
+            <div class="shortcut-controls">
+                {% for name, label in shortcuts.items() %}
+                <button class="shortcut-button" data-shortcut="{{ name }}">{{ label }}</button>
+                {% endfor %}
+            </div>
+
+            {% if nodes %}
+            <div class="node-controls">
+                <div class="shortcut-controls">
+                    <button class="shortcut-button" data-node-route="mute" data-node-data='{"muted": true}'>Mute all</button>
+                    <button class="shortcut-button" data-node-route="mute" data-node-data='{"muted": false}'>Unmute all</button>
+                    <button class="shortcut-button" data-node-route="playback" data-node-data='{"action": "playpause"}'>Play/Pause all</button>
+                </div>
+                <div class="node-list"></div>
+            </div>
+            {% endif %}
+
+            <div class="system-controls">
+                <button class="system-button" id="shutdownButton">Shutdown Service</button>
+            </div>
+
+            <div class="log-container"></div>
+        </div>
+    </div>
+
+    <script src="{{ script_url }}"></script>
+</body>
+</html>
+'''
+
+STYLE_SHEET = '''
+:root {
+    --primary-color: rgba(82, 108, 235, 0.9);
+    --accent-color: rgba(255, 255, 255, 0.9);
+    --text-shadow: 2px 2px 4px rgba(0, 0, 0, 0.5);
+}
+
+* {
+    margin: 0;
+    padding: 0;
+    box-sizing: border-box;
+}
+
+body {
+    font-family: 'Noto Sans', system-ui, -apple-system, 'Segoe UI', Roboto, sans-serif;
+    min-height: 100vh;
+    background: linear-gradient(-45deg, #ee7752, #e73c7e, #23a6d5, #23d5ab);
+    background-size: 400% 400%;
+    color: white;
+    animation: gradient 15s ease infinite;
+}
+
+@keyframes gradient {
+    0% {
+        background-position: 0% 50%;
+    }
+    50% {
+        background-position: 100% 50%;
+    }
+    100% {
+        background-position: 0% 50%;
+    }
+}
+
+.container {
+    max-width: 1200px;
+    margin: 0 auto;
+    padding: 2rem;
+    min-height: 100vh;
+    display: flex;
+    flex-direction: column;
+    backdrop-filter: blur(10px);
+}
+
+.header {
+    text-align: center;
+    margin-bottom: 3rem;
+    padding: 2rem;
+    background: rgba(0, 0, 0, 0.5);
+    border-radius: 15px;
+    box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
+}
+
+.title {
+    font-size: 2.5rem;
+    margin-bottom: 1rem;
+    text-shadow: var(--text-shadow);
+    color: var(--accent-color);
+}
+
+.version {
+    font-size: 1rem;
+    color: #aaa;
+}
+
+.control-panel {
+    background: rgba(0, 0, 0, 0.5);
+    padding: 2rem;
+    border-radius: 15px;
+    box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
+}
+
+.now-playing {
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    gap: 1rem;
+    margin-bottom: 2rem;
+}
+
+.now-playing[hidden], .now-playing-art[hidden] {
+    display: none;
+}
+
+.now-playing-art {
+    width: 96px;
+    height: 96px;
+    object-fit: cover;
+    border-radius: 10px;
+}
+
+.now-playing-title {
+    font-size: 1.2rem;
+    color: var(--accent-color);
+}
+
+.now-playing-artist {
+    color: #aaa;
+}
+
+.playback-controls {
+    display: flex;
+    justify-content: center;
+    align-items: center;
+    gap: 2rem;
+    margin-bottom: 2rem;
+}
+
+.control-button {
+    background: var(--primary-color);
+    border: none;
+    border-radius: 50%;
+    width: 50px;
+    height: 50px;
+    cursor: pointer;
+    color: white;
+    font-size: 1.5rem;
+    transition: all 0.3s ease;
+}
+
+.control-button:hover {
+    transform: scale(1.1);
+    background: rgba(82, 108, 235, 1);
+}
+
+.volume-control {
+    display: flex;
+    align-items: center;
+    gap: 1rem;
+    margin-bottom: 2rem;
+}
+
+.volume-slider {
+    flex: 1;
+    -webkit-appearance: none;
+    height: 8px;
+    background: rgba(255, 255, 255, 0.1);
+    border-radius: 4px;
+    outline: none;
+}
+
+.volume-slider::-webkit-slider-thumb {
+    -webkit-appearance: none;
+    width: 20px;
+    height: 20px;
+    background: var(--primary-color);
+    border-radius: 50%;
+    cursor: pointer;
+    transition: all 0.3s ease;
+}
+
+.volume-slider::-webkit-slider-thumb:hover {
+    transform: scale(1.2);
+}
+
+.volume-value {
+    min-width: 60px;
+    text-align: center;
+    font-size: 1.2rem;
+    color: var(--accent-color);
+}
+
+.level-meter {
+    position: relative;
+    height: 6px;
+    margin: -1rem 0 2rem;
+    background: rgba(255, 255, 255, 0.1);
+    border-radius: 3px;
+    overflow: hidden;
+}
+
+.level-rms, .level-peak {
+    position: absolute;
+    inset: 0;
+    transform: scaleX(0);
+    transform-origin: left;
+}
+
+.level-rms {
+    background: var(--accent-color);
+}
+
+.level-peak {
+    background: rgba(255, 255, 255, 0.35);
+}
+
+html.low-power .level-meter {
+    display: none;
+}
+
+.log-container {
+    margin-top: 2rem;
+    background: rgba(0, 0, 0, 0.3);
+    padding: 1rem;
+    border-radius: 10px;
+    height: 300px;
+    overflow-y: auto;
+}
+
+.log-entry {
+    padding: 0.5rem;
+    margin-bottom: 0.5rem;
+    border-radius: 5px;
+    font-family: monospace;
+}
+
+.log-info {
+    background: rgba(82, 108, 235, 0.2);
+}
+
+.log-error {
+    background: rgba(235, 82, 82, 0.2);
+}
+
+.shortcut-controls {
+    display: flex;
+    justify-content: center;
+    gap: 1rem;
+    margin: 2rem 0;
+}
+
+.shortcut-button {
+    background: var(--primary-color);
+    border: none;
+    border-radius: 8px;
+    padding: 10px 20px;
+    color: white;
+    cursor: pointer;
+    transition: all 0.3s ease;
+}
+
+.shortcut-button:hover {
+    transform: scale(1.05);
+    background: rgba(82, 108, 235, 1);
+}
+
+.system-controls {
+    display: flex;
+    justify-content: center;
+    gap: 1rem;
+    margin-top: 2rem;
+}
+
+.system-button {
+    background: #dc3545;
+    border: none;
+    border-radius: 8px;
+    padding: 10px 20px;
+    color: white;
+    cursor: pointer;
+    transition: all 0.3s ease;
+}
+
+.system-button:hover {
+    transform: scale(1.05);
+    background: #c82333;
+}
+
+@keyframes fadeIn {
+    from { opacity: 0; }
+    to { opacity: 1; }
+}
+
+.node-list {
+    display: grid;
+    grid-template-columns: repeat(auto-fill, minmax(200px, 1fr));
+    gap: 0.5rem;
+    margin-bottom: 2rem;
+}
+
+.node {
+    background: rgba(0, 0, 0, 0.3);
+    padding: 0.5rem 1rem;
+    border-radius: 8px;
+}
+
+.node-offline {
+    color: #aaa;
+}
+
+/* Low-power mode: nothing animates or blurs, so the GPU can idle */
+html.low-power *, html.low-power *::before, html.low-power *::after {
+    animation: none !important;
+    transition: none !important;
+    backdrop-filter: none !important;
+}
+'''
+
+SCRIPT = '''
+// Dynamic color background
+function getRandomColor() {
+    return `#${Math.floor(Math.random()*16777215).toString(16)}`;
+}
+
+function updateBackground() {
+    const color1 = getRandomColor();
+    const color2 = getRandomColor();
+    const color3 = getRandomColor();
+    const color4 = getRandomColor();
+    document.body.style.background = `linear-gradient(-45deg, ${color1}, ${color2}, ${color3}, ${color4})`;
+    document.body.style.backgroundSize = '400% 400%';
+    document.body.style.animation = 'gradient 15s ease infinite';
+}
+
+// Low-power mode: picked from the config, or from the reduced motion
+// preference and the battery when the config says auto
+const lowPowerSetting = document.documentElement.dataset.lowPower;
+const reducedMotion = window.matchMedia('(prefers-reduced-motion: reduce)');
+let onBattery = false;
+
+function isLowPower() {
+    if (lowPowerSetting !== 'auto') return lowPowerSetting === 'on';
+    return reducedMotion.matches || onBattery;
+}
+
+function updatePowerMode() {
+    document.documentElement.classList.toggle('low-power', isLowPower());
+    document.dispatchEvent(new Event('powermodechange'));
+}
+
+updatePowerMode();
+reducedMotion.addEventListener('change', updatePowerMode);
+if (navigator.getBattery) {
+    navigator.getBattery().then((battery) => {
+        const update = () => {
+            onBattery = !battery.charging;
+            updatePowerMode();
+        };
+        update();
+        battery.addEventListener('chargingchange', update);
+    });
+}
+
+// Everything that polls or streams stops while the tab is hidden
+const visibilityHandlers = [];
+
+function whileVisible(start, stop) {
+    visibilityHandlers.push({start, stop});
+    if (!document.hidden) start();
+}
+
+document.addEventListener('visibilitychange', () => {
+    visibilityHandlers.forEach((handler) => document.hidden ? handler.stop() : handler.start());
+});
+
+// Initial background, then a new one every 10 seconds unless saving power
+updateBackground();
+let backgroundTimer = null;
+whileVisible(
+    () => { backgroundTimer = setInterval(() => { if (!isLowPower()) updateBackground(); }, 10000); },
+    () => clearInterval(backgroundTimer)
+);
+
+// Playback controls
+const playPauseButton = document.getElementById('playPauseButton');
+const prevButton = document.getElementById('prevButton');
+const nextButton = document.getElementById('nextButton');
+const muteButton = document.getElementById('muteButton');
+const volumeSlider = document.querySelector('.volume-slider');
+const volumeValue = document.querySelector('.volume-value');
+const logContainer = document.querySelector('.log-container');
+
+// Shortcut buttons
+const shortcutButtons = document.querySelectorAll('[data-shortcut]');
+const shutdownButton = document.getElementById('shutdownButton');
+
+// Last state reported by the server; buttons only ever show this
+let playerState = {volume: null, muted: false, playing: false};
+
+// Commands go over one WebSocket when the server offers it and fall back to
+// HTTP whenever the socket is not open. Messages are [id, route, value] up and
+// [id, 1, state] or [id, 0, message] down.
+const HTTP_FIELDS = {volume: 'volume', mute: 'muted', playback: 'action', shortcut: 'shortcut'};
+const channel = {socket: null, nextId: 1, pending: new Map(), retryDelay: 1000, wanted: false};
+
+function openChannel() {
+    if (document.documentElement.dataset.websocket !== 'on' || !window.WebSocket) return;
+    channel.wanted = true;
+    const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${scheme}://${location.host}/ws`);
+    socket.addEventListener('open', () => { channel.retryDelay = 1000; });
+    socket.addEventListener('message', (event) => {
+        const [id, ok, payload, retryAfter] = JSON.parse(event.data);
+        const pending = channel.pending.get(id);
+        if (!pending) return;
+        channel.pending.delete(id);
+        clearTimeout(pending.timer);
+        pending.resolve(ok ? {status: 'success', ...payload} : {status: 'error', message: payload, retryAfter});
+    });
+    socket.addEventListener('close', () => {
+        if (channel.socket !== socket) return;
+        channel.socket = null;
+        channel.pending.forEach((pending) => pending.reject(new Error('Channel closed')));
+        channel.pending.clear();
+        if (channel.wanted) {
+            setTimeout(() => { if (channel.wanted && !channel.socket) openChannel(); }, channel.retryDelay);
+            channel.retryDelay = Math.min(channel.retryDelay * 2, 30000);
+        }
+    });
+    channel.socket = socket;
+}
+
+function closeChannel() {
+    channel.wanted = false;
+    if (channel.socket) channel.socket.close();
+    channel.socket = null;
+}
+
+function sendOverChannel(route, value) {
+    return new Promise((resolve, reject) => {
+        const id = channel.nextId++;
+        const timer = setTimeout(() => {
+            channel.pending.delete(id);
+            reject(new Error('Channel timed out'));
+        }, 5000);
+        channel.pending.set(id, {resolve, reject, timer});
+        channel.socket.send(JSON.stringify([id, route, value]));
+    });
+}
+
+async function command(route, value) {
+    if (channel.socket && channel.socket.readyState === WebSocket.OPEN) {
+        try {
+            const data = await sendOverChannel(route, value);
+            if (data.status === 'success') showState(data);
+            if (data.retryAfter && route === 'volume') retryVolume(data.retryAfter);
+            return data;
+        } catch (error) {
+            // Fall through to HTTP
+        }
+    }
+    if (route === 'volume') {
+        const response = await postVolume(value);
+        if (response.status === 429) retryVolume(parseInt(response.headers.get('Retry-After')));
+        return response.json();
+    }
+    const response = await fetch(`/${route}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({[HTTP_FIELDS[route]]: value})
+    });
+    return response.json();
+}
+
+// Shortcut handlers
+async function sendShortcut(shortcut) {
+    try {
+        const data = await command('shortcut', shortcut);
+        if (data.status !== 'success') {
+            console.error('Error sending shortcut:', data.message);
+        }
+    } catch (error) {
+        console.error('Error sending shortcut:', error);
+    }
+}
+
+shortcutButtons.forEach((button) => {
+    button.addEventListener('click', () => sendShortcut(button.dataset.shortcut));
+});
+
+shutdownButton.addEventListener('click', async () => {
+    if (confirm('Are you sure you want to shutdown the service?')) {
+        try {
+            await fetch('/shutdown', { method: 'POST' });
+        } catch (error) {
+            console.error('Error shutting down service:', error);
+        }
+    }
+});
+
+playPauseButton.addEventListener('click', async () => {
+    try {
+        const data = await command('playback', 'playpause');
+        if (data.status === 'success') {
+            showState({playing: data.playing});
+        }
+    } catch (error) {
+        console.error('Error toggling playback:', error);
+    }
+});
+
+prevButton.addEventListener('click', async () => {
+    try {
+        await command('playback', 'previous');
+    } catch (error) {
+        console.error('Error changing to previous track:', error);
+    }
+});
+
+nextButton.addEventListener('click', async () => {
+    try {
+        await command('playback', 'next');
+    } catch (error) {
+        console.error('Error changing to next track:', error);
+    }
+});
+
+// Sequence numbers let the server drop slider writes that arrive out of order
+const clientId = Math.random().toString(36).slice(2);
+let volumeSeq = 0;
+
+function postVolume(volume) {
+    return fetch('/volume', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({volume: volume, seq: ++volumeSeq, client: clientId})
+    });
+}
+
+muteButton.addEventListener('click', async () => {
+    try {
+        const data = await command('mute', !playerState.muted);
+        if (data.status === 'success') {
+            showState({muted: data.muted});
+        }
+    } catch (error) {
+        console.error('Error toggling mute:', error);
+    }
+});
+
+// Now playing
+const nowPlaying = document.querySelector('.now-playing');
+const nowPlayingArt = document.querySelector('.now-playing-art');
+const nowPlayingTitle = document.querySelector('.now-playing-title');
+const nowPlayingArtist = document.querySelector('.now-playing-artist');
+
+async function updateNowPlaying() {
+    try {
+        const response = await fetch('/nowplaying');
+        const data = await response.json();
+        if (data.status !== 'success') return;
+        const track = data.track;
+        nowPlaying.hidden = !track;
+        if (!track) return;
+        nowPlayingTitle.textContent = track.title;
+        nowPlayingArtist.textContent = track.album ? `${track.artist} · ${track.album}` : track.artist;
+        // Artwork URLs are content-hashed, so an unchanged URL is never refetched
+        nowPlayingArt.hidden = !track.artwork;
+        if (track.artwork && nowPlayingArt.getAttribute('src') !== track.artwork) {
+            nowPlayingArt.src = track.artwork;
+        }
+    } catch (error) {
+        console.error('Error fetching now playing:', error);
+    }
+}
+
+let nowPlayingTimer = null;
+whileVisible(
+    () => {
+        updateNowPlaying();
+        nowPlayingTimer = setInterval(updateNowPlaying, 5000);
+    },
+    () => clearInterval(nowPlayingTimer)
+);
+[playPauseButton, prevButton, nextButton].forEach((button) => {
+    button.addEventListener('click', () => setTimeout(updateNowPlaying, 500));
+});
+
+let draggingVolume = false;
+
+function showVolume(volume) {
+    // Don't fight the user's finger while the slider is being dragged
+    if (draggingVolume) return;
+    volumeSlider.value = volume;
+    volumeValue.textContent = `${volume}%`;
+}
+
+function showState(state) {
+    playerState = {...playerState, ...state};
+    if (state.volume !== undefined && state.volume !== null) showVolume(state.volume);
+    muteButton.textContent = playerState.muted ? '🔇' : '🔊';
+    playPauseButton.textContent = playerState.playing ? '⏸' : '▶';
+}
+
+async function updateVolume() {
+    try {
+        // The browser revalidates with the ETag; unchanged state is a 304
+        const response = await fetch('/get_volume');
+        const data = await response.json();
+        if (data.status === 'success') {
+            showState(data);
+        }
+    } catch (error) {
+        console.error('Error fetching volume:', error);
+    }
+}
+
+volumeSlider.addEventListener('pointerdown', () => { draggingVolume = true; });
+['pointerup', 'pointercancel', 'change'].forEach((type) => {
+    volumeSlider.addEventListener(type, () => { draggingVolume = false; });
+});
+
+// When rate limited, send wherever the slider ends up once the server allows it
+let volumeRetry = null;
+
+function retryVolume(seconds) {
+    if (volumeRetry) return;
+    volumeRetry = setTimeout(async () => {
+        volumeRetry = null;
+        try {
+            await command('volume', parseInt(volumeSlider.value));
+        } catch (error) {
+            console.error('Error setting volume:', error);
+        }
+    }, (seconds || 1) * 1000);
+}
+
+// Update volume display
+volumeSlider.addEventListener('input', async () => {
+    volumeValue.textContent = `${volumeSlider.value}%`;
+    try {
+        await command('volume', parseInt(volumeSlider.value));
+    } catch (error) {
+        console.error('Error setting volume:', error);
+    }
+});
+
+// Real-time logs
+// Sequence number of the newest log line shown
+let logSeq = 0;
+
+function showLog(log) {
+    if (log.seq <= logSeq) return;
+    logSeq = log.seq;
+    const logEntry = document.createElement('div');
+    logEntry.className = `log-entry log-${log.type}`;
+    logEntry.textContent = log.message;
+    logContainer.appendChild(logEntry);
+
+    // Auto-scroll to bottom
+    logContainer.scrollTop = logContainer.scrollHeight;
+
+    // Keep only last 100 entries
+    while (logContainer.children.length > 100) {
+        logContainer.removeChild(logContainer.firstChild);
+    }
+}
+
+async function fetchLogs() {
+    try {
+        const response = await fetch(`/logs?since=${logSeq}`);
+        const data = await response.json();
+        data.logs.forEach(showLog);
+    } catch (error) {
+        console.error('Error fetching logs:', error);
+    }
+}
+
+// Polling is only the fallback when server-sent events are unavailable
+let volumePoller = null;
+
+function startVolumePolling() {
+    if (volumePoller) return;
+    updateVolume();
+    volumePoller = setInterval(updateVolume, 2000);
+}
+
+function stopVolumePolling() {
+    clearInterval(volumePoller);
+    volumePoller = null;
+}
+
+whileVisible(openChannel, closeChannel);
+
+// Level meter: "peak rms" frames, both 0-255, sent on the event stream
+// unless saving power
+const levelRms = document.querySelector('.level-rms');
+const levelPeak = document.querySelector('.level-peak');
+
+function showLevel(peak, rms) {
+    levelPeak.style.transform = `scaleX(${peak / 255})`;
+    levelRms.style.transform = `scaleX(${rms / 255})`;
+}
+
+let logPoller = null;
+
+function startLogPolling() {
+    if (!logPoller) logPoller = setInterval(fetchLogs, 1000);
+}
+
+function stopLogPolling() {
+    clearInterval(logPoller);
+    logPoller = null;
+}
+
+// Controller mode: every node's state in one list, refreshed while visible
+const nodeList = document.querySelector('.node-list');
+
+async function updateNodes() {
+    try {
+        const response = await fetch('/nodes');
+        const data = await response.json();
+        if (data.status !== 'success') return;
+        nodeList.replaceChildren(...Object.entries(data.nodes).map(([name, node]) => {
+            const row = document.createElement('div');
+            row.className = node.status === 'success' ? 'node' : 'node node-offline';
+            row.textContent = node.status === 'success'
+                ? `${name}: ${node.volume}% ${node.muted ? '🔇' : '🔊'}`
+                : `${name}: ${node.message}`;
+            return row;
+        }));
+    } catch (error) {
+        console.error('Error fetching nodes:', error);
+    }
+}
+
+if (nodeList) {
+    let nodesTimer = null;
+    whileVisible(
+        () => {
+            updateNodes();
+            nodesTimer = setInterval(updateNodes, 3000);
+        },
+        () => clearInterval(nodesTimer)
+    );
+    document.querySelectorAll('[data-node-route]').forEach((button) => {
+        button.addEventListener('click', async () => {
+            try {
+                await fetch('/nodes/command', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({route: button.dataset.nodeRoute, data: JSON.parse(button.dataset.nodeData)})
+                });
+                updateNodes();
+            } catch (error) {
+                console.error('Error sending node command:', error);
+            }
+        });
+    });
+}
+
+// One event stream per page carries volume, log and meter events; the server
+// only has so many threads for streams, so it may refuse one and the page polls
+let events = null;
+let eventsMeter = false;
+
+function startPolling() {
+    startVolumePolling();
+    startLogPolling();
+}
+
+function stopPolling() {
+    stopVolumePolling();
+    stopLogPolling();
+}
+
+function openEventStream() {
+    // Catch up on anything missed while hidden
+    updateVolume();
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    // Log lines resume after the last one shown, so nothing is lost while hidden
+    eventsMeter = !isLowPower();
+    events = new EventSource(`/events?logs=${logSeq}&meter=${eventsMeter ? 1 : 0}`);
+    events.addEventListener('volume', (event) => showState(JSON.parse(event.data)));
+    events.addEventListener('log', (event) => showLog(JSON.parse(event.data)));
+    events.addEventListener('meter', (event) => showLevel(...event.data.split(' ').map(Number)));
+    events.addEventListener('open', stopPolling);
+    events.addEventListener('error', startPolling);
+}
+
+function closeEventStream() {
+    if (events) events.close();
+    events = null;
+    stopPolling();
+    showLevel(0, 0);
+}
+
+whileVisible(openEventStream, closeEventStream);
+// Reopened when low-power mode turns the meter on or off
+document.addEventListener('powermodechange', () => {
+    if (events && eventsMeter === isLowPower()) {
+        closeEventStream();
+        openEventStream();
+    }
+});
+
+// Installable app with the page served from cache; service workers only run
+// on HTTPS or localhost
+if ('serviceWorker' in navigator) {
+    window.addEventListener('load', () => {
+        navigator.serviceWorker.register('/sw.js').catch((error) => {
+            console.error('Error registering service worker:', error);
+        });
+    });
+}
+'''
+
+# The shell (page, CSS, JS, fonts, icons) is cached under a name that changes
+# with the version and the page, so an update installs a new worker which drops
+# the old cache. Everything else, the API included, goes to the network.
+SERVICE_WORKER = '''
+const CACHE = {{ cache | tojson }};
+const SHELL = {{ shell | tojson }};
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(CACHE)
+            .then((cache) => cache.addAll(SHELL.map((url) => new Request(url, { cache: 'reload' }))))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then((keys) => Promise.all(keys
+                .filter((key) => key.startsWith('pywebplayback-') && key !== CACHE)
+                .map((key) => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', (event) => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== 'GET' || url.origin !== location.origin) return;
+    const key = event.request.mode === 'navigate' && url.pathname === '/' ? '/' : url.pathname;
+    if (!SHELL.includes(key)) return;
+    event.respondWith(caches.open(CACHE)
+        .then((cache) => cache.match(key))
+        .then((cached) => cached || fetch(event.request)));
+});
+'''
+
+# UI assets are rendered and compressed once at startup and served from memory.
+# CSS/JS/fonts live under content-hashed URLs and can be cached forever; the
+# page itself is revalidated through its ETag.
+fonts_dir = path.join(path.dirname(path.abspath(__file__)), 'fonts')
+# Optional bundled fonts: (weight, local name, file in fonts_dir)
+FONT_FILES = [
+    (400, 'Noto Sans', 'NotoSans-Regular.woff2'),
+    (700, 'Noto Sans Bold', 'NotoSans-Bold.woff2'),
+]
+IMMUTABLE = 'public, max-age=31536000, immutable'
+THEME_COLOR = '#526ceb'
+ICON_SVG = '''<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100">
+<rect width="100" height="100" fill="#526ceb"/><path d="M36 27v46l38-23z" fill="#fff"/></svg>'''
+
+class StaticAsset:
+    def __init__(self, body, content_type, cache_control, compress=True):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.content_type = content_type
+        self.cache_control = cache_control
+        # Content-Encoding -> (body, strong ETag); every encoding gets its own tag
+        self.variants = {None: (body, self.digest)}
+        if compress:
+            self.variants['gzip'] = (gzip.compress(body, 9, mtime=0), f'{self.digest}-gz')
+            if brotli is not None:
+                self.variants['br'] = (brotli.compress(body, quality=11), f'{self.digest}-br')
+
+    def response(self):
+        encoding = None
+        for candidate in ('br', 'gzip'):
+            if candidate in self.variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        body, etag = self.variants[encoding]
+
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, content_type=self.content_type)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = self.cache_control
+        response.vary.add('Accept-Encoding')
+        return response
+
+def hashed_name(name, asset):
+    stem, ext = name.rsplit('.', 1)
+    return f'{stem}.{asset.digest[:10]}.{ext}'
+
+def icon_png(size):
+    # ICON_SVG as a PNG for launchers that need one: a white play triangle on
+    # the theme colour, drawn row by row
+    background, foreground = bytes((82, 108, 235)), b'\xff\xff\xff'
+    left, top, bottom, right = (round(size * edge / 100) for edge in (36, 27, 73, 74))
+    middle = (top + bottom) / 2
+    rows = []
+    for y in range(size):
+        width = 0
+        if top <= y < bottom:
+            width = round((right - left) * (1 - abs(y + 0.5 - middle) / (middle - top)))
+        rows.append(background * left + foreground * width + background * (size - left - width))
+    return rgb_png(size, size, rows)
+
+def build_ui(websocket=False):
+    # Returns (page, manifest, service worker, {asset name: StaticAsset})
+    assets = {}
+    font_faces = []
+    for weight, local_name, filename in FONT_FILES:
+        font_path = path.join(fonts_dir, filename)
+        if not path.exists(font_path):
+            continue
+        with open(font_path, 'rb') as f:
+            # woff2 is already compressed
+            font = StaticAsset(f.read(), 'font/woff2', IMMUTABLE, compress=False)
+        name = hashed_name(filename, font)
+        assets[name] = font
+        font_faces.append(
+            f"@font-face {{ font-family: 'Noto Sans'; font-weight: {weight}; font-display: swap; "
+            f"src: local('{local_name}'), url(/assets/{name}) format('woff2'); }}\n")
 
-app = Flask(__name__)
+    style = StaticAsset(''.join(font_faces) + STYLE_SHEET, 'text/css; charset=utf-8', IMMUTABLE)
+    style_name = hashed_name('app.css', style)
+    assets[style_name] = style
+    script = StaticAsset(SCRIPT, 'application/javascript; charset=utf-8', IMMUTABLE)
+    script_name = hashed_name('app.js', script)
+    assets[script_name] = script
+    icons = {}
+    for filename, body, content_type, sizes in (('icon.svg', ICON_SVG, 'image/svg+xml', 'any'),
+                                                ('icon-192.png', icon_png(192), 'image/png', '192x192'),
+                                                ('icon-512.png', icon_png(512), 'image/png', '512x512')):
+        icon = StaticAsset(body, content_type, IMMUTABLE, compress=content_type != 'image/png')
+        icons[filename] = {'src': f'/assets/{hashed_name(filename, icon)}', 'sizes': sizes, 'type': content_type}
+        assets[hashed_name(filename, icon)] = icon
 
-# Set up logging
-log_dir = path.join(expanduser('~'), 'documents', 'logs')
-makedirs(log_dir, exist_ok=True)
+    html = app.jinja_env.from_string(HTML_TEMPLATE).render(
+        version=version,
+        shortcuts=shortcuts.labels,
+        low_power={True: 'on', False: 'off'}.get(config['ui']['low_power'], 'auto'),
+        nodes=config['controller']['nodes'],
+        websocket='on' if websocket else 'off',
+        style_url=f'/assets/{style_name}',
+        script_url=f'/assets/{script_name}',
+        theme_color=THEME_COLOR,
+        icon_url=icons['icon.svg']['src'],
+        touch_icon_url=icons['icon-192.png']['src'],
+    )
+    page = StaticAsset(html, 'text/html; charset=utf-8', 'no-cache')
 
-# Access log
-access_log = path.join(log_dir, 'access.log')
-access_handler = RotatingFileHandler(access_log, maxBytes=100*1024*1024, backupCount=5)  # 100MB limit
-access_handler.setLevel(logging.INFO)
-access_formatter = logging.Formatter('%(asctime)s - %(message)s')
-access_handler.setFormatter(access_formatter)
+    manifest = StaticAsset(json.dumps({
+        'name': 'PyWebPlayback Control Panel',
+        'short_name': 'PyWebPlayback',
+        'start_url': '/',
+        'scope': '/',
+        'display': 'standalone',
+        'background_color': THEME_COLOR,
+        'theme_color': THEME_COLOR,
+        'icons': list(icons.values()),
+    }), 'application/manifest+json', 'no-cache')
+    worker = StaticAsset(app.jinja_env.from_string(SERVICE_WORKER).render(
+        cache=f'pywebplayback-{version}-{page.digest[:10]}',
+        shell=['/', '/manifest.webmanifest'] + [f'/assets/{name}' for name in assets],
+    ), 'application/javascript; charset=utf-8', 'no-cache')
+    return page, manifest, worker, assets
 
-# Error log  
-error_log = path.join(log_dir, 'error.log')
-error_handler = RotatingFileHandler(error_log, maxBytes=100*1024*1024, backupCount=5)  # 100MB limit
-error_handler.setLevel(logging.WARNING)
-error_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-error_handler.setFormatter(error_formatter)
+ui_page = ui_manifest = ui_worker = ui_assets = None
 
-app.logger.addHandler(access_handler)
-app.logger.addHandler(error_handler)
-app.logger.setLevel(logging.INFO)
+@routes.route('/logs')
+def get_logs():
+    logs, seq = log_buffer.since(request.args.get('since', 0, type=int))
+    return jsonify({'status': 'success', 'seq': seq, 'logs': logs})
 
-# Queue for real-time logs
-log_queue = queue.Queue(maxsize=100)
+def parse_log_time(value, default):
+    # Epoch seconds or ISO-8601 local time
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
 
-# Load config from JSON
-config_dir = path.join(expanduser('~'), 'documents', 'config')
-config_file = path.join(config_dir, 'PyWebPlayback.json')
+@routes.route('/logs/search')
+def search_logs():
+    handler = LOG_FILES.get(request.args.get('log', 'access'))
+    if handler is None:
+        return jsonify({'status': 'error', 'message': 'log must be access or error'})
+    try:
+        start = parse_log_time(request.args.get('from'), 0.0)
+        end = parse_log_time(request.args.get('to'), float('inf'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid time: {str(e)}'})
+    min_level = 0
+    if request.args.get('level'):
+        min_level = logging.getLevelName(request.args['level'].upper())
+        if not isinstance(min_level, int):
+            return jsonify({'status': 'error', 'message': 'Unknown level'})
+    limit = request.args.get('limit', 10000, type=int)
+    ip = request.args.get('ip')
 
-# Create config directory if not exists
-makedirs(config_dir, exist_ok=True)
+    matches = handler.search(start, end, ip=ip, min_level=min_level, limit=limit)
+    return Response(matches, mimetype='text/plain', headers={'X-Accel-Buffering': 'no'})
 
-# Default config
-default_config = {
-    "baseport": 80,
-    "listenaddress": "0.0.0.0",
-    "debug": False
-}
+# Event streams. Each open stream holds a server thread for as long as it
+# lasts, so the page opens just one (/events, carrying volume, log and meter
+# events)
+# and the number open at once is capped below the thread pool, keeping threads
+# free for ordinary requests. A refused stream makes the page poll instead.
+STREAM_RESERVED_THREADS = 8
 
-# Load or create config file
-if path.exists(config_file):
-    with open(config_file, 'r') as f:
-        config = json.load(f)
-else:
-    config = default_config
-    with open(config_file, 'w') as f:
-        json.dump(config, f, indent=4)
+class StreamSlots:
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.open = 0
 
-baseport = config['baseport']
-version = 'PyWebPlayback ver 1.0.1 Build 2024.12.30'
-service_link = f"http://localhost:{baseport}/"
+    def acquire(self):
+        with self.lock:
+            if self.open >= self.limit:
+                return False
+            self.open += 1
+            return True
 
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>PyWebPlayback Control Panel</title>
-    <link href="https://fonts.googleapis.com/css2?family=Noto+Sans:wght@400;700&display=swap" rel="stylesheet">
-    <style>
-        :root {
-            --primary-color: rgba(82, 108, 235, 0.9);
-            --accent-color: rgba(255, 255, 255, 0.9);
-            --text-shadow: 2px 2px 4px rgba(0, 0, 0, 0.5);
-        }
+    def release(self):
+        with self.lock:
+            self.open -= 1
 
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
+stream_slots = None
 
-        body {
-            font-family: 'Noto Sans', sans-serif;
-            min-height: 100vh;
-            background: linear-gradient(-45deg, #ee7752, #e73c7e, #23a6d5, #23d5ab);
-            background-size: 400% 400%;
-            color: white;
-            animation: gradient 15s ease infinite;
-        }
+metrics.callback('event_streams_open', 'gauge', 'Event streams currently open.',
+                 lambda: stream_slots.open if stream_slots else 0)
 
-        @keyframes gradient {
-            0% {
-                background-position: 0% 50%;
-            }
-            50% {
-                background-position: 100% 50%;
-            }
-            100% {
-                background-position: 0% 50%;
-            }
-        }
+def stream_limit(server):
+    # max_streams, lowered to what the waitress pool can spare
+    if server['mode'] != 'production':
+        return server['max_streams']
+    spare = max(0, server['threads'] - STREAM_RESERVED_THREADS)
+    if server['max_streams'] > spare:
+        app.logger.warning(f"server.threads={server['threads']} leaves room for {spare} event streams, not "
+                           f"max_streams={server['max_streams']}; pages beyond that poll instead")
+        return spare
+    return server['max_streams']
 
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 2rem;
-            min-height: 100vh;
-            display: flex;
-            flex-direction: column;
-            backdrop-filter: blur(10px);
-        }
+def stream_events(log_seq=None, volume=True, meter=False):
+    # Volume events when the player state changes, log events (with their seq
+    # as id) for every line after log_seq unless that is None, and with meter,
+    # "peak rms" meter events from the shared level meter. The meter is
+    # subscribed once the stream runs, and unsubscribed when the server closes
+    # the generator after the client has gone.
+    version = 0
+    tick = meter_tick = None
+    meter_seq = level_meter.subscribe() if meter else None
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            sent = False
+            # Read the ticks before the sources, so a change made meanwhile still
+            # ends the wait below
+            new_tick, meter_tick = stream_hub.tick, stream_hub.meter_tick
+            if new_tick != tick:
+                # Not after a wake-up for a meter frame alone
+                tick = new_tick
+                # Version 0 is "nothing published yet", so a stream opened while the
+                # backend is still starting waits for the first state
+                new_version, state = player_state.current()
+                if volume and new_version != version:
+                    version = new_version
+                    if state['volume'] is not None:
+                        yield f'event: volume\ndata: {json.dumps(state)}\n\n'
+                        sent = True
+                if log_seq is not None:
+                    logs, log_seq = log_buffer.since(log_seq)
+                    for log in logs:
+                        yield f'id: {log["seq"]}\nevent: log\ndata: {json.dumps(log)}\n\n'
+                        sent = True
+            if meter:
+                new_seq, frame = level_meter.latest()
+                if new_seq != meter_seq:
+                    meter_seq = new_seq
+                    yield f'event: meter\ndata: {frame[0]} {frame[1]}\n\n'
+                    sent = True
+            if not sent and not stream_hub.wait(tick, 15, meter_tick if meter else None):
+                # Keeps proxies and idle Wi-Fi links from dropping the connection
+                yield ': keepalive\n\n'
+    finally:
+        if meter:
+            level_meter.unsubscribe()
 
-        .header {
-            text-align: center;
-            margin-bottom: 3rem;
-            padding: 2rem;
-            background: rgba(0, 0, 0, 0.5);
-            border-radius: 15px;
-            box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
-        }
+def event_stream(stream):
+    if not stream_slots.acquire():
+        stream.close()
+        response = jsonify({'status': 'error', 'message': 'Too many open event streams'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    # The slot is given back when the server closes the response, including
+    # when the client has gone away
+    return Response(ClosingIterator(stream, stream_slots.release), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-        .title {
-            font-size: 2.5rem;
-            margin-bottom: 1rem;
-            text-shadow: var(--text-shadow);
-            color: var(--accent-color);
-        }
+def last_log_seq(param):
+    # EventSource resends the last id it saw on reconnect, so nothing is lost or repeated
+    seq = request.headers.get('Last-Event-ID', type=int)
+    return seq if seq is not None else request.args.get(param, type=int)
 
-        .version {
-            font-size: 1rem;
-            color: #aaa;
-        }
+@routes.route('/logs/stream')
+def stream_logs():
+    return event_stream(stream_events(last_log_seq('since') or 0, volume=False))
 
-        .control-panel {
-            background: rgba(0, 0, 0, 0.5);
-            padding: 2rem;
-            border-radius: 15px;
-            box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
-        }
+# Admission control. Rejections are answered before any backend or log work.
+class RateLimiter:
+    # Per-client token buckets, plus caps on backend requests in flight across
+    # all clients and from any one client
+    MAX_CLIENTS = 1024
+    CONCURRENCY_RETRY_AFTER = 1.0
 
-        .playback-controls {
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            gap: 2rem;
-            margin-bottom: 2rem;
-        }
+    def __init__(self, rate, burst, max_concurrent, max_per_client):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.max_per_client = max_per_client
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)
+        # client -> (tokens, monotonic time they were counted at), oldest first
+        self.buckets = {}
+        self.in_flight = 0
+        # client -> admitted requests not yet released, sleeping ones included
+        self.client_in_flight = {}
 
-        .control-button {
-            background: var(--primary-color);
-            border: none;
-            border-radius: 50%;
-            width: 50px;
-            height: 50px;
-            cursor: pointer;
-            color: white;
-            font-size: 1.5rem;
-            transition: all 0.3s ease;
-        }
+    def acquire(self, client, cost=1):
+        # Returns None when admitted, and the caller must release(); otherwise
+        # (reason, seconds to wait before retrying)
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < cost:
+                self.buckets[client] = (tokens, now)
+                return 'rate', (cost - tokens) / self.rate
+            running = self.client_in_flight.get(client, 0)
+            if running >= self.max_per_client:
+                self.buckets[client] = (tokens, now)
+                return 'client_concurrency', self.CONCURRENCY_RETRY_AFTER
+            if self.in_flight >= self.max_concurrent:
+                self.buckets[client] = (tokens, now)
+                return 'concurrency', self.CONCURRENCY_RETRY_AFTER
+            self.buckets[client] = (tokens - cost, now)
+            self.in_flight += 1
+            self.client_in_flight[client] = running + 1
+            if len(self.buckets) > self.MAX_CLIENTS:
+                del self.buckets[next(iter(self.buckets))]
+        return None
 
-        .control-button:hover {
-            transform: scale(1.1);
-            background: rgba(82, 108, 235, 1);
-        }
+    def release(self, client):
+        with self.lock:
+            self.in_flight -= 1
+            self.slot_freed.notify()
+            running = self.client_in_flight.pop(client) - 1
+            if running:
+                self.client_in_flight[client] = running
 
-        .volume-control {
-            display: flex;
-            align-items: center;
-            gap: 1rem;
-            margin-bottom: 2rem;
-        }
+    def suspend(self):
+        # An admitted request about to sleep (a batch delay) gives its shared
+        # slot back; it still counts against its client's cap
+        with self.lock:
+            self.in_flight -= 1
+            self.slot_freed.notify()
 
-        .volume-slider {
-            flex: 1;
-            -webkit-appearance: none;
-            height: 8px;
-            background: rgba(255, 255, 255, 0.1);
-            border-radius: 4px;
-            outline: none;
-        }
+    def resume(self):
+        # Waits for a shared slot after suspend(); running requests only hold
+        # theirs for as long as a backend call takes
+        with self.lock:
+            self.slot_freed.wait_for(lambda: self.in_flight < self.max_concurrent)
+            self.in_flight += 1
 
-        .volume-slider::-webkit-slider-thumb {
-            -webkit-appearance: none;
-            width: 20px;
-            height: 20px;
-            background: var(--primary-color);
-            border-radius: 50%;
-            cursor: pointer;
-            transition: all 0.3s ease;
-        }
+rate_limiter = None
+rate_limited_total = metrics.counter('rate_limited_total', 'Requests rejected by admission control.', ('route', 'reason'))
+metrics.callback('rate_limit_clients', 'gauge', 'Clients with a token bucket.',
+                 lambda: len(rate_limiter.buckets) if rate_limiter else 0)
+metrics.callback('backend_requests_in_flight', 'gauge', 'Admitted backend requests still running.',
+                 lambda: rate_limiter.in_flight if rate_limiter else 0)
 
-        .volume-slider::-webkit-slider-thumb:hover {
-            transform: scale(1.2);
-        }
+def rate_limited(cost=None):
+    # Route decorator; cost() gives the tokens a request takes, default one
+    def decorate(view):
+        @functools.wraps(view)
+        def limited(*args, **kwargs):
+            if rate_limiter is None:
+                return view(*args, **kwargs)
+            rejected = rate_limiter.acquire(request.remote_addr, cost() if cost else 1)
+            if rejected:
+                reason, retry_after = rejected
+                rate_limited_total.labels(request.url_rule.rule, reason).inc()
+                response = jsonify({'status': 'error', 'message': 'Too many requests'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(math.ceil(retry_after))
+                return response
+            try:
+                return view(*args, **kwargs)
+            finally:
+                rate_limiter.release(request.remote_addr)
+        return limited
+    return decorate
 
-        .volume-value {
-            min-width: 60px;
-            text-align: center;
-            font-size: 1.2rem;
-            color: var(--accent-color);
-        }
+# Request instrumentation
+class ActiveRequestsMiddleware:
+    # Counts a request until its response is closed, so open streams stay counted
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
 
-        .log-container {
-            margin-top: 2rem;
-            background: rgba(0, 0, 0, 0.3);
-            padding: 1rem;
-            border-radius: 10px;
-            height: 300px;
-            overflow-y: auto;
-        }
+    def __call__(self, environ, start_response):
+        active_requests.inc()
+        try:
+            response = self.wsgi_app(environ, start_response)
+        except Exception:
+            active_requests.dec()
+            raise
+        return ClosingIterator(response, active_requests.dec)
 
-        .log-entry {
-            padding: 0.5rem;
-            margin-bottom: 0.5rem;
-            border-radius: 5px;
-            font-family: monospace;
-        }
+def frame_label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        return name
+    return f'{name} ({path.basename(filename)}:{lineno})'
 
-        .log-info {
-            background: rgba(82, 108, 235, 0.2);
-        }
+def collapsed_stacks(stats):
+    # pstats only keeps caller -> callee totals, so a function's time is split
+    # across its call paths in proportion to what each caller spent in it.
+    # Yields ("frame;frame;frame", microseconds) pairs.
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller in callers:
+            callees.setdefault(caller, []).append(func)
+    stacks = {}
 
-        .log-error {
-            background: rgba(235, 82, 82, 0.2);
-        }
+    def walk(func, stack, on_path, share):
+        tt, ct = stats[func][2:4]
+        stack = f'{stack};{frame_label(func)}' if stack else frame_label(func)
+        own = round(tt * share * 1e6)
+        if own:
+            stacks[stack] = stacks.get(stack, 0) + own
+        for callee in callees.get(func, ()):
+            total = stats[callee][3]
+            if callee in on_path or not total:
+                continue
+            walk(callee, stack, on_path | {callee}, share * stats[callee][4][func][3] / total)
 
-        .shortcut-controls {
-            display: flex;
-            justify-content: center;
-            gap: 1rem;
-            margin: 2rem 0;
-        }
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        if not callers:
+            walk(func, '', {func}, 1.0)
+    yield from stacks.items()
 
-        .shortcut-button {
-            background: var(--primary-color);
-            border: none;
-            border-radius: 8px;
-            padding: 10px 20px;
-            color: white;
-            cursor: pointer;
-            transition: all 0.3s ease;
-        }
+class RequestProfiler:
+    # Profiles chosen requests with cProfile: the next N requests (optionally
+    # only on some routes) and an evenly spaced fraction of the requests on
+    # sampled routes. Each profile is written to the directory as <name>.pstats
+    # and <name>.collapsed ("frame;frame;frame microseconds" lines, the input
+    # format of flamegraph tools) by a writer thread. While nothing is armed the
+    # only cost per request is reading `armed`. One request is profiled at a
+    # time: cProfile only sees its own thread, and from Python 3.12 on only one
+    # profiler can be active per process.
+    RECENT = 50
 
-        .shortcut-button:hover {
-            transform: scale(1.05);
-            background: rgba(82, 108, 235, 1);
-        }
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.busy = threading.Lock()
+        self.armed = False
+        self.remaining = 0
+        self.routes = None
+        self.rates = {}
+        self.counters = {}
+        self.profiled = 0
+        self.recent = deque(maxlen=self.RECENT)
+        self.writer = None
 
-        .system-controls {
-            display: flex;
-            justify-content: center;
-            gap: 1rem;
-            margin-top: 2rem;
-        }
+    def configure(self, requests=0, routes=None, sample=None):
+        with self.lock:
+            self.remaining = requests
+            self.routes = set(routes) if routes else None
+            self.rates = dict(sample or {})
+            self.counters = {route: itertools.count(1) for route in self.rates}
+            self.armed = bool(self.remaining or self.rates)
 
-        .system-button {
-            background: #dc3545;
-            border: none;
-            border-radius: 8px;
-            padding: 10px 20px;
-            color: white;
-            cursor: pointer;
-            transition: all 0.3s ease;
-        }
+    def status(self):
+        with self.lock:
+            return {
+                'armed': self.armed,
+                'remaining': self.remaining,
+                'routes': sorted(self.routes) if self.routes else None,
+                'sample': self.rates,
+                'profiled': self.profiled,
+                'directory': self.directory,
+                'recent': list(self.recent),
+            }
 
-        .system-button:hover {
-            transform: scale(1.05);
-            background: #c82333;
-        }
+    def start(self, route):
+        # Returns a running profile if this request was picked, else None
+        if not self.busy.acquire(blocking=False):
+            return None
+        with self.lock:
+            counter = self.counters.get(route)
+            picked = counter is not None and evenly_sampled(counter, self.rates[route])
+            if not picked and self.remaining and (self.routes is None or route in self.routes):
+                self.remaining -= 1
+                self.armed = bool(self.remaining or self.rates)
+                picked = True
+            if picked:
+                self.profiled += 1
+                number = self.profiled
+        if not picked:
+            self.busy.release()
+            return None
+        # Imported here so an unprofiled server never loads the profiler
+        import cProfile
+        profile = cProfile.Profile()
+        profile.number = number
+        profile.enable()
+        return profile
 
-        @keyframes fadeIn {
-            from { opacity: 0; }
-            to { opacity: 1; }
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1 class="title">PyWebPlayback for WindowsControl Panel</h1>
-            <div class="version">{{ version }}</div>
-        </div>
+    def finish(self, profile, method, route):
+        profile.disable()
+        self.busy.release()
+        slug = ''.join(c if c.isalnum() else '_' for c in route.strip('/')) or 'root'
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{profile.number:04d}-{method}-{slug}"
+        with self.lock:
+            if self.writer is None:
+                self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ProfileWriter')
+        self.writer.submit(self.write, profile, name)
 
-        <div class="control-panel">
-            <div class="playback-controls">
-                <button class="control-button" id="prevButton">⏮</button>
-                <button class="control-button" id="playPauseButton">⏯</button>
-                <button class="control-button" id="nextButton">⏭</button>
-            </div>
-            <div class="volume-control">
-                <button class="control-button" id="muteButton">🔊</button>
-                <input type="range" class="volume-slider" min="0" max="100" value="50">
-                <div class="volume-value">50%</div>
-            </div>
+    def write(self, profile, name):
+        import pstats
+        try:
+            makedirs(self.directory, exist_ok=True)
+            stats = pstats.Stats(profile)
+            base = path.join(self.directory, name)
+            stats.dump_stats(base + '.pstats')
+            with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+                for stack, micros in collapsed_stacks(stats.stats):
+                    f.write(f'{stack} {micros}\n')
+        except Exception as e:
+            app.logger.error(f'Error writing profile {name}: {str(e)}')
+            return
+        self.recent.append(name)
 
-            <div class="shortcut-controls">
-                <button class="shortcut-button" id="alt1Button">Alt+1</button>
-                <button class="shortcut-button" id="alt2Button">Alt+2</button>
-                <button class="shortcut-button" id="alt3Button">Alt+3</button>
-                <button class="shortcut-button" id="ctrlAltLButton">Ctrl+Alt+L</button>
-                <button class="shortcut-button" id="altQButton">Alt+Q</button>
-            </div>
+profiler = None
 
-            <div class="system-controls">
-                <button class="system-button" id="shutdownButton">Shutdown Service</button>
-            </div>
+@routes.before_app_request
+def start_request_timer():
+    request.environ['pywebplayback.started'] = time.perf_counter()
 
-            <div class="log-container"></div>
-        </div>
-    </div>
+@routes.before_app_request
+def start_request_profile():
+    if profiler.armed:
+        profile = profiler.start(request.url_rule.rule if request.url_rule else 'unmatched')
+        if profile is not None:
+            request.environ['pywebplayback.profile'] = profile
 
-    <script>
-        // Dynamic color background
-        function getRandomColor() {
-            return `#${Math.floor(Math.random()*16777215).toString(16)}`;
-        }
+@routes.teardown_app_request
+def finish_request_profile(error):
+    profile = request.environ.pop('pywebplayback.profile', None)
+    if profile is not None:
+        profiler.finish(profile, request.method, request.url_rule.rule if request.url_rule else 'unmatched')
 
-        function updateBackground() {
-            const color1 = getRandomColor();
-            const color2 = getRandomColor();
-            const color3 = getRandomColor();
-            const color4 = getRandomColor();
-            document.body.style.background = `linear-gradient(-45deg, ${color1}, ${color2}, ${color3}, ${color4})`;
-            document.body.style.backgroundSize = '400% 400%';
-            document.body.style.animation = 'gradient 15s ease infinite';
-        }
+@routes.after_app_request
+def record_request_metrics(response):
+    started = request.environ.get('pywebplayback.started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.labels(route, request.method).observe(time.perf_counter() - started)
+        request_count.labels(route, request.method, response.status_code).inc()
+    return response
 
-        // Initial background
-        updateBackground();
-        // Change background every 10 seconds
-        setInterval(updateBackground, 10000);
-
-        // Playback controls
-        const playPauseButton = document.getElementById('playPauseButton');
-        const prevButton = document.getElementById('prevButton');
-        const nextButton = document.getElementById('nextButton');
-        const muteButton = document.getElementById('muteButton');
-        const volumeSlider = document.querySelector('.volume-slider');
-        const volumeValue = document.querySelector('.volume-value');
-        const logContainer = document.querySelector('.log-container');
-
-        // Shortcut buttons
-        const alt1Button = document.getElementById('alt1Button');
-        const alt2Button = document.getElementById('alt2Button');
-        const alt3Button = document.getElementById('alt3Button');
-        const ctrlAltLButton = document.getElementById('ctrlAltLButton');
-        const altQButton = document.getElementById('altQButton');
-        const shutdownButton = document.getElementById('shutdownButton');
-
-        let isPlaying = false;
-        let isMuted = false;
-
-        // Shortcut handlers
-        async function sendShortcut(shortcut) {
-            try {
-                const response = await fetch('/shortcut', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({shortcut: shortcut})
-                });
-                const data = await response.json();
-                if (data.status !== 'success') {
-                    console.error('Error sending shortcut:', data.message);
-                }
-            } catch (error) {
-                console.error('Error sending shortcut:', error);
-            }
-        }
+@routes.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-        alt1Button.addEventListener('click', () => sendShortcut('alt1'));
-        alt2Button.addEventListener('click', () => sendShortcut('alt2'));
-        alt3Button.addEventListener('click', () => sendShortcut('alt3'));
-        ctrlAltLButton.addEventListener('click', () => sendShortcut('ctrlaltl'));
-        altQButton.addEventListener('click', () => sendShortcut('altq'));
-
-        shutdownButton.addEventListener('click', async () => {
-            if (confirm('Are you sure you want to shutdown the service?')) {
-                try {
-                    await fetch('/shutdown', { method: 'POST' });
-                } catch (error) {
-                    console.error('Error shutting down service:', error);
-                }
-            }
-        });
+@routes.route('/')
+def home():
+    app.logger.info('Home page accessed')
+    return ui_page.response()
 
-        playPauseButton.addEventListener('click', async () => {
-            try {
-                const response = await fetch('/playback', { 
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({action: 'playpause'})
-                });
-                const data = await response.json();
-                if (data.status === 'success') {
-                    isPlaying = !isPlaying;
-                    playPauseButton.textContent = isPlaying ? '⏸' : '▶';
-                }
-            } catch (error) {
-                console.error('Error toggling playback:', error);
-            }
-        });
+@routes.route('/manifest.webmanifest')
+def get_manifest():
+    return ui_manifest.response()
 
-        prevButton.addEventListener('click', async () => {
-            try {
-                await fetch('/playback', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({action: 'previous'})
-                });
-            } catch (error) {
-                console.error('Error changing to previous track:', error);
-            }
-        });
+@routes.route('/sw.js')
+def get_service_worker():
+    return ui_worker.response()
 
-        nextButton.addEventListener('click', async () => {
-            try {
-                await fetch('/playback', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({action: 'next'})
-                });
-            } catch (error) {
-                console.error('Error changing to next track:', error);
-            }
-        });
+@routes.route('/assets/<name>')
+def get_asset(name):
+    asset = ui_assets.get(name)
+    if asset is None:
+        abort(404)
+    return asset.response()
 
-        muteButton.addEventListener('click', async () => {
-            try {
-                const response = await fetch('/volume', { 
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({volume: isMuted ? volumeSlider.value : 0})
-                });
+@routes.route('/nowplaying')
+def get_now_playing():
+    try:
+        return jsonify({'status': 'success', 'track': now_playing.get()})
+    except Exception as e:
+        app.logger.error(f'Error getting now playing: {str(e)}')
+        return jsonify({'status': 'error', 'message': str(e)})
 
-                const data = await response.json();
-                if (data.status === 'success') {
-                    isMuted = !isMuted;
-                    muteButton.textContent = isMuted ? '🔇' : '🔊';
-                }
-            } catch (error) {
-                console.error('Error toggling mute:', error);
-            }
-        });
+@routes.route('/artwork/<name>')
+def get_artwork(name):
+    asset = artwork_cache.get(name)
+    if asset is None:
+        abort(404)
+    return asset.response()
 
-        async function updateVolume() {
-            try {
-                const response = await fetch('/get_volume');
-                const data = await response.json();
-                if (data.status === 'success') {
-                    volumeSlider.value = data.volume;
-                    volumeValue.textContent = `${data.volume}%`;
-                }
-            } catch (error) {
-                console.error('Error fetching volume:', error);
-            }
-        }
+@routes.route('/get_volume')
+def get_volume():
+    etag, body, state = player_state.snapshot()
+    if state['volume'] is None:
+        # The backend is still starting up
+        app.logger.info('Volume requested')
+        try:
+            current_volume = audio_worker.call('get_volume')
+            return jsonify({'status': 'success', 'volume': current_volume})
+        except Exception as e:
+            app.logger.error(f'Error getting volume: {str(e)}')
+            return jsonify({'status': 'error', 'message': str(e)})
 
-        // Update volume display
-        volumeSlider.addEventListener('input', async () => {
-            volumeValue.textContent = `${volumeSlider.value}%`;
-            try {
-                await fetch('/volume', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({ volume: parseInt(volumeSlider.value) })
-                });
-            } catch (error) {
-                console.error('Error setting volume:', error);
-            }
-        });
+    # Unchanged state costs pollers a 304 and no backend call or log line
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        app.logger.info('Volume requested')
+        response = Response(body, content_type='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-        // Real-time logs
-        async function fetchLogs() {
-            try {
-                const response = await fetch('/logs');
-                const logs = await response.json();
-                
-                logs.forEach(log => {
-                    const logEntry = document.createElement('div');
-                    logEntry.className = `log-entry log-${log.type}`;
-                    logEntry.textContent = log.message;
-                    logContainer.appendChild(logEntry);
-                    
-                    // Auto-scroll to bottom
-                    logContainer.scrollTop = logContainer.scrollHeight;
-                    
-                    // Keep only last 100 entries
-                    while (logContainer.children.length > 100) {
-                        logContainer.removeChild(logContainer.firstChild);
-                    }
-                });
-            } catch (error) {
-                console.error('Error fetching logs:', error);
-            }
-        }
+@routes.route('/events')
+def events():
+    # Volume events, log events after ?logs=<seq> when that is given, and
+    # level meter events with ?meter=1
+    app.logger.info('Event stream opened')
+    return event_stream(stream_events(last_log_seq('logs'), meter=request.args.get('meter') == '1'))
 
-        // Initial volume
-        updateVolume();
-        // Update volume every 2 seconds
-        setInterval(updateVolume, 2000);
-        // Fetch logs every second
-        setInterval(fetchLogs, 1000);
-    </script>
-</body>
-</html>
-'''
+def is_number(value):
+    # Flask's JSON parser accepts NaN and Infinity, which clamp to full volume
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
 
-@app.route('/logs')
-def get_logs():
-    logs = []
-    while not log_queue.empty():
-        try:
-            logs.append(log_queue.get_nowait())
-        except queue.Empty:
-            break
-    return jsonify(logs)
+@routes.route('/volume', methods=['POST'])
+@rate_limited()
+def set_volume():
+    data = request.json
+    volume = data.get('volume', 0)
+    seq = data.get('seq')
+    if not is_number(volume):
+        return jsonify({'status': 'error', 'message': 'volume must be a number'})
+    if seq is not None and not is_number(seq):
+        return jsonify({'status': 'error', 'message': 'seq must be a number'})
+    client = data.get('client', request.remote_addr)
+    if not isinstance(client, str):
+        return jsonify({'status': 'error', 'message': 'client must be a string'})
+    volume = max(0, min(100, volume))
 
-class QueueHandler(logging.Handler):
-    def emit(self, record):
-        client_ip = request.remote_addr if request else 'Unknown IP'
-        user_agent = request.headers.get('User-Agent', 'Unknown UA') if request else 'Unknown UA'
-        log_entry = {
-            'message': f'[{client_ip}] [{user_agent}] {self.format(record)}',
-            'type': record.levelname.lower()
-        }
-        try:
-            log_queue.put_nowait(log_entry)
-        except queue.Full:
-            pass
+    # Setting the volume by hand stops any fade
+    volume_ramper.cancel()
+    batch = volume_writer.submit(volume, client, seq)
+    if batch is None:
+        current = player_state.state['volume']
+        return jsonify({'status': 'stale', 'volume': current, 'seq': seq})
+    if batch.error is not None:
+        app.logger.error(f'Error setting volume: {str(batch.error)}')
+        return jsonify({'status': 'error', 'message': str(batch.error)})
+    player_state.update(volume=batch.applied)
+    return jsonify({'status': 'success', 'volume': batch.applied, 'seq': seq})
 
-queue_handler = QueueHandler()
-queue_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-app.logger.addHandler(queue_handler)
+RAMP_MAX_DURATION_MS = 10 * 60 * 1000
 
-@app.route('/')
-def home():
-    app.logger.info('Home page accessed')
-    return render_template_string(HTML_TEMPLATE, version=version)
+@routes.route('/volume/ramp', methods=['POST'])
+@rate_limited()
+def ramp_volume():
+    data = request.json
+    if data.get('cancel'):
+        return jsonify({'status': 'success', 'cancelled': volume_ramper.cancel()})
+
+    target = data.get('target')
+    duration_ms = data.get('duration_ms', 1000)
+    curve = data.get('curve', 'linear')
+    if not is_number(target):
+        return jsonify({'status': 'error', 'message': 'target must be a number'})
+    if not is_number(duration_ms) or not 0 <= duration_ms <= RAMP_MAX_DURATION_MS:
+        return jsonify({'status': 'error', 'message': f'duration_ms must be between 0 and {RAMP_MAX_DURATION_MS}'})
+    if curve not in VolumeRamp.CURVES:
+        return jsonify({'status': 'error', 'message': f'curve must be one of {", ".join(VolumeRamp.CURVES)}'})
 
-@app.route('/get_volume')
-def get_volume():
-    app.logger.info('Volume requested')
-    pythoncom.CoInitialize()
     try:
-        devices = AudioUtilities.GetSpeakers()
-        interface = devices.Activate(
-            IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-        volume_interface = cast(interface, POINTER(IAudioEndpointVolume))
-        current_volume = round(volume_interface.GetMasterVolumeLevelScalar() * 100)
-        return jsonify({'status': 'success', 'volume': current_volume})
+        ramp = volume_ramper.start(max(0, min(100, round(target))), duration_ms / 1000, curve)
     except Exception as e:
-        app.logger.error(f'Error getting volume: {str(e)}')
+        app.logger.error(f'Error starting volume ramp: {str(e)}')
         return jsonify({'status': 'error', 'message': str(e)})
-    finally:
-        pythoncom.CoUninitialize()
+    app.logger.info(f'Volume ramp from {ramp.start} to {ramp.target} over {duration_ms} ms ({curve})')
+    return jsonify({'status': 'success', 'ramp': ramp.describe()})
 
-@app.route('/volume', methods=['POST'])
-def set_volume():
+@routes.route('/mute', methods=['POST'])
+@rate_limited()
+def set_mute():
     data = request.json
-    volume = data.get('volume', 0)
-    app.logger.info(f'Volume set to {volume}')
-    
-    pythoncom.CoInitialize()
+    # Without an explicit value, mute toggles
+    muted = data.get('muted')
+    if muted is None:
+        muted = not player_state.state['muted']
+    elif not isinstance(muted, bool):
+        return jsonify({'status': 'error', 'message': 'muted must be true or false'})
     try:
-        devices = AudioUtilities.GetSpeakers()
-        interface = devices.Activate(
-            IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-        volume_interface = cast(interface, POINTER(IAudioEndpointVolume))
-        volume_interface.SetMasterVolumeLevelScalar(volume/100, None)
-        return jsonify({'status': 'success'})
+        result = run_mute_action(muted)
     except Exception as e:
-        app.logger.error(f'Error setting volume: {str(e)}')
+        app.logger.error(f'Error setting mute: {str(e)}')
         return jsonify({'status': 'error', 'message': str(e)})
-    finally:
-        pythoncom.CoUninitialize()
+    app.logger.info(f'Mute set to {result["muted"]}')
+    return jsonify({'status': 'success', **result})
+
+@routes.route('/devices')
+def get_devices():
+    try:
+        return jsonify({'status': 'success', 'devices': audio_index.list('device')})
+    except Exception as e:
+        app.logger.error(f'Error listing devices: {str(e)}')
+        return jsonify({'status': 'error', 'message': str(e)})
+
+@routes.route('/sessions')
+def get_sessions():
+    try:
+        return jsonify({'status': 'success', 'sessions': audio_index.list('session')})
+    except Exception as e:
+        app.logger.error(f'Error listing sessions: {str(e)}')
+        return jsonify({'status': 'error', 'message': str(e)})
+
+def update_audio_target(kind, target_id, setting):
+    data = request.json
+    if setting == 'volume':
+        value = data.get('volume', 0)
+        if not is_number(value):
+            return jsonify({'status': 'error', 'message': 'volume must be a number'})
+        value = max(0, min(100, value))
+    else:
+        # Without an explicit value, mute toggles
+        value = data.get('muted')
+        if value is not None and not isinstance(value, bool):
+            return jsonify({'status': 'error', 'message': 'muted must be true or false'})
+    try:
+        info = audio_index.update(kind, target_id, setting, value)
+    except KeyError as e:
+        return jsonify({'status': 'error', 'message': e.args[0]})
+    except Exception as e:
+        app.logger.error(f'Error setting {kind} {setting}: {str(e)}')
+        return jsonify({'status': 'error', 'message': str(e)})
+    if info is None:
+        return jsonify({'status': 'error', 'message': f'{kind.capitalize()} is gone: {target_id}'})
+    field = 'volume' if setting == 'volume' else 'muted'
+    app.logger.info(f'{kind.capitalize()} {info["name"]} {field} set to {info[field]}')
+    return jsonify({'status': 'success', kind: info})
+
+@routes.route('/devices/<device_id>/volume', methods=['POST'])
+@rate_limited()
+def set_device_volume(device_id):
+    return update_audio_target('device', device_id, 'volume')
+
+@routes.route('/devices/<device_id>/mute', methods=['POST'])
+@rate_limited()
+def set_device_mute(device_id):
+    return update_audio_target('device', device_id, 'mute')
+
+@routes.route('/sessions/<session_id>/volume', methods=['POST'])
+@rate_limited()
+def set_session_volume(session_id):
+    return update_audio_target('session', session_id, 'volume')
+
+@routes.route('/sessions/<session_id>/mute', methods=['POST'])
+@rate_limited()
+def set_session_mute(session_id):
+    return update_audio_target('session', session_id, 'mute')
+
+def press_media_key(action):
+    media_keys.send(action)
+    player_state.record_playback(action)
+
+def press_shortcut(shortcut):
+    shortcuts.send(shortcut)
 
-@app.route('/playback', methods=['POST'])
+@routes.route('/playback', methods=['POST'])
+@rate_limited()
 def control_playback():
     data = request.json
     action = data.get('action', '')
     app.logger.info(f'Playback control: {action}')
     
-    VK_MEDIA_PLAY_PAUSE = 0xB3
-    VK_MEDIA_NEXT_TRACK = 0xB0
-    VK_MEDIA_PREV_TRACK = 0xB1
-    
     try:
-        if action == 'playpause':
-            win32api.keybd_event(VK_MEDIA_PLAY_PAUSE, 0, 0, 0)
-            win32api.keybd_event(VK_MEDIA_PLAY_PAUSE, 0, win32con.KEYEVENTF_KEYUP, 0)
-        elif action == 'next':
-            win32api.keybd_event(VK_MEDIA_NEXT_TRACK, 0, 0, 0)
-            win32api.keybd_event(VK_MEDIA_NEXT_TRACK, 0, win32con.KEYEVENTF_KEYUP, 0)
-        elif action == 'previous':
-            win32api.keybd_event(VK_MEDIA_PREV_TRACK, 0, 0, 0)
-            win32api.keybd_event(VK_MEDIA_PREV_TRACK, 0, win32con.KEYEVENTF_KEYUP, 0)
-            
-        return jsonify({'status': 'success'})
+        press_media_key(action)
+        return jsonify({'status': 'success', 'playing': player_state.state['playing']})
     except Exception as e:
         app.logger.error(f'Error controlling playback: {str(e)}')
         return jsonify({'status': 'error', 'message': str(e)})
 
-@app.route('/shortcut', methods=['POST'])
+@routes.route('/shortcut', methods=['POST'])
+@rate_limited()
 def send_shortcut():
     data = request.json
     shortcut = data.get('shortcut', '')
     app.logger.info(f'Shortcut requested: {shortcut}')
     
     try:
-        if shortcut == 'alt1':
-            win32api.keybd_event(win32con.VK_MENU, 0, 0, 0)  # Alt down
-            win32api.keybd_event(ord('1'), 0, 0, 0)
-            win32api.keybd_event(ord('1'), 0, win32con.KEYEVENTF_KEYUP, 0)
-            win32api.keybd_event(win32con.VK_MENU, 0, win32con.KEYEVENTF_KEYUP, 0)
-        elif shortcut == 'alt2':
-            win32api.keybd_event(win32con.VK_MENU, 0, 0, 0)
-            win32api.keybd_event(ord('2'), 0, 0, 0)
-            win32api.keybd_event(ord('2'), 0, win32con.KEYEVENTF_KEYUP, 0)
-            win32api.keybd_event(win32con.VK_MENU, 0, win32con.KEYEVENTF_KEYUP, 0)
-        elif shortcut == 'alt3':
-            win32api.keybd_event(win32con.VK_MENU, 0, 0, 0)
-            win32api.keybd_event(ord('3'), 0, 0, 0)
-            win32api.keybd_event(ord('3'), 0, win32con.KEYEVENTF_KEYUP, 0)
-            win32api.keybd_event(win32con.VK_MENU, 0, win32con.KEYEVENTF_KEYUP, 0)
-        elif shortcut == 'ctrlaltl':
-            win32api.keybd_event(win32con.VK_CONTROL, 0, 0, 0)  # Ctrl down
-            win32api.keybd_event(win32con.VK_MENU, 0, 0, 0)     # Alt down
-            win32api.keybd_event(ord('L'), 0, 0, 0)
-            win32api.keybd_event(ord('L'), 0, win32con.KEYEVENTF_KEYUP, 0)
-            win32api.keybd_event(win32con.VK_MENU, 0, win32con.KEYEVENTF_KEYUP, 0)
-            win32api.keybd_event(win32con.VK_CONTROL, 0, win32con.KEYEVENTF_KEYUP, 0)
-        elif shortcut == 'altq':
-            win32api.keybd_event(win32con.VK_MENU, 0, 0, 0)
-            win32api.keybd_event(ord('Q'), 0, 0, 0)
-            win32api.keybd_event(ord('Q'), 0, win32con.KEYEVENTF_KEYUP, 0)
-            win32api.keybd_event(win32con.VK_MENU, 0, win32con.KEYEVENTF_KEYUP, 0)
-            
+        press_shortcut(shortcut)
         return jsonify({'status': 'success'})
     except Exception as e:
         app.logger.error(f'Error sending shortcut: {str(e)}')
         return jsonify({'status': 'error', 'message': str(e)})
 
-@app.route('/shutdown', methods=['POST'])
+# Batch actions use the same vocabulary as the single-action routes: each route
+# name maps to the request field it reads and the function that performs it.
+def run_volume_action(volume):
+    volume = max(0, min(100, volume))
+    volume_ramper.cancel()
+    audio_worker.call('set_volume', volume)
+    player_state.update(volume=volume)
+    return {'volume': volume}
+
+def run_mute_action(muted):
+    audio_worker.call('set_mute', bool(muted))
+    player_state.update(muted=bool(muted))
+    return {'muted': bool(muted)}
+
+# route -> (field, check for the field's value, runner)
+BATCH_ACTIONS = {
+    'volume': ('volume', is_number, run_volume_action),
+    'mute': ('muted', lambda value: isinstance(value, bool), run_mute_action),
+    'playback': ('action', lambda value: isinstance(value, str) and value in media_keys.prepared, press_media_key),
+    'shortcut': ('shortcut', lambda value: isinstance(value, str) and value in shortcuts.prepared, press_shortcut),
+}
+BATCH_MAX_ACTIONS = 32
+BATCH_MAX_DELAY_MS = 10000
+
+def batch_cost():
+    # One token per action, so a batch can't get around the limit
+    data = request.get_json(silent=True)
+    actions = data.get('actions') if isinstance(data, dict) else None
+    return len(actions) if isinstance(actions, list) and actions else 1
+
+@routes.route('/batch', methods=['POST'])
+@rate_limited(cost=batch_cost)
+def run_batch():
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': 'Body must be a JSON object'})
+    actions = data.get('actions')
+    stop_on_error = data.get('stop_on_error', False)
+
+    # Validate everything up front so a bad entry never leaves a batch half-run;
+    # what can still fail is the backend itself
+    if not isinstance(actions, list) or not 0 < len(actions) <= BATCH_MAX_ACTIONS:
+        return jsonify({'status': 'error', 'message': f'actions must be a list of 1 to {BATCH_MAX_ACTIONS} entries'})
+    total_delay = 0
+    for index, step in enumerate(actions):
+        if not isinstance(step, dict) or step.get('route') not in BATCH_ACTIONS:
+            return jsonify({'status': 'error', 'message': f'Unknown route in action {index}'})
+        field, valid, _ = BATCH_ACTIONS[step['route']]
+        if field not in step:
+            return jsonify({'status': 'error', 'message': f'Missing {field} in action {index}'})
+        if not valid(step[field]):
+            return jsonify({'status': 'error', 'message': f'Invalid {field} in action {index}'})
+        delay_ms = step.get('delay_ms', 0)
+        if not is_number(delay_ms) or delay_ms < 0:
+            return jsonify({'status': 'error', 'message': f'Invalid delay_ms in action {index}'})
+        total_delay += delay_ms
+    if total_delay > BATCH_MAX_DELAY_MS:
+        return jsonify({'status': 'error', 'message': f'Total delay exceeds {BATCH_MAX_DELAY_MS} ms'})
+
+    results = []
+    summary = []
+    for step in actions:
+        label = step['route']
+        field, _, runner = BATCH_ACTIONS[label]
+        if step.get('delay_ms'):
+            # A sleeping batch doesn't hold one of the shared backend slots
+            if rate_limiter is not None:
+                rate_limiter.suspend()
+            try:
+                time.sleep(step['delay_ms'] / 1000)
+            finally:
+                if rate_limiter is not None:
+                    rate_limiter.resume()
+        try:
+            result = runner(step[field]) or {}
+            results.append({'status': 'success', **result})
+            summary.append(f'{label} {step[field]}')
+        except Exception as e:
+            app.logger.error(f'Error in batch {label} {step[field]}: {str(e)}')
+            results.append({'status': 'error', 'message': str(e)})
+            summary.append(f'{label} {step[field]} (failed)')
+            if stop_on_error:
+                break
+
+    # One log line for the whole batch
+    app.logger.info(f'Batch executed: {", ".join(summary)}')
+    failed = any(result['status'] != 'success' for result in results)
+    return jsonify({'status': 'error' if failed else 'success', 'results': results})
+
+@routes.route('/nodes')
+def get_nodes():
+    if controller is None:
+        return jsonify({'status': 'success', 'nodes': {}})
+    return jsonify({'status': 'success', 'nodes': controller.state()})
+
+@routes.route('/nodes/command', methods=['POST'])
+@rate_limited()
+def command_nodes():
+    data = request.json
+    route = data.get('route')
+    names = data.get('nodes') or list(controller.nodes if controller else ())
+    if controller is None:
+        return jsonify({'status': 'error', 'message': 'No nodes configured'})
+    if route not in Controller.ROUTES:
+        return jsonify({'status': 'error', 'message': f'Unknown route: {route}'})
+    unknown = [name for name in names if name not in controller.nodes]
+    if unknown:
+        return jsonify({'status': 'error', 'message': f'Unknown nodes: {", ".join(unknown)}'})
+
+    results = controller.command(names, route, data.get('data', {}))
+    failed = [name for name, result in results.items() if result['status'] != 'success']
+    app.logger.info(f'Node command {route} sent to {len(names)} nodes' + (f' ({", ".join(failed)} failed)' if failed else ''))
+    return jsonify({'status': 'error' if failed else 'success', 'results': results})
+
+# Command channel: one WebSocket per page carrying the batch vocabulary.
+# Upstream [id, route, value], e.g. [7, "volume", 40]; downstream
+# [id, 1, state] on success or [id, 0, message] (plus retry-after seconds
+# when rate limited). Messages on a connection are handled in order.
+ws_message_latency = metrics.histogram('ws_message_duration_seconds', 'Time to handle a command channel message.', ('route',))
+
+def write_volume(volume):
+    # The POST /volume path, so channel writes share batches with everyone else's
+    volume_ramper.cancel()
+    batch = volume_writer.submit(max(0, min(100, volume)))
+    if batch.error is not None:
+        raise batch.error
+    player_state.update(volume=batch.applied)
+    return {'volume': batch.applied}
+
+def latest_volume(ws, request_id, value):
+    # A slider drag sends one volume message per step. Volume messages already
+    # waiting on the socket replace this one, and the replaced ones are answered
+    # with the current state, so only the newest value is written. Returns
+    # (request id, value, the first other message waiting or None).
+    while True:
+        message = ws.receive(timeout=0)
+        if message is None:
+            return request_id, value, None
+        try:
+            newer_id, route, newer = json.loads(message)
+        except (TypeError, ValueError):
+            return request_id, value, message
+        if route != 'volume' or not is_number(newer):
+            return request_id, value, message
+        ws.send(json.dumps([request_id, 1, player_state.state], separators=(',', ':')))
+        request_id, value = newer_id, newer
+
+def command_channel(ws):
+    app.logger.info('Command channel opened')
+    waiting = None
+    while True:
+        if waiting is None:
+            message = ws.receive()
+        else:
+            message, waiting = waiting, None
+        try:
+            request_id, route, value = json.loads(message)
+        except (TypeError, ValueError):
+            ws.send('[null,0,"Malformed message"]')
+            continue
+        if not isinstance(route, str) or route not in BATCH_ACTIONS:
+            ws.send(json.dumps([request_id, 0, f'Unknown route: {route}']))
+            continue
+        field, valid, runner = BATCH_ACTIONS[route]
+        if not valid(value):
+            ws.send(json.dumps([request_id, 0, f'Invalid {field}']))
+            continue
+        if route == 'volume':
+            request_id, value, waiting = latest_volume(ws, request_id, value)
+            runner = write_volume
+        if rate_limiter is not None:
+            rejected = rate_limiter.acquire(request.remote_addr)
+            if rejected:
+                reason, retry_after = rejected
+                rate_limited_total.labels('/ws', reason).inc()
+                ws.send(json.dumps([request_id, 0, 'Too many requests', math.ceil(retry_after)]))
+                continue
+        started = time.perf_counter()
+        try:
+            result = runner(value) or {}
+            reply = [request_id, 1, {**player_state.state, **result}]
+            # The volume writer logs its own, coalesced, line
+            if route != 'volume':
+                app.logger.info(f'Command channel: {route} {value}')
+        except Exception as e:
+            app.logger.error(f'Error in command channel {route} {value}: {str(e)}')
+            reply = [request_id, 0, str(e)]
+        finally:
+            if rate_limiter is not None:
+                rate_limiter.release(request.remote_addr)
+            ws_message_latency.labels(route).observe(time.perf_counter() - started)
+        ws.send(json.dumps(reply, separators=(',', ':')))
+
+def register_command_channel(app, server):
+    # Optional: needs flask-sock and a server that hands the socket over to the
+    # app, which the development server does and waitress does not
+    if not server['websocket']:
+        return False
+    if server['mode'] != 'dev':
+        app.logger.warning('server.websocket needs server.mode "dev" (waitress cannot hand sockets '
+                           'over to the app); /ws is off and commands use HTTP')
+        return False
+    try:
+        from flask_sock import Sock
+    except ImportError:
+        app.logger.warning('server.websocket needs flask-sock, which is not installed; '
+                           '/ws is off and commands use HTTP')
+        return False
+    app.config['SOCK_SERVER_OPTIONS'] = {'ping_interval': 25, 'max_message_size': 4096}
+    Sock(app).route('/ws')(command_channel)
+    return True
+
+@routes.route('/profile', methods=['GET', 'POST'])
+def profile_requests():
+    if request.method == 'POST':
+        data = request.json
+        requests = data.get('requests', 0)
+        only = data.get('routes') or []
+        sample = data.get('sample') or {}
+        if not isinstance(requests, int) or requests < 0:
+            return jsonify({'status': 'error', 'message': 'requests must be a non-negative integer'})
+        if not isinstance(only, list) or not all(isinstance(route, str) for route in only):
+            return jsonify({'status': 'error', 'message': 'routes must be a list of route paths'})
+        if not isinstance(sample, dict) or not all(isinstance(rate, (int, float)) and 0 <= rate <= 1 for rate in sample.values()):
+            return jsonify({'status': 'error', 'message': 'sample must map route paths to fractions between 0 and 1'})
+        profiler.configure(requests, only, sample)
+        app.logger.info(f'Profiling set to {requests} requests on {", ".join(only) or "all routes"}, sampling {sample or "nothing"}')
+    return jsonify({'status': 'success', **profiler.status()})
+
+@routes.route('/shutdown', methods=['POST'])
 def shutdown():
     app.logger.info('Shutdown requested')
     def shutdown_server():
         time.sleep(1)
         app.logger.info('Server shutting down')
+        log_listener.stop()
         quit_completely(0)
     
     thread = threading.Thread(target=shutdown_server)
     thread.start()
     return jsonify({'status': 'success'})
 
+# Startup. create_app() is measured phase by phase against STARTUP_BUDGET;
+# opening the audio backend (and importing the platform audio stack) happens
+# on the AudioWorker thread afterwards, with requests queueing behind it.
+STARTUP_BUDGET = 0.5
+startup_seconds = None
+
+metrics.callback('startup_duration_seconds', 'gauge', 'Time from module import to a built app.',
+                 lambda: startup_seconds or 0)
+
+class StartupTimer:
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.phases = [('import', self.last - import_started)] if app is None else []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+    def summary(self):
+        return ', '.join(f'{name} {seconds * 1000:.1f} ms' for name, seconds in self.phases)
+
+def start_audio():
+    player_state.start()
+    audio_index.start()
+
+def create_app(config_overrides=None, log_dir=None):
+    # Builds the app. The config comes from the config file unless overrides are
+    # given, in which case they are merged over the defaults and nothing is read
+    # or written. One app per process: the module state belongs to the last one.
+    global app, config, baseport, service_link, startup_seconds, ui_page, ui_manifest, ui_worker, ui_assets
+    global key_injector, shortcuts, media_keys, audio_worker, player_state, volume_writer, volume_ramper, level_meter
+    global audio_index, now_playing, artwork_cache, rate_limiter, controller, profiler, stream_slots
+    timer = StartupTimer()
+
+    config = load_config() if config_overrides is None else merge_config(config_overrides)
+    baseport = config['baseport']
+    service_link = f"http://localhost:{baseport}/"
+    timer.mark('config')
+
+    app = Flask(__name__)
+    app.config['MAX_CONTENT_LENGTH'] = config['server']['max_request_body_size']
+    app.wsgi_app = ActiveRequestsMiddleware(app.wsgi_app)
+    app.register_blueprint(routes)
+    limits = config['rate_limit']
+    rate_limiter = RateLimiter(limits['rate'], limits['burst'], limits['max_concurrent'],
+                               limits['max_per_client']) if limits['enabled'] else None
+    setup_logging(app, log_dir or default_log_dir, config['logging'])
+    websocket = register_command_channel(app, config['server'])
+    stream_slots = StreamSlots(stream_limit(config['server']))
+    profiler = RequestProfiler(path.join(log_dir or default_log_dir, 'profiles'))
+    profiling = config['profiling']
+    profiler.configure(profiling['requests'], profiling['routes'], profiling['sample'])
+    timer.mark('app')
+
+    key_injector = create_key_injector(config['key_injector'])
+    shortcuts = ShortcutTable(key_injector, config['shortcuts'])
+    media_keys = ShortcutTable(key_injector, MEDIA_ACTIONS, 'playback action')
+    timer.mark('keyboard')
+
+    if audio_worker is not None:
+        # Only one worker may own the audio backend
+        audio_worker.stop()
+        audio_worker.join(audio_worker.timeout)
+    audio_worker = AudioWorker(create_audio_backend(config['audio_backend']))
+    audio_worker.start()
+    player_state = PlayerState(audio_worker)
+    volume_writer = VolumeWriter(audio_worker)
+    volume_ramper = VolumeRamper(audio_worker, player_state)
+    level_meter = LevelMeter(audio_worker)
+    audio_index = AudioIndex(audio_worker)
+    threading.Thread(target=start_audio, name='AudioStartup', daemon=True).start()
+    timer.mark('audio')
+
+    artwork_cache = ArtworkCache()
+    now_playing = NowPlaying(create_nowplaying_provider(config['nowplaying_provider']), artwork_cache)
+
+    nodes = config['controller']
+    controller = Controller(nodes['nodes'], nodes['timeout'], nodes['pool_size']) if nodes['nodes'] else None
+
+    ui_page, ui_manifest, ui_worker, ui_assets = build_ui(websocket)
+    timer.mark('ui')
+
+    startup_seconds = timer.total()
+    if startup_seconds > STARTUP_BUDGET:
+        app.logger.warning(f'Startup took {startup_seconds * 1000:.0f} ms, over the '
+                           f'{STARTUP_BUDGET * 1000:.0f} ms budget ({timer.summary()})')
+    else:
+        app.logger.info(f'Started in {startup_seconds * 1000:.0f} ms ({timer.summary()})')
+    return app
+
+def import_report(limit=15):
+    # Runs a fresh interpreter with -X importtime and lists the slowest imports
+    # by cumulative time, so startup regressions can be traced to a module
+    import subprocess
+    here = path.dirname(path.abspath(__file__))
+    module = path.splitext(path.basename(__file__))[0]
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=here, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line.split(':', 1)[1].split('|')
+        rows.append((int(cumulative), int(own), name.strip()))
+    rows.sort(reverse=True)
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative, own, name in rows[:limit]:
+        print(f'{cumulative / 1000:>14.1f} {own / 1000:>9.1f}  {name}')
+    return result.returncode
+
+def run_server():
+    server = config['server']
+
+    if server['mode'] == 'production':
+        try:
+            import waitress
+        except ImportError:
+            app.logger.warning('waitress is not installed, falling back to the development server')
+        else:
+            if config['debug']:
+                app.logger.warning('debug is only available in dev mode and is ignored')
+            waitress.serve(app, host=config['listenaddress'], port=baseport,
+                           threads=server['threads'],
+                           connection_limit=server['connection_limit'],
+                           channel_timeout=server['keepalive_timeout'],
+                           max_request_body_size=server['max_request_body_size'])
+            return
+
+    app.run(host=config['listenaddress'], port=baseport, debug=config['debug'], threaded=True)
+
 if __name__ == '__main__':
+    if '--import-report' in sys.argv[1:]:
+        sys.exit(import_report())
+    import webbrowser
+    create_app()
     app.logger.info(f'Starting server at {service_link}')
     webbrowser.open(service_link)
-    app.run(host=config['listenaddress'], port=baseport, debug=config['debug'])
+    run_server()
+    log_listener.stop()
     quit_completely(0)
\ No newline at end of file
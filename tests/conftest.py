@@ -0,0 +1,60 @@
+import sys
+from os import path
+
+import pytest
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import main
+
+
+class GatedBackend(main.FakeAudioBackend):
+    # set_volume waits at the gate while one is set, to hold a write in flight
+    gate = None
+
+    def set_volume(self, volume):
+        if self.gate is not None:
+            self.gate.wait(5)
+        super().set_volume(volume)
+
+
+class RecordingWorker(main.AudioWorker):
+    # Records every command sent to the backend
+    def __init__(self, backend, timeout=5.0):
+        super().__init__(backend, timeout)
+        self.calls = []
+
+    def call(self, method, *args):
+        self.calls.append((method, *args))
+        return super().call(method, *args)
+
+    def called(self, method):
+        return [call[1:] for call in self.calls if call[0] == method]
+
+
+@pytest.fixture(scope='session', autouse=True)
+def app(tmp_path_factory):
+    # One app per process: the classes under test log through main.app
+    app = main.create_app({'audio_backend': 'fake', 'key_injector': 'recording',
+                           'rate_limit': {'enabled': False}},
+                          log_dir=str(tmp_path_factory.mktemp('logs')))
+    yield app
+    main.log_listener.stop()
+
+
+@pytest.fixture
+def backend():
+    return GatedBackend()
+
+
+@pytest.fixture
+def worker(backend):
+    worker = RecordingWorker(backend)
+    worker.start()
+    yield worker
+    worker.stop()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
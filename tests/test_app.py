@@ -0,0 +1,37 @@
+import sys
+
+import main
+
+CONFIG = {'audio_backend': 'fake', 'key_injector': 'recording', 'rate_limit': {'enabled': False},
+          'logging': {'dedup_window': 0}}
+
+
+def count_lines(log_dir, text):
+    with open(log_dir / 'access.log', encoding='utf-8') as f:
+        return sum(text in line for line in f)
+
+
+def test_import_has_no_platform_side_effects():
+    for module in ('pycaw', 'comtypes', 'pythoncom', 'cProfile'):
+        assert module not in sys.modules
+
+
+def test_a_second_app_replaces_the_first_ones_logs_and_worker(app, tmp_path):
+    first_dir, second_dir = tmp_path / 'first', tmp_path / 'second'
+    first = main.create_app(CONFIG, log_dir=str(first_dir))
+    first_worker = main.audio_worker
+    first.test_client().get('/get_volume')
+
+    second = main.create_app(CONFIG, log_dir=str(second_dir))
+    assert not first_worker.is_alive()
+    assert main.audio_worker is not first_worker
+    client = second.test_client()
+    for _ in range(50):
+        client.get('/get_volume')
+    main.log_listener.stop()
+
+    assert count_lines(first_dir, 'Volume requested') == 1
+    assert count_lines(second_dir, 'Volume requested') == 50
+
+    # Leave the session's app state in place for the other tests
+    main.create_app(CONFIG, log_dir=str(tmp_path / 'restored'))
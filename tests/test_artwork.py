@@ -0,0 +1,51 @@
+import io
+import sys
+
+import pytest
+
+import main
+
+
+def png(width, height, rgb=(200, 40, 40)):
+    return main.solid_png(width, height, rgb)
+
+
+def test_art_is_downscaled_once():
+    image = pytest.importorskip('PIL.Image')
+    cache = main.ArtworkCache()
+    raw = png(1000, 500)
+    name = cache.add(raw)
+    assert name.endswith('.jpg')
+    assert cache.add(raw) == name
+    assert len(cache.entries) == 1
+    body, _ = cache.get(name).variants[None]
+    assert image.open(io.BytesIO(body)).size == (256, 128)
+
+
+def test_without_pillow_small_art_is_kept_as_is(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'PIL', None)
+    cache = main.ArtworkCache()
+    raw = png(64, 64)
+    name = cache.add(raw)
+    assert name.endswith('.png')
+    assert cache.get(name).variants[None][0] == raw
+    assert cache.unscaled_warned
+
+
+def test_without_pillow_large_or_unknown_art_is_dropped(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'PIL', None)
+    monkeypatch.setattr(main.ArtworkCache, 'MAX_UNSCALED_BYTES', 100)
+    cache = main.ArtworkCache()
+    assert cache.add(png(64, 64, (1, 2, 3)) + bytes(200)) is None
+    assert cache.add(b'GIF89a' + bytes(10)) is None
+    assert not cache.entries
+
+
+def test_least_recently_used_art_is_evicted(monkeypatch):
+    monkeypatch.setattr(main.ArtworkCache, 'MAX_ENTRIES', 2)
+    cache = main.ArtworkCache()
+    first, second, third = (cache.add(png(300, 300, (n, n, n))) for n in (10, 20, 30))
+    assert cache.get(first) is None
+    assert cache.get(second) is not None and cache.get(third) is not None
+    assert cache.evictions == 1
+    assert cache.bytes == sum(entry[2] for entry in cache.entries.values())
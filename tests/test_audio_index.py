@@ -0,0 +1,107 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def index(worker):
+    index = main.AudioIndex(worker)
+    index.start()
+    return index
+
+
+def names(entries):
+    return sorted(entry['name'] for entry in entries)
+
+
+def test_first_read_builds_the_index(worker, index):
+    assert names(index.list('session')) == ['browser.exe', 'player.exe']
+    assert names(index.list('device')) == ['Fake Headphones', 'Fake Speakers']
+    assert len(worker.called('list_sessions')) == 1
+
+
+def test_notifications_refresh_only_what_changed(backend, worker, index):
+    index.list('session')
+    worker.calls.clear()
+
+    backend.add_session('fake-chat', 'chat.exe', 1003)
+    assert names(index.list('session')) == ['browser.exe', 'chat.exe', 'player.exe']
+    assert worker.called('resolve_session') == [('fake-chat',)]
+    worker.calls.clear()
+
+    backend.remove_session('fake-browser')
+    backend.set_session_volume('fake-player', 25)
+    sessions = {entry['name']: entry for entry in index.list('session')}
+    assert sorted(sessions) == ['chat.exe', 'player.exe']
+    assert sessions['player.exe']['volume'] == 25
+    assert worker.called('get_session') == [('fake-player',)]
+    # Backend state for a removed session is dropped on the worker, not the notifying thread
+    assert worker.called('forget_session') == [('fake-browser',)]
+
+    assert not worker.called('list_sessions')
+    assert not worker.called('list_devices')
+
+
+def test_reads_without_changes_do_not_touch_the_backend(worker, index):
+    index.list('device')
+    worker.calls.clear()
+    index.list('device')
+    index.list('session')
+    assert not worker.calls
+
+
+def test_update_applies_to_one_entry(backend, worker, index):
+    player = next(entry for entry in index.list('session') if entry['name'] == 'player.exe')
+    info = index.update('session', player['id'], 'volume', 30)
+    assert info['volume'] == 30
+    assert backend.sessions['fake-player']['volume'] == 30
+    assert index.update('session', player['id'], 'mute', None)['muted'] is True
+
+
+def test_public_ids_hide_backend_ids(index):
+    ids = [entry['id'] for entry in index.list('session')]
+    assert 'fake-player' not in ids
+    assert main.AudioIndex.public_id('fake-player') in ids
+
+
+def test_update_rejects_unknown_ids(index):
+    with pytest.raises(KeyError):
+        index.update('session', 'missing', 'volume', 30)
+
+
+def first_session(client):
+    return client.get('/sessions').get_json()['sessions'][0]
+
+
+@pytest.mark.parametrize('body', [{'volume': 'abc'}, {'volume': None}, {'volume': True}])
+def test_session_volume_rejects_non_numbers(client, body):
+    session = first_session(client)
+    response = client.post(f'/sessions/{session["id"]}/volume', json=body)
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'error'
+    assert first_session(client)['volume'] == session['volume']
+
+
+def test_session_volume_rejects_non_finite_numbers(client):
+    session = first_session(client)
+    response = client.post(f'/sessions/{session["id"]}/volume', data='{"volume": NaN}',
+                           content_type='application/json')
+    assert response.get_json()['status'] == 'error'
+
+
+@pytest.mark.parametrize('muted', ['no', 'false', 0, 1])
+def test_device_mute_rejects_non_booleans(client, muted):
+    device = client.get('/devices').get_json()['devices'][0]
+    body = client.post(f'/devices/{device["id"]}/mute', json={'muted': muted}).get_json()
+    assert body['status'] == 'error'
+    assert client.get('/devices').get_json()['devices'][0]['muted'] == device['muted']
+
+
+def test_session_routes_set_volume_and_mute(client):
+    session = first_session(client)
+    body = client.post(f'/sessions/{session["id"]}/volume', json={'volume': 140}).get_json()
+    assert body['session']['volume'] == 100
+    body = client.post(f'/sessions/{session["id"]}/mute', json={'muted': True}).get_json()
+    assert body['session']['muted'] is True
+    body = client.post(f'/sessions/{session["id"]}/mute', json={}).get_json()
+    assert body['session']['muted'] is False
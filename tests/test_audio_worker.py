@@ -0,0 +1,38 @@
+import threading
+import time
+
+import pytest
+
+import main
+
+
+def test_calls_run_on_the_worker_thread(backend, worker):
+    threads = []
+
+    def get_volume():
+        threads.append(threading.current_thread().name)
+        return 50
+    backend.get_volume = get_volume
+    assert worker.call('get_volume') == 50
+    assert threads == ['AudioWorker']
+
+
+def test_backend_errors_reach_the_caller(backend, worker):
+    with pytest.raises(AttributeError):
+        worker.call('no_such_method')
+    # The worker carries on after a failed command
+    assert worker.call('get_volume') == backend.volume
+
+
+def test_worker_fails_calls_when_the_backend_cannot_open():
+    class BrokenBackend(main.FakeAudioBackend):
+        def open(self):
+            raise OSError('no audio device')
+
+    worker = main.AudioWorker(BrokenBackend(), timeout=5.0)
+    worker.start()
+    worker.join(2)
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match='no audio device'):
+        worker.call('get_volume')
+    assert time.monotonic() - started < 1
@@ -0,0 +1,60 @@
+import pytest
+
+import main
+
+
+def batch(client, *actions, **options):
+    return client.post('/batch', json={'actions': list(actions), **options}).get_json()
+
+
+def test_actions_run_in_order(client):
+    body = batch(client, {'route': 'volume', 'volume': 35}, {'route': 'mute', 'muted': True},
+                 {'route': 'mute', 'muted': False})
+    assert body['status'] == 'success'
+    assert [result['status'] for result in body['results']] == ['success'] * 3
+    assert main.player_state.state['volume'] == 35
+    assert main.player_state.state['muted'] is False
+
+
+def test_shortcuts_and_media_keys_are_injected(client):
+    injector = main.key_injector
+    sent = len(injector.sent)
+    assert batch(client, {'route': 'playback', 'action': 'next'},
+                 {'route': 'shortcut', 'shortcut': next(iter(main.shortcuts.prepared))})['status'] == 'success'
+    assert len(injector.sent) == sent + 2
+
+
+def test_batch_rejects_a_non_object_body(client):
+    assert client.post('/batch', json=[1]).get_json()['status'] == 'error'
+
+
+@pytest.mark.parametrize('action', [
+    {'route': 'volume', 'volume': '40'},
+    {'route': 'volume'},
+    {'route': 'mute', 'muted': 'no'},
+    {'route': 'playback', 'action': 'bogus'},
+    {'route': 'shortcut', 'shortcut': 'missing'},
+    {'route': 'reboot'},
+    {'route': 'volume', 'volume': 40, 'delay_ms': -1},
+])
+def test_batch_validates_every_action_before_running_any(client, action):
+    client.post('/volume', json={'volume': 20})
+    body = batch(client, {'route': 'volume', 'volume': 70}, action)
+    assert body['status'] == 'error'
+    assert 'action 1' in body['message']
+    assert main.player_state.state['volume'] == 20
+
+
+@pytest.mark.parametrize('value', ['NaN', 'Infinity'])
+def test_batch_rejects_non_finite_numbers(client, value):
+    client.post('/volume', json={'volume': 20})
+    for action in (f'{{"route": "volume", "volume": {value}}}',
+                   f'{{"route": "volume", "volume": 50, "delay_ms": {value}}}'):
+        response = client.post('/batch', data=f'{{"actions": [{action}]}}', content_type='application/json')
+        assert response.get_json()['status'] == 'error'
+    assert main.player_state.state['volume'] == 20
+
+
+def test_total_delay_is_capped(client):
+    body = batch(client, *[{'route': 'volume', 'volume': 40, 'delay_ms': main.BATCH_MAX_DELAY_MS}] * 2)
+    assert body['status'] == 'error'
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+import main
+
+CONFIG = {'audio_backend': 'fake', 'key_injector': 'recording', 'rate_limit': {'enabled': False}}
+
+
+class FakeSocket:
+    # Hands out queued messages; receive(timeout=0) returns None when none are left
+    def __init__(self, messages):
+        self.messages = [json.dumps(message) for message in messages]
+        self.sent = []
+
+    def receive(self, timeout=None):
+        if self.messages:
+            return self.messages.pop(0)
+        if timeout == 0:
+            return None
+        raise ConnectionError('closed')
+
+    def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+def test_command_channel_writes_only_the_newest_queued_volume(app):
+    socket = FakeSocket([[n, 'volume', n * 10] for n in range(1, 6)] + [[6, 'mute', True]])
+    with app.test_request_context('/ws'):
+        with pytest.raises(ConnectionError):
+            main.command_channel(socket)
+    assert [reply[0] for reply in socket.sent] == [1, 2, 3, 4, 5, 6]
+    assert all(reply[1] == 1 for reply in socket.sent)
+    assert socket.sent[4][2]['volume'] == 50
+    assert main.audio_worker.backend.volume == 50
+    assert socket.sent[5][2]['muted'] is True
+
+
+def test_queued_messages_after_a_volume_are_still_handled(app):
+    socket = FakeSocket([[1, 'volume', 10], [2, 'volume', 'loud'], [3, 'volume', 20], 'not json'])
+    with app.test_request_context('/ws'):
+        with pytest.raises(ConnectionError):
+            main.command_channel(socket)
+    assert socket.sent == [
+        [1, 1, {**socket.sent[0][2], 'volume': 10}],
+        [2, 0, 'Invalid volume'],
+        [3, 1, {**socket.sent[2][2], 'volume': 20}],
+        [None, 0, 'Malformed message'],
+    ]
+
+
+def has_channel(app):
+    return any(rule.rule == '/ws' for rule in app.url_map.iter_rules())
+
+
+@pytest.mark.parametrize('mode, websocket, registered', [
+    ('production', True, False),
+    ('dev', True, True),
+    ('dev', False, False),
+])
+def test_channel_only_runs_where_it_can(app, tmp_path, caplog, mode, websocket, registered):
+    pytest.importorskip('flask_sock')
+    other = main.create_app({**CONFIG, 'server': {'mode': mode, 'websocket': websocket}}, log_dir=str(tmp_path))
+    try:
+        assert has_channel(other) is registered
+        assert (b'data-websocket="on"' in other.test_client().get('/').data) is registered
+        warned = any('/ws is off' in record.getMessage() for record in caplog.records)
+        assert warned is (websocket and not registered)
+    finally:
+        # Leave the session's app state in place for the other tests
+        main.create_app(CONFIG, log_dir=str(tmp_path / 'restored'))
+
+
+def test_channel_is_off_by_default():
+    assert main.default_config['server']['websocket'] is False
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import main
+
+
+def test_meter_frames_only_wake_meter_waiters():
+    hub = main.StreamHub()
+    woken = {}
+
+    def wait(name, meter_tick):
+        woken[name] = hub.wait(hub.tick, 0.3, meter_tick)
+
+    threads = [threading.Thread(target=wait, args=('quiet', None)),
+               threading.Thread(target=wait, args=('metered', hub.meter_tick))]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    hub.notify_meter()
+    for thread in threads:
+        thread.join()
+    assert woken == {'quiet': False, 'metered': True}
+
+
+def test_state_changes_wake_every_waiter():
+    hub = main.StreamHub()
+    tick = hub.tick
+    hub.notify()
+    assert hub.wait(tick, 0)
+    assert hub.wait(tick, 0, hub.meter_tick)
+
+
+def test_sampler_runs_only_while_subscribed(backend, worker):
+    meter = main.LevelMeter(worker)
+    seq = meter.subscribe()
+    deadline = time.monotonic() + 2
+    while meter.latest()[0] == seq:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    _, (peak, rms) = meter.latest()
+    assert 0 <= rms <= peak <= 255
+    meter.unsubscribe()
+    time.sleep(0.15)
+    samples = len(worker.called('get_peak'))
+    time.sleep(0.2)
+    assert len(worker.called('get_peak')) == samples
+
+
+def pull_in_thread(stream, chunks, stop):
+    # Pulls chunks off a stream until stop is set and something wakes it
+    def pull():
+        for chunk in stream:
+            if stop.is_set():
+                break
+            chunks.append(chunk)
+        stream.close()
+    thread = threading.Thread(target=pull, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_streams_without_the_meter_sleep_through_meter_frames(app, monkeypatch):
+    reads = []
+    current = main.player_state.current
+
+    def counted_current():
+        reads.append(threading.current_thread().name)
+        return current()
+    monkeypatch.setattr(main.player_state, 'current', counted_current)
+
+    stop = threading.Event()
+    quiet, metered = [], []
+    threads = [pull_in_thread(main.stream_events(meter=False), quiet, stop),
+               pull_in_thread(main.stream_events(meter=True), metered, stop)]
+    try:
+        time.sleep(0.6)
+        # Several meter frames went out, and each stream read the state once
+        assert sum(chunk.startswith('event: meter') for chunk in metered) >= 3
+        assert len(set(reads)) == 2
+        assert len(reads) == 2
+        assert not any(chunk.startswith('event: meter') for chunk in quiet)
+    finally:
+        stop.set()
+        main.stream_hub.notify()
+        for thread in threads:
+            thread.join(2)
+    assert not main.level_meter.subscribers
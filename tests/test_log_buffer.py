@@ -0,0 +1,42 @@
+import main
+
+
+def test_log_buffer_cursors():
+    buffer = main.LogBuffer(size=3)
+    assert buffer.since(0) == ([], 0)
+    for n in range(1, 3):
+        buffer.append({'message': f'line {n}'})
+    entries, last = buffer.since(0)
+    assert [e['message'] for e in entries] == ['line 1', 'line 2']
+    assert last == 2
+    assert [e['seq'] for e in buffer.since(1)[0]] == [2]
+    assert buffer.since(2) == ([], 2)
+
+
+def test_log_buffer_cursor_behind_the_ring_resumes_at_the_oldest_entry():
+    buffer = main.LogBuffer(size=3)
+    for n in range(1, 6):
+        buffer.append({'message': f'line {n}'})
+    entries, last = buffer.since(0)
+    assert [e['seq'] for e in entries] == [3, 4, 5]
+    assert last == 5
+    assert [e['seq'] for e in buffer.since(4)[0]] == [5]
+
+
+def test_every_reader_keeps_its_own_cursor():
+    buffer = main.LogBuffer(size=10)
+    buffer.append({'message': 'line 1'})
+    first, first_cursor = buffer.since(0)
+    buffer.append({'message': 'line 2'})
+    second, second_cursor = buffer.since(0)
+    # Reading does not consume: a slower reader still sees everything
+    assert [e['seq'] for e in first] == [1]
+    assert [e['seq'] for e in second] == [1, 2]
+    assert [e['seq'] for e in buffer.since(first_cursor)[0]] == [2]
+    assert buffer.since(second_cursor)[0] == []
+
+
+def test_append_wakes_event_streams():
+    tick = main.stream_hub.tick
+    main.LogBuffer().append({'message': 'line'})
+    assert main.stream_hub.wait(tick, 0)
@@ -0,0 +1,85 @@
+import itertools
+import logging
+
+import main
+
+
+def record(message, created, level=logging.INFO, client_ip='10.0.0.1'):
+    return logging.makeLogRecord({'msg': message, 'levelno': level, 'levelname': logging.getLevelName(level),
+                                  'created': created, 'client_ip': client_ip})
+
+
+def messages(records):
+    return [r.getMessage() for r in records]
+
+
+def test_repeats_collapse_into_one_summary():
+    dedup = main.LogDeduplicator(60)
+    assert messages(dedup.process(record('GET /get_volume', 100.0))) == ['GET /get_volume']
+    assert dedup.process(record('GET /get_volume', 101.0)) == []
+    assert dedup.process(record('GET /get_volume', 102.5)) == []
+    assert messages(dedup.process(record('POST /volume', 103.0))) == [
+        'GET /get_volume (repeated 2 more times over 2.5s)',
+        'POST /volume',
+    ]
+    assert dedup.collapsed == 2
+
+
+def test_summary_is_stamped_when_written():
+    dedup = main.LogDeduplicator(60)
+    dedup.process(record('GET /get_volume', 100.0))
+    dedup.process(record('GET /get_volume', 101.0))
+    summary = dedup.process(record('POST /volume', 110.0))[0]
+    assert summary.created == 110.0
+
+
+def test_clients_and_warnings_are_kept_apart():
+    dedup = main.LogDeduplicator(60)
+    dedup.process(record('GET /get_volume', 100.0, client_ip='10.0.0.1'))
+    assert len(dedup.process(record('GET /get_volume', 100.5, client_ip='10.0.0.2'))) == 1
+    assert len(dedup.process(record('Device lost', 101.0, level=logging.WARNING))) == 1
+    assert len(dedup.process(record('Device lost', 101.5, level=logging.WARNING))) == 1
+
+
+def test_expire_reports_long_runs_and_keeps_counting():
+    dedup = main.LogDeduplicator(60)
+    dedup.process(record('GET /get_volume', 100.0))
+    dedup.process(record('GET /get_volume', 130.0))
+    assert dedup.expire(150.0) == []
+    assert dedup.next_expiry() == 160.0
+    assert messages(dedup.expire(160.0)) == ['GET /get_volume (repeated 1 more times over 30.0s)']
+    # The run goes on from the summary
+    assert dedup.process(record('GET /get_volume', 170.0)) == []
+    assert messages(dedup.expire(0, everything=True)) == ['GET /get_volume (repeated 1 more times over 10.0s)']
+
+
+def test_expire_forgets_runs_without_repeats():
+    dedup = main.LogDeduplicator(60)
+    dedup.process(record('GET /get_volume', 100.0))
+    assert dedup.expire(200.0) == []
+    assert dedup.next_expiry() is None
+
+
+def test_zero_window_disables_deduplication():
+    dedup = main.LogDeduplicator(0)
+    dedup.process(record('GET /get_volume', 100.0))
+    assert len(dedup.process(record('GET /get_volume', 101.0))) == 1
+
+
+def test_evenly_sampled_keeps_the_given_fraction():
+    counter = itertools.count(1)
+    kept = [n for n in range(1, 101) if main.evenly_sampled(counter, 0.25)]
+    assert kept == list(range(4, 101, 4))
+
+
+def test_sampler_only_thins_info_lines_of_sampled_routes(app):
+    sampler = main.LogSampler({'/get_volume': 0.5})
+    with app.test_request_context('/get_volume'):
+        main.request.url_rule = next(r for r in app.url_map.iter_rules() if r.rule == '/get_volume')
+        kept = [sampler.filter(record('GET', 100.0)) for _ in range(10)]
+        assert kept.count(True) == 5
+        assert all(sampler.filter(record('bad', 100.0, level=logging.WARNING)) for _ in range(3))
+    with app.test_request_context('/mute'):
+        main.request.url_rule = next(r for r in app.url_map.iter_rules() if r.rule == '/mute')
+        assert all(sampler.filter(record('POST', 100.0)) for _ in range(3))
+    assert sampler.dropped == 5
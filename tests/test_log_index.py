@@ -0,0 +1,108 @@
+import logging
+import os
+import time
+
+import pytest
+
+import main
+
+
+def record(message, created, level=logging.INFO, client_ip='10.0.0.1'):
+    return logging.makeLogRecord({'msg': message, 'levelno': level, 'levelname': logging.getLevelName(level),
+                                  'created': created, 'client_ip': client_ip})
+
+
+@pytest.fixture
+def handler(tmp_path):
+    handler = main.IndexedRotatingFileHandler(str(tmp_path / 'access.log'), maxBytes=400, backupCount=3)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    yield handler
+    handler.close()
+
+
+def write(handler, count, start=1000.0):
+    for n in range(count):
+        handler.handle(record(f'line {n:03d} ✓', start + n, client_ip=f'10.0.0.{n % 3}'))
+    handler.flush_buffer()
+
+
+def lines(records):
+    return [r.decode().rstrip('\n') for r in records]
+
+
+def test_index_offsets_point_at_each_record(handler):
+    write(handler, 10)
+    with open(handler.baseFilename, 'rb') as f:
+        log = f.read()
+    with open(handler.baseFilename + '.idx', 'rb') as f:
+        index = f.read()
+    entries = list(handler.INDEX_ENTRY.iter_unpack(index))
+    assert len(entries) == 10
+    for n, (created, offset, levelno, _) in enumerate(entries):
+        assert created == 1000.0 + n
+        assert levelno == logging.INFO
+        assert log[offset:].startswith(f'line {n:03d}'.encode())
+
+
+def test_logs_and_indexes_rotate_together(handler):
+    write(handler, 60)
+    assert handler.rollovers > 0
+    for age in range(handler.backupCount + 1):
+        name = handler.backup_name(age)
+        if not os.path.exists(name):
+            continue
+        assert os.path.getsize(name) < 400
+        entries = os.path.getsize(name + '.idx') // handler.INDEX_ENTRY.size
+        with open(name, 'rb') as f:
+            assert entries == f.read().count(b'\n')
+
+
+def test_search_spans_backups_oldest_first(handler):
+    write(handler, 60)
+    found = lines(handler.search(1040.0, 1049.0))
+    assert found == [f'line {n:03d} ✓' for n in range(40, 50)]
+
+
+def test_search_filters_by_ip_level_and_limit(handler):
+    write(handler, 30)
+    handler.handle(record('device lost', 1030.0, level=logging.WARNING, client_ip='::1'))
+    handler.flush_buffer()
+    assert lines(handler.search(1000.0, 1100.0, ip='10.0.0.2', limit=3)) == [
+        'line 002 ✓', 'line 005 ✓', 'line 008 ✓']
+    assert lines(handler.search(0, float('inf'), min_level=logging.WARNING)) == ['device lost']
+    assert lines(handler.search(0, float('inf'), ip='::1')) == ['device lost']
+
+
+def test_multi_line_records_come_back_whole(handler):
+    handler.handle(record('Traceback\n  frame\nError', 1000.0))
+    handler.handle(record('next', 1001.0))
+    handler.flush_buffer()
+    assert lines(handler.search(0, float('inf'))) == ['Traceback\n  frame\nError', 'next']
+
+
+def test_reopening_continues_the_byte_count(handler, tmp_path):
+    write(handler, 5)
+    handler.close()
+    reopened = main.IndexedRotatingFileHandler(handler.baseFilename, maxBytes=400, backupCount=3)
+    reopened.setFormatter(logging.Formatter('%(message)s'))
+    try:
+        assert reopened.size == os.path.getsize(handler.baseFilename)
+        reopened.handle(record('after reopen', 2000.0))
+        reopened.flush_buffer()
+        assert lines(reopened.search(2000.0, 2000.0)) == ['after reopen']
+    finally:
+        reopened.close()
+
+
+def test_search_route_reads_the_app_logs(client):
+    main.app.logger.warning('search route marker')
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        response = client.get('/logs/search', query_string={'log': 'error', 'level': 'warning'})
+        if 'search route marker' in response.get_data(as_text=True):
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail('marker never reached the error log')
+    assert response.mimetype == 'text/plain'
+    assert client.get('/logs/search', query_string={'log': 'debug'}).get_json()['status'] == 'error'
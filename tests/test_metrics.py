@@ -0,0 +1,87 @@
+import threading
+
+import main
+
+
+def test_counters_and_gauges_render_with_labels():
+    registry = main.MetricsRegistry(prefix='test_')
+    requests = registry.counter('requests_total', 'Requests.', ('route',))
+    requests.labels('/volume').inc()
+    requests.labels('/volume').inc(2)
+    requests.labels('/mute').inc()
+    streams = registry.gauge('streams', 'Open streams.').labels()
+    streams.inc()
+    streams.inc()
+    streams.dec()
+    assert registry.render().splitlines() == [
+        '# HELP test_requests_total Requests.',
+        '# TYPE test_requests_total counter',
+        'test_requests_total{route="/mute"} 1',
+        'test_requests_total{route="/volume"} 3',
+        '# HELP test_streams Open streams.',
+        '# TYPE test_streams gauge',
+        'test_streams 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = main.MetricsRegistry(prefix='test_')
+    latency = registry.histogram('latency_seconds', 'Latency.', ('call',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.labels('get').observe(value)
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'test_latency_seconds_bucket{call="get",le="0.1"} 1',
+        'test_latency_seconds_bucket{call="get",le="1.0"} 3',
+        'test_latency_seconds_bucket{call="get",le="+Inf"} 4',
+        'test_latency_seconds_sum{call="get"} 4.05',
+        'test_latency_seconds_count{call="get"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = main.MetricsRegistry(prefix='test_')
+    registry.counter('errors_total', 'Errors.', ('node',)).labels('a"b\\c\nd').inc()
+    assert 'test_errors_total{node="a\\"b\\\\c\\nd"} 1' in registry.render()
+
+
+def test_callbacks_are_read_at_scrape_time():
+    registry = main.MetricsRegistry(prefix='test_')
+    depth = [3]
+    registry.callback('queue_depth', 'gauge', 'Queue depth.', lambda: depth[0])
+    assert registry.render().endswith('test_queue_depth 3\n')
+    depth[0] = 5
+    assert registry.render().endswith('test_queue_depth 5\n')
+
+
+def test_shards_from_many_threads_add_up():
+    registry = main.MetricsRegistry(prefix='test_')
+    counter = registry.counter('events_total', 'Events.').labels()
+
+    def work():
+        for _ in range(1000):
+            counter.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    assert counter.value() <= 8000
+    for thread in threads:
+        thread.join()
+    # Exited threads are folded into the retired totals and still count
+    assert counter.value() == 8000
+    assert counter.value() == 8000
+    assert not counter.shards
+
+
+def test_label_children_are_reused():
+    registry = main.MetricsRegistry(prefix='test_')
+    family = registry.counter('events_total', 'Events.', ('kind',))
+    assert family.labels('a') is family.labels('a')
+
+
+def test_metrics_route_reports_requests(client):
+    client.get('/get_volume')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'pywebplayback_http_requests_total{route="/get_volume",method="GET",status="200"}' in body
+    assert 'pywebplayback_backend_call_duration_seconds_count{backend="audio",call="get_volume"}' in body
@@ -0,0 +1,102 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import main
+
+
+class FakeNode(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Like a node whose keep-alive timeout ran out: the connection looks
+        # reusable to the client but is already closed
+        self.close_connection = self.server.drop_connections
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.posts.append((self.path, body))
+        time.sleep(self.server.delay)
+        self.reply(200, json.dumps({'status': 'success', **body}).encode())
+
+    def do_GET(self):
+        self.server.gets += 1
+        if self.headers.get('If-None-Match') == '"v1"':
+            return self.reply(304, headers=[('ETag', '"v1"')])
+        self.reply(200, b'{"status":"success","volume":40}', headers=[('ETag', '"v1"')])
+
+
+@pytest.fixture
+def node():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeNode)
+    server.daemon_threads = True
+    server.posts = []
+    server.gets = 0
+    server.delay = 0
+    server.drop_connections = False
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client_for(node, timeout=1.0):
+    return main.NodeClient('node', f'http://127.0.0.1:{node.server_address[1]}', timeout, pool_size=2)
+
+
+def test_connections_are_reused(node):
+    client = client_for(node)
+    client.command('volume', {'volume': 10})
+    connection = client.idle.queue[-1]
+    client.command('volume', {'volume': 20})
+    assert client.idle.queue[-1] is connection
+    assert [body['volume'] for _, body in node.posts] == [10, 20]
+
+
+def test_a_dropped_idle_connection_is_retried_once(node):
+    node.drop_connections = True
+    client = client_for(node)
+    assert client.command('volume', {'volume': 10})['volume'] == 10
+    time.sleep(0.05)
+    assert client.command('volume', {'volume': 20})['volume'] == 20
+    # The retry went out on a fresh connection and the node saw each command once
+    assert [body['volume'] for _, body in node.posts] == [10, 20]
+
+
+def test_a_timeout_is_not_retried(node):
+    node.delay = 0.3
+    client = client_for(node, timeout=0.1)
+    with pytest.raises(socket.timeout):
+        client.command('mute', {'muted': True})
+    time.sleep(0.4)
+    assert node.posts == [('/mute', {'muted': True})]
+
+
+def test_a_failed_fresh_connection_is_not_retried():
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+    client = main.NodeClient('node', f'http://127.0.0.1:{port}', 1.0, pool_size=2)
+    with pytest.raises(ConnectionRefusedError):
+        client.command('volume', {'volume': 10})
+
+
+def test_state_revalidates_with_the_etag(node):
+    client = client_for(node)
+    assert client.state()['volume'] == 40
+    assert client.state()['volume'] == 40
+    assert node.gets == 2
+    assert client.cached[0] == '"v1"'
@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+import main
+
+
+def wait_for_state(client):
+    # The backend's first reading arrives from a startup thread
+    deadline = time.monotonic() + 2
+    response = client.get('/get_volume')
+    while response.headers.get('ETag') is None:
+        assert time.monotonic() < deadline, 'no player state'
+        time.sleep(0.01)
+        response = client.get('/get_volume')
+    return response
+
+
+def test_unchanged_state_is_a_304(client):
+    first = wait_for_state(client)
+    etag = first.headers['ETag']
+    again = client.get('/get_volume', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == etag
+    assert again.headers['Cache-Control'] == 'no-cache'
+
+
+def test_a_change_gives_a_new_etag_and_body(client):
+    etag = wait_for_state(client).headers['ETag']
+    client.post('/volume', json={'volume': 33})
+    response = client.get('/get_volume', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['volume'] == 33
+
+
+def test_etags_include_the_process_epoch(worker):
+    first, second = main.PlayerState(worker), main.PlayerState(worker)
+    assert first.snapshot()[0] != second.snapshot()[0]
+
+
+def test_state_only_versions_real_changes(worker):
+    state = main.PlayerState(worker)
+    state.update(volume=40)
+    version = state.version
+    state.update(volume=40)
+    assert state.version == version
+    state.update(volume=41)
+    assert state.version == version + 1
+
+
+def test_playpause_toggles_playing(worker):
+    state = main.PlayerState(worker)
+    state.record_playback('playpause')
+    assert state.state['playing'] is True
+    state.record_playback('next')
+    assert state.state == {**state.state, 'playing': True, 'last_action': 'next'}
+    state.record_playback('playpause')
+    assert state.state['playing'] is False
+
+
+@pytest.mark.parametrize('muted', ['false', 'no', 0, 1])
+def test_mute_rejects_non_booleans(client, muted):
+    client.post('/mute', json={'muted': False})
+    assert client.post('/mute', json={'muted': muted}).get_json()['status'] == 'error'
+    assert main.player_state.state['muted'] is False
+
+
+def test_mute_sets_and_toggles(client):
+    assert client.post('/mute', json={'muted': True}).get_json()['muted'] is True
+    assert client.post('/mute', json={}).get_json()['muted'] is False
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+import main
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+
+@pytest.mark.parametrize('curve', main.VolumeRamp.CURVES)
+def test_ramp_values_end_on_target(curve):
+    assert main.ramp_value(20, 80, 0, curve) == pytest.approx(20)
+    assert main.ramp_value(20, 80, 1, curve) == 80
+    assert main.ramp_value(40, 0, 1, curve) == 0
+
+
+def test_linear_and_logarithmic_curves_differ():
+    assert main.ramp_value(0, 100, 0.5, 'linear') == 50
+    # Equal decibel steps stay quiet for longer on the way up
+    assert main.ramp_value(1, 100, 0.5, 'logarithmic') == pytest.approx(10)
+
+
+def test_zero_duration_ramp_finishes_at_once():
+    assert main.VolumeRamp(10, 90, 0, 'linear').value(time.monotonic()) == (90, True)
+
+
+@pytest.fixture
+def ramper(worker):
+    return main.VolumeRamper(worker, main.PlayerState(worker))
+
+
+def test_ramp_runs_to_target(backend, worker, ramper):
+    ramper.start(60, 0.1, 'linear')
+    wait_until(lambda: ramper.ramp is None)
+    assert backend.volume == 60
+    assert ramper.state.state['volume'] == 60
+    volumes = [call[0] for call in worker.called('set_volume')]
+    assert volumes == sorted(volumes)
+
+
+def test_retarget_starts_from_where_the_ramp_got_to(backend, ramper):
+    ramper.start(0, 10, 'linear')
+    wait_until(lambda: backend.volume < 49)
+    ramp = ramper.start(100, 0.1, 'linear')
+    assert ramp.start < 50
+    wait_until(lambda: ramper.ramp is None)
+    assert backend.volume == 100
+
+
+def test_cancel_stops_the_ramp_where_it_is(backend, worker, ramper):
+    ramper.start(0, 10, 'linear')
+    wait_until(lambda: backend.volume < 49)
+    assert ramper.cancel()
+    stopped = backend.volume
+    writes = len(worker.called('set_volume'))
+    time.sleep(0.1)
+    assert backend.volume == stopped
+    assert len(worker.called('set_volume')) == writes
+    assert not ramper.cancel()
+
+
+def test_ramp_route_answers_before_the_fade_ends(client):
+    client.post('/volume', json={'volume': 0})
+    started = time.monotonic()
+    body = client.post('/volume/ramp', json={'target': 80, 'duration_ms': 300}).get_json()
+    assert time.monotonic() - started < 0.2
+    assert body['ramp'] == {'from': 0, 'target': 80, 'duration_ms': 300, 'curve': 'linear'}
+    wait_until(lambda: main.volume_ramper.ramp is None)
+    assert main.player_state.state['volume'] == 80
+
+
+def test_setting_the_volume_cancels_a_ramp(client):
+    client.post('/volume', json={'volume': 0})
+    client.post('/volume/ramp', json={'target': 100, 'duration_ms': 5000})
+    client.post('/volume', json={'volume': 25})
+    assert main.volume_ramper.ramp is None
+    time.sleep(0.05)
+    assert main.player_state.state['volume'] == 25
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+import main
+
+
+def test_bucket_allows_a_burst_then_refills():
+    limiter = main.RateLimiter(rate=20, burst=3, max_concurrent=10, max_per_client=10)
+    for _ in range(3):
+        assert limiter.acquire('a') is None
+        limiter.release('a')
+    reason, retry_after = limiter.acquire('a')
+    assert reason == 'rate'
+    assert 0 < retry_after <= 0.05
+    # Other clients have their own bucket
+    assert limiter.acquire('b') is None
+    limiter.release('b')
+    time.sleep(0.06)
+    assert limiter.acquire('a') is None
+
+
+def test_cost_takes_several_tokens_but_never_more_than_the_burst():
+    limiter = main.RateLimiter(rate=1, burst=5, max_concurrent=10, max_per_client=10)
+    assert limiter.acquire('a', cost=4) is None
+    limiter.release('a')
+    assert limiter.acquire('a', cost=2)[0] == 'rate'
+    fresh = main.RateLimiter(rate=1, burst=5, max_concurrent=10, max_per_client=10)
+    assert fresh.acquire('a', cost=50) is None
+
+
+def test_concurrency_caps_are_global_and_per_client():
+    limiter = main.RateLimiter(rate=100, burst=100, max_concurrent=3, max_per_client=2)
+    assert limiter.acquire('a') is None
+    assert limiter.acquire('a') is None
+    assert limiter.acquire('a') == ('client_concurrency', limiter.CONCURRENCY_RETRY_AFTER)
+    assert limiter.acquire('b') is None
+    assert limiter.acquire('c') == ('concurrency', limiter.CONCURRENCY_RETRY_AFTER)
+    limiter.release('a')
+    assert limiter.acquire('c') is None
+    assert limiter.client_in_flight == {'a': 1, 'b': 1, 'c': 1}
+    for client in 'abc':
+        limiter.release(client)
+    assert limiter.in_flight == 0
+    assert limiter.client_in_flight == {}
+
+
+def test_suspended_requests_free_their_shared_slot():
+    limiter = main.RateLimiter(rate=100, burst=100, max_concurrent=1, max_per_client=1)
+    assert limiter.acquire('a') is None
+    limiter.suspend()
+    assert limiter.acquire('b') is None
+    # Still counted against its client while asleep
+    assert limiter.acquire('a')[0] == 'client_concurrency'
+
+    resumed = threading.Event()
+
+    def resume():
+        limiter.resume()
+        resumed.set()
+    thread = threading.Thread(target=resume)
+    thread.start()
+    assert not resumed.wait(0.05)
+    limiter.release('b')
+    assert resumed.wait(1)
+    thread.join()
+    assert limiter.in_flight == 1
+    limiter.release('a')
+    assert limiter.in_flight == 0
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = main.RateLimiter(rate=100, burst=60, max_concurrent=2, max_per_client=2)
+    monkeypatch.setattr(main, 'rate_limiter', limiter)
+    return limiter
+
+
+def post(app, client_ip, route, body):
+    with app.test_client() as client:
+        return client.post(route, json=body, environ_base={'REMOTE_ADDR': client_ip})
+
+
+def test_delayed_batches_do_not_lock_other_clients_out(app, limiter):
+    batch = {'actions': [{'route': 'volume', 'volume': 30, 'delay_ms': 300}]}
+    sleepers = [threading.Thread(target=post, args=(app, '10.0.0.1', '/batch', batch)) for _ in range(2)]
+    for thread in sleepers:
+        thread.start()
+    deadline = time.monotonic() + 1
+    while limiter.client_in_flight.get('10.0.0.1') != 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+    # The sleeping client is at its own cap; everyone else still gets through
+    response = post(app, '10.0.0.1', '/batch', batch)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    assert post(app, '10.0.0.2', '/volume', {'volume': 40}).get_json()['status'] == 'success'
+    for thread in sleepers:
+        thread.join()
+    assert limiter.in_flight == 0
+
+
+def test_rate_limited_routes_answer_429(app, monkeypatch):
+    monkeypatch.setattr(main, 'rate_limiter', main.RateLimiter(rate=0.1, burst=1, max_concurrent=2, max_per_client=2))
+    assert post(app, '10.0.0.3', '/mute', {'muted': False}).status_code == 200
+    response = post(app, '10.0.0.3', '/mute', {'muted': False})
+    assert response.status_code == 429
+    assert response.get_json() == {'status': 'error', 'message': 'Too many requests'}
+    assert int(response.headers['Retry-After']) >= 1
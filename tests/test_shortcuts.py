@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+import main
+
+CTRL, ALT, L = 0x11, 0x12, ord('L')
+
+
+def test_compile_keys_presses_in_order_and_releases_in_reverse():
+    assert main.compile_keys('lock', ['ctrl', 'alt', 'l']) == (
+        (CTRL, False), (ALT, False), (L, False),
+        (L, True), (ALT, True), (CTRL, True),
+    )
+
+
+def test_compile_keys_is_case_insensitive():
+    assert main.compile_keys('lock', ['Ctrl', 'ALT', 'L']) == main.compile_keys('lock', ['ctrl', 'alt', 'l'])
+
+
+@pytest.mark.parametrize('keys', [[], 'ctrl', None, ['ctrl', 'hyper']])
+def test_compile_keys_rejects_bad_definitions(keys):
+    with pytest.raises(ValueError):
+        main.compile_keys('bad', keys)
+
+
+def test_compile_shortcuts_labels():
+    compiled = main.compile_shortcuts({
+        'lock': ['ctrl', 'alt', 'l'],
+        'quit': {'keys': ['alt', 'q'], 'label': 'Close'},
+    })
+    assert compiled['lock'][0] == 'Ctrl+Alt+L'
+    assert compiled['quit'] == ('Close', ((ALT, False), (ord('Q'), False), (ord('Q'), True), (ALT, True)))
+
+
+def test_shortcut_table_sends_compiled_events():
+    injector = main.RecordingKeyInjector()
+    table = main.ShortcutTable(injector, {'lock': ['ctrl', 'alt', 'l']})
+    table.send('lock')
+    assert [events for _, events in injector.sent] == [main.compile_keys('lock', ['ctrl', 'alt', 'l'])]
+
+
+def test_shortcut_table_rejects_unknown_names():
+    injector = main.RecordingKeyInjector()
+    table = main.ShortcutTable(injector, {})
+    with pytest.raises(ValueError):
+        table.send('missing')
+    assert not injector.sent
+
+
+def test_concurrent_shortcuts_never_interleave():
+    injector = main.RecordingKeyInjector()
+    table = main.ShortcutTable(injector, {
+        'lock': ['ctrl', 'alt', 'l'],
+        'quit': ['alt', 'q'],
+        'one': ['alt', '1'],
+    })
+
+    def press(name):
+        for _ in range(50):
+            table.send(name)
+
+    threads = [threading.Thread(target=press, args=(name,)) for name in table.prepared]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(injector.sent) == 150
+    for _, events in injector.sent:
+        # Every injection is one whole shortcut: each press is released, innermost first
+        held = []
+        for code, key_up in events:
+            if key_up:
+                assert held.pop() == code
+            else:
+                held.append(code)
+        assert not held
+
+
+def test_unknown_names_are_reported_by_kind(client):
+    assert client.post('/playback', json={'action': 'bogus'}).get_json()['message'] == 'Unknown playback action: bogus'
+    assert client.post('/shortcut', json={'shortcut': 'bogus'}).get_json()['message'] == 'Unknown shortcut: bogus'
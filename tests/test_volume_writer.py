@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+import main
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+
+def test_writes_during_a_write_are_coalesced(backend, worker):
+    writer = main.VolumeWriter(worker)
+    backend.gate = threading.Event()
+    batches = {}
+
+    def submit(volume):
+        batches[volume] = writer.submit(volume)
+
+    first = threading.Thread(target=submit, args=(10,))
+    first.start()
+    wait_until(lambda: worker.called('set_volume'))
+
+    # The first write is held at the device; the next three share one batch
+    followers = []
+    for volume in (20, 30, 40):
+        thread = threading.Thread(target=submit, args=(volume,))
+        thread.start()
+        followers.append(thread)
+        wait_until(lambda: writer.pending is not None and writer.pending.target == volume)
+    backend.gate.set()
+    for thread in [first] + followers:
+        thread.join()
+
+    assert worker.called('set_volume') == [(10,), (40,)]
+    assert batches[10].applied == 10
+    assert batches[20] is batches[30] is batches[40]
+    assert batches[40].applied == 40
+    assert batches[40].requests == 3
+
+
+def test_stale_sequence_numbers_are_rejected(worker):
+    writer = main.VolumeWriter(worker)
+    assert writer.submit(50, 'phone', 2).applied == 50
+    assert writer.submit(60, 'phone', 1) is None
+    assert writer.submit(60, 'phone', 2) is None
+    assert writer.submit(70, 'tablet', 1).applied == 70
+    assert writer.submit(80, 'phone', 3).applied == 80
+
+
+def test_writer_reports_backend_errors(worker):
+    writer = main.VolumeWriter(worker)
+    worker.backend.set_volume = None
+    batch = writer.submit(30)
+    assert batch.applied is None
+    assert isinstance(batch.error, TypeError)
+
+
+def test_volume_rejects_non_numbers(client):
+    response = client.post('/volume', json={'volume': '40'})
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'error'
+
+
+def test_volume_rejects_stale_writes(client):
+    assert client.post('/volume', json={'volume': 30, 'client': 'routes', 'seq': 5}).get_json()['status'] == 'success'
+    body = client.post('/volume', json={'volume': 90, 'client': 'routes', 'seq': 4}).get_json()
+    assert body['status'] == 'stale'
+    assert body['volume'] == 30
+
+
+@pytest.mark.parametrize('volume', ['NaN', 'Infinity', '-Infinity'])
+def test_volume_rejects_non_finite_numbers(client, volume):
+    client.post('/volume', json={'volume': 20})
+    response = client.post('/volume', data=f'{{"volume": {volume}}}', content_type='application/json')
+    assert response.get_json()['status'] == 'error'
+    assert main.player_state.state['volume'] == 20
+
+
+@pytest.mark.parametrize('target', ['true', 'NaN', '"50"'])
+def test_ramp_rejects_targets_that_are_not_numbers(client, target):
+    response = client.post('/volume/ramp', data=f'{{"target": {target}}}', content_type='application/json')
+    assert response.get_json()['status'] == 'error'
+    assert main.volume_ramper.ramp is None